@@ -1,8 +1,12 @@
 import logging
+import os
 import shlex
 import subprocess
 from typing import Any, Callable, List
 
+from abackup import spans
+from abackup.usage import run_with_usage
+
 
 class Command:
     def __init__(
@@ -41,25 +45,30 @@ class Command:
 
     def _run_with_result(self, command: str, log: logging.Logger):
         log.debug("Command::_run({}, {}):".format(command, self.output_path))
-        if self.capture_output:
-            with open(self.output_path, "wb") as output:
-                run_result = subprocess.run(
-                    shlex.split(command),
+        args = shlex.split(command)
+        program = os.path.basename(args[0]) if args else None
+        with spans.span("command", program, command=self.friendly_str()[:120]) as command_span:
+            if self.capture_output:
+                with open(self.output_path, "wb") as output:
+                    run_result = run_with_usage(
+                        args,
+                        input=self.encoded_input(),
+                        stdout=output,
+                        stderr=subprocess.PIPE,
+                        universal_newlines=self.universal_newlines,
+                    )
+            else:
+                run_result = run_with_usage(
+                    args,
                     input=self.encoded_input(),
-                    check=False,
-                    stdout=output,
+                    stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
                     universal_newlines=self.universal_newlines,
                 )
-        else:
-            run_result = subprocess.run(
-                shlex.split(command),
-                input=self.encoded_input(),
-                check=False,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=self.universal_newlines,
-            )
+            command_span.ok = run_result.returncode == 0
+            command_span.set(returncode=run_result.returncode)
+            command_span.add_usage(run_result.usage)
+        log.info("Command {}: {}".format(program, run_result.usage))
         if run_result.returncode != 0:
             log.critical("COMMAND FAILED: {}".format(command))
             if self.universal_newlines:
@@ -4,11 +4,14 @@ from crontab import CronTab
 
 
 class AppJob:
-    def __init__(self, command: str, app: str, comment: str, project: str = None):
+    """A scheduled job of an app, command is written to the crontab or run by abackup-scheduler at frequency"""
+
+    def __init__(self, command: str, app: str, comment: str, project: str = None, frequency: str = None):
         self.command = command
         self.app = app
         self.project = project
         self.comment = comment
+        self.frequency = frequency
         self.cron_job = None
 
     @classmethod
@@ -35,21 +38,24 @@ class AppCronTab:
         return [job for job in self.cron if job.comment.startswith(AppJob.comment_prefix(self.app, project))]
 
     def job(self, command: str, comment: str, frequency: str = None, project: str = None):
-        app_job = AppJob(command, self.app, comment, project)
+        return self.add(AppJob(command, self.app, comment, project, frequency))
+
+    def add(self, app_job: AppJob):
+        """Add or update the crontab entry of app_job"""
         job = next(self.cron.find_comment(app_job.cron_comment), None)
         if job:
             if self.log:
                 self.log.info("found cron job for {} and clearing".format(app_job.comment))
             job.clear()
-            job.command = command
+            job.command = app_job.command
         else:
             if self.log:
                 self.log.info("creating new cron job for " + app_job.comment)
             job = self.cron.new(command=app_job.command, comment=app_job.cron_comment)
-        if frequency:
-            job.setall(frequency)
+        if app_job.frequency:
+            job.setall(app_job.frequency)
             if self.log:
-                self.log.info("set job with frequency: {}".format(frequency))
+                self.log.info("set job with frequency: {}".format(app_job.frequency))
         if self.log:
             self.log.debug(job)
         app_job.cron_job = job
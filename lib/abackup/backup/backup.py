@@ -1,14 +1,16 @@
 import datetime
 import logging
 import os
+import time
 
 from inspect import Traceback, currentframe, getframeinfo
 import shutil
 from typing import List
 
-from abackup import fs, healthchecks as hc, notifications
+from abackup import fs, healthchecks as hc, notifications, spans
 from abackup.backup import Config
 from abackup.backup.project import Container
+from abackup.metrics import add_job_metrics
 
 
 def get_backups(
@@ -137,66 +139,97 @@ def perform_backup(
     do_healthchecks: bool = True,
 ):
     success = True
-    for container in containers:
-        log.info(container.name)
-        if not container.backup:
-            log.info("skipping {}, no backup settings defined".format(container.name))
-            continue
+    with spans.span("backup", project_name) as backup_span:
+        for container in containers:
+            log.info(container.name)
+            if not container.backup:
+                log.info("skipping {}, no backup settings defined".format(container.name))
+                continue
+            with spans.span("container", container.name) as container_span:
+                container_span.ok = backup_container(config, project_name, container, notify_mode, log, do_healthchecks)
+            success = success and container_span.ok
+        backup_span.ok = success
+
+    return success
 
-        if do_healthchecks and container.backup.healthchecks:
-            hc.perform_healthcheck_start(
-                config.default_healthcheck,
-                container.backup.healthchecks,
-                container.name,
-                config.notifier,
-                notify_mode,
-                log,
-            )
 
-        successful_commands = []
-        failed_commands = []
-        backup_path = config.ensure_backup_path(project_name, container.name)
-        skip_backup = False
+def backup_container(
+    config: Config,
+    project_name: str,
+    container: Container,
+    notify_mode: notifications.Mode,
+    log: logging.Logger,
+    do_healthchecks: bool = True,
+):
+    started = time.monotonic()
+    healthcheck_run = None
+    if do_healthchecks and container.backup.healthchecks:
+        healthcheck_run = hc.perform_healthcheck_start(
+            config.default_healthcheck,
+            container.backup.healthchecks,
+            container.name,
+            config.notifier,
+            notify_mode,
+            log,
+        )
+
+    successful_commands = []
+    failed_commands = []
+    backup_bytes = 0
+    backup_path = config.ensure_backup_path(project_name, container.name)
+    skip_backup = False
+    with spans.span("pre_commands") as phase_span:
         for command in container.backup.pre_commands:
             if command.run(log):
                 successful_commands.append(command.command_string)
             else:
                 log.error("failed running pre command, skipping container: {}".format(container.name))
                 skip_backup = True
+                phase_span.ok = False
                 failed_commands.append(command.command_string)
                 break
 
-        if not skip_backup:
-            for command in container.build_database_backup_commands(backup_path):
+    def finish_backup_file(command):
+        if config.file_permissions:
+            with spans.span("chmod"):
+                os.chmod(command.backup_file_path, config.file_permissions)
+        size = os.path.getsize(command.backup_file_path)
+        with spans.span("retention"):
+            remove_backup(container.backup.version_count, backup_path, command.file_prefix, command.file_extension, log)
+        return size
+
+    if not skip_backup:
+        for command in container.build_database_backup_commands(backup_path):
+            with spans.span("database_backup", command.name) as phase_span:
                 if command.run(log):
-                    os.chmod(command.backup_file_path, config.file_permissions)
-                    remove_backup(
-                        container.backup.version_count, backup_path, command.file_prefix, command.file_extension, log
-                    )
+                    backup_bytes += finish_backup_file(command)
                     successful_commands.append(command.friendly_str())
                 else:
                     log.error("failed running database backup for {}".format(command.name))
+                    phase_span.ok = False
                     failed_commands.append(command.friendly_str())
-            for command in container.build_directory_backup_commands(backup_path):
+        for command in container.build_directory_backup_commands(backup_path):
+            with spans.span("directory_backup", command.directory) as phase_span:
                 if command.run(log):
-                    os.chmod(command.backup_file_path, config.file_permissions)
-                    remove_backup(
-                        container.backup.version_count, backup_path, command.file_prefix, command.file_extension, log
-                    )
+                    backup_bytes += finish_backup_file(command)
                     successful_commands.append(command.friendly_str())
                 else:
                     log.error("failed running directory backup for {}".format(command.directory))
+                    phase_span.ok = False
                     failed_commands.append(command.friendly_str())
+        with spans.span("post_commands") as phase_span:
             for command in container.backup.post_commands:
                 if command.run(log):
                     successful_commands.append(command.command_string)
                 else:
                     log.error("failed running post command")
+                    phase_span.ok = False
                     failed_commands.append(command.command_string)
                     break
 
-        backup_failed = len(failed_commands) > 0
+    backup_failed = len(failed_commands) > 0
 
+    with spans.span("notify"):
         notify_or_log(
             config.notifier,
             container.name,
@@ -207,7 +240,8 @@ def perform_backup(
             getframeinfo(currentframe()),
         )
 
-        if do_healthchecks and container.backup.healthchecks:
+    if do_healthchecks and container.backup.healthchecks:
+        with spans.span("healthcheck"):
             hc.perform_healthcheck(
                 config.default_healthcheck,
                 container.backup.healthchecks,
@@ -217,11 +251,25 @@ def perform_backup(
                 log,
                 is_fail=backup_failed,
                 message="Failed commands: {}".format("\n".join(failed_commands)) if failed_commands else None,
+                run=healthcheck_run,
             )
 
-        success = success and not backup_failed
+    metrics_file = config.metrics_file("abackup_backup_{}_{}".format(project_name, container.name))
+    if metrics_file:
+        labels = {"project": project_name, "container": container.name}
+        add_job_metrics(
+            metrics_file,
+            "abackup_backup",
+            labels,
+            not backup_failed,
+            time.monotonic() - started,
+            backup_bytes,
+            spans.current_usage(),
+        )
+        metrics_file.add("abackup_backup_failed_commands", len(failed_commands), labels)
+        metrics_file.write()
 
-    return success
+    return not backup_failed
 
 
 def perform_get_backups(
@@ -2,39 +2,55 @@ import logging
 
 from typing import List
 
+from abackup import spans
 from abackup.backup import Config
 from abackup.backup.project import Container
 
 
-def perform_restore(config: Config, project_name: str, containers: List[Container], log: logging.Logger):
+def restore_container(config: Config, project_name: str, container: Container, log: logging.Logger):
     success = True
-    for container in containers:
-        log.info(container.name)
-        if not container.restore:
-            log.info("skipping {}, no restore settings defined".format(container.name))
-            continue
-        backup_path = config.ensure_backup_path(project_name, container.name)
-        skip_restore = False
+    backup_path = config.ensure_backup_path(project_name, container.name)
+    with spans.span("pre_commands") as phase_span:
         for command in container.restore.pre_commands:
             if not command.run(log):
                 log.error("failed running pre command, skipping container: {}".format(container.name))
-                skip_restore = True
+                phase_span.ok = False
+                return False
+
+    for command in container.build_database_restore_commands(backup_path):
+        with spans.span("database_restore", command.name) as phase_span:
+            if not command.run(log):
+                log.error("failed running database restore for {}".format(command.name))
+                phase_span.ok = False
+                success = False
+    for command in container.build_directory_restore_commands(backup_path):
+        with spans.span("directory_restore", command.directory) as phase_span:
+            if not command.run(log):
+                log.error("failed running directory restore for {}".format(command.directory))
+                phase_span.ok = False
+                success = False
+    with spans.span("post_commands") as phase_span:
+        for command in container.restore.post_commands:
+            if not command.run(log):
+                log.error("failed running post command")
+                phase_span.ok = False
                 success = False
                 break
 
-        if not skip_restore:
-            for command in container.build_database_restore_commands(backup_path):
-                if not command.run(log):
-                    log.error("failed running database restore for {}".format(command.name))
-                    success = False
-            for command in container.build_directory_restore_commands(backup_path):
-                if not command.run(log):
-                    log.error("failed running directory restore for {}".format(command.directory))
-                    success = False
-            for command in container.restore.post_commands:
-                if not command.run(log):
-                    log.error("failed running post command")
-                    success = False
-                    break
+    return success
+
+
+def perform_restore(config: Config, project_name: str, containers: List[Container], log: logging.Logger):
+    success = True
+    with spans.span("restore", project_name) as restore_span:
+        for container in containers:
+            log.info(container.name)
+            if not container.restore:
+                log.info("skipping {}, no restore settings defined".format(container.name))
+                continue
+            with spans.span("container", container.name) as container_span:
+                container_span.ok = restore_container(config, project_name, container, log)
+            success = success and container_span.ok
+        restore_span.ok = success
 
     return success
@@ -3,19 +3,19 @@ import os
 
 from typing import List
 
-from abackup.appcron import AppCronTab
+from abackup.appcron import AppCronTab, AppJob
 from abackup.backup.project import Container, ProjectConfig
 
 
-def perform_update_cron(
+def auto_backup_jobs(
     project_name: str,
     project_config: ProjectConfig,
     containers: List[Container],
     abackup_options: str,
-    cron: AppCronTab,
     log: logging.Logger,
 ):
-    do_write_cron = True
+    """The jobs of the auto_backups of containers"""
+    jobs = []
     for container in containers:
         log.info(container.name)
         if not container.backup or not container.backup.auto_backups:
@@ -32,15 +32,32 @@ def perform_update_cron(
             )
             comment = "{}".format(container.name)
             log.debug("command: {}, comment: {}".format(command, comment))
-            job = cron.job(
-                command,
-                comment,
-                frequency=auto_backup.frequency if auto_backup.frequency else "0 0 * * *",
-                project=project_name,
+            jobs.append(
+                AppJob(
+                    command,
+                    "abackup",
+                    comment,
+                    project=project_name,
+                    frequency=auto_backup.frequency if auto_backup.frequency else "0 0 * * *",
+                )
             )
-            if not job.is_valid():
-                log.error("job not valid! {}".format(comment))
-                do_write_cron = False
+    return jobs
+
+
+def perform_update_cron(
+    project_name: str,
+    project_config: ProjectConfig,
+    containers: List[Container],
+    abackup_options: str,
+    cron: AppCronTab,
+    log: logging.Logger,
+):
+    do_write_cron = True
+    for app_job in auto_backup_jobs(project_name, project_config, containers, abackup_options, log):
+        job = cron.add(app_job)
+        if not job.is_valid():
+            log.error("job not valid! {}".format(app_job.comment))
+            do_write_cron = False
 
     if do_write_cron:
         cron.write()
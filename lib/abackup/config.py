@@ -5,7 +5,9 @@ import yaml
 
 from logging.handlers import RotatingFileHandler
 
-from abackup import healthchecks as hc, notifications
+from abackup import healthchecks as hc, notifications, spans
+from abackup.metrics import MetricsFile
+from abackup.outbox import Outbox
 
 
 def setup_logger(name: str, log_path: str = None, level=logging.INFO):
@@ -17,14 +19,27 @@ def setup_logger(name: str, log_path: str = None, level=logging.INFO):
     handler.setFormatter(formatter)
     log = logging.getLogger(name)
     log.setLevel(level)
+    # a config loaded again in the same process, e.g. by abackup-scheduler, replaces its handler instead of adding one
+    for old_handler in list(log.handlers):
+        log.removeHandler(old_handler)
+        old_handler.close()
     log.addHandler(handler)
     return log
 
 
 class BaseConfig:
-    def __init__(self, app: str, config_dir: str, no_log: bool, debug: bool, log_dir_name: str = None):
+    def __init__(
+        self,
+        app: str,
+        config_dir: str,
+        no_log: bool,
+        debug: bool,
+        log_dir_name: str = None,
+        start_background: bool = True,
+    ):
         self.log_root = os.path.join(config_dir, "logs", log_dir_name if log_dir_name else app)
         self.notifier = None
+        self.metrics_dir = None
         self.default_healthcheck = hc.Healthcheck(
             "https://hc-ping.com",
             do_include_messages=True,
@@ -41,6 +56,8 @@ class BaseConfig:
             if "notifications" in self._raw:
                 if "slack" in self._raw["notifications"]:  # TODO extend to others
                     self.notifier = notifications.SlackNotifier(**self._raw["notifications"]["slack"])
+            if "metrics" in self._raw and "textfile_dir" in self._raw["metrics"]:
+                self.metrics_dir = os.path.expanduser(self._raw["metrics"]["textfile_dir"])
             if "healthchecks" in self._raw:
                 if "default" in self._raw["healthchecks"]:
                     self.default_healthcheck = hc.Healthcheck(
@@ -59,6 +76,29 @@ class BaseConfig:
         if self.log_path:
             self._ensure_log_dir()
         self.log = setup_logger(app, self.log_path, logging.DEBUG if debug else logging.INFO)
+        self.spans_path = os.path.join(self.log_root, "spans.jsonl")
+        self.outbox = Outbox(os.path.join(self.log_root, "outbox.jsonl"))
+        if self.notifier:
+            self.notifier.outbox = self.outbox
+        # without it the config is only read, e.g. by abackup-scheduler for the jobs it schedules, which would otherwise
+        # start another set of dispatcher threads and drain the outbox on every reload
+        if start_background:
+            self._start_background()
+
+    def _start_background(self):
+        """Record spans, send notifications and healthchecks in the background and retry the ones in the outbox"""
+        if self.log_path:
+            spans.start_recording(self.spans_path)
+        if self.notifier:
+            self.notifier.start_dispatcher(self.log)
+        # started after the slack one, so it is flushed first at exit and its errors can still be sent to slack
+        hc.start_dispatcher(self.log, outbox=self.outbox)
+        if os.path.exists(self.outbox.path):
+            hc.drain_outbox(self.outbox, self.notifier, self.log)
+
+    def metrics_file(self, job: str):
+        """The node_exporter textfile of job, None when no metrics textfile_dir is configured"""
+        return MetricsFile(self.metrics_dir, job) if self.metrics_dir else None
 
     def _ensure_log_dir(self):
         if not os.path.isdir(self.log_root):
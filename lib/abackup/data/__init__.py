@@ -1,3 +1,4 @@
+import datetime
 import os
 import yaml
 
@@ -12,12 +13,96 @@ class AutoCheck:
         self.notify = notifications.Mode(notify) if notify else notifications.Mode.AUTO
 
 
+class Capacity:
+    def __init__(self, warn_days: int = 30, fit_days: int = 90):
+        self.warn_days = warn_days
+        self.fit_days = fit_days
+
+
+class IoMonitor:
+    def __init__(
+        self,
+        sample_seconds: float = 5,
+        outlier_factor: float = 3.0,
+        min_latency_ms: float = 10.0,
+        min_throughput: float = 1048576,
+    ):
+        self.sample_seconds = sample_seconds
+        self.outlier_factor = outlier_factor
+        self.min_latency_ms = min_latency_ms
+        self.min_throughput = min_throughput
+
+
+class Thresholds:
+    # each one is off unless set
+    def __init__(
+        self,
+        max_fragmentation: int = None,
+        max_capacity: int = None,
+        min_arc_hit_ratio: float = None,
+        min_arc_accesses: int = 10000,
+    ):
+        self.max_fragmentation = max_fragmentation
+        self.max_capacity = max_capacity
+        self.min_arc_hit_ratio = min_arc_hit_ratio
+        # hits and misses the hit ratio needs before it is judged, few reads say nothing about the ARC
+        self.min_arc_accesses = min_arc_accesses
+
+
+class Scrub:
+    def __init__(
+        self,
+        window: str = None,
+        interval_days: float = 30,
+        max_utilization: float = 0.5,
+        sample_seconds: float = 10,
+        frequency: str = None,
+        watch_devices: List[str] = None,
+    ):
+        self.window = window
+        self.interval_days = interval_days
+        self.max_utilization = max_utilization
+        self.sample_seconds = sample_seconds
+        self.frequency = frequency
+        self.watch_devices = watch_devices
+        self._window_times = None
+        if window:
+            start, end = window.split("-")
+            self._window_times = (
+                datetime.datetime.strptime(start.strip(), "%H:%M").time(),
+                datetime.datetime.strptime(end.strip(), "%H:%M").time(),
+            )
+
+    def in_window(self, now: datetime.datetime):
+        if not self._window_times:
+            return True
+        start, end = self._window_times
+        if start <= end:
+            return start <= now.time() < end
+        # window over midnight, e.g. 22:00-04:00
+        return now.time() >= start or now.time() < end
+
+
 class Pool:
     def __init__(
-        self, name: str, path: str, auto_check: List[Dict[str, str]] = None, healthchecks: Dict[str, str] = None
+        self,
+        name: str,
+        path: str,
+        auto_check: List[Dict[str, str]] = None,
+        healthchecks: Dict[str, str] = None,
+        timeout: float = 60,
+        capacity: Dict[str, int] = None,
+        scrub: Dict[str, Any] = None,
+        io: Dict[str, float] = None,
+        thresholds: Dict[str, float] = None,
     ):
         self.name = name
         self.path = path
+        self.timeout = timeout
+        self.capacity = Capacity(**capacity) if capacity else Capacity()
+        self.scrub = Scrub(**scrub) if scrub else None
+        self.io = IoMonitor(**io) if io else IoMonitor()
+        self.thresholds = Thresholds(**thresholds) if thresholds else Thresholds()
         self.auto_check = [AutoCheck(**check) for check in auto_check] if auto_check else []
         self.healthchecks = hc.Healthcheck(**healthchecks) if healthchecks else None
 
@@ -29,8 +114,8 @@ class Driver:
 
 
 class Config(config.BaseConfig):
-    def __init__(self, path: str, no_log: bool, debug: bool):
-        super().__init__("abdata", os.path.dirname(path), no_log, debug)
+    def __init__(self, path: str, no_log: bool, debug: bool, start_background: bool = True):
+        super().__init__("abdata", os.path.dirname(path), no_log, debug, start_background=start_background)
 
         if path and os.path.isfile(path):
             with open(path, "r") as stream:
@@ -0,0 +1,286 @@
+import datetime
+import logging
+import os
+import struct
+
+from inspect import currentframe, getframeinfo
+from typing import List
+
+from tabulate import tabulate
+
+from abackup import fs, notifications, zfs
+from abackup.data import Config, Driver, Pool
+from abackup.fs import PoolState, PoolStatus
+
+# (seconds per slot, slots): a week of 4 hour samples, 3 months of daily and 3 years of weekly ones, 7.5 KB per pool
+RING_TIERS = [(4 * 3600, 42), (24 * 3600, 90), (7 * 24 * 3600, 156)]
+
+_HEADER = struct.Struct("<6sH")
+_TIER = struct.Struct("<II")
+# timestamp, used, total, then fragmentation in percent, dedup ratio in 1/100 and ARC hit ratio in 1/10000
+_SAMPLE = struct.Struct("<IQQHHH")
+_MAGIC = b"ABCAP2"
+# earlier layouts, still read so their samples are carried over to the current one
+_OLD_SAMPLES = {b"ABCAP1": struct.Struct("<IQQ")}
+_UNKNOWN = 0xFFFF
+
+
+class CapacitySample:
+    def __init__(
+        self,
+        timestamp: int,
+        used: int,
+        total: int,
+        fragmentation: int = None,
+        dedup_ratio: float = None,
+        arc_hit_ratio: float = None,
+    ):
+        self.timestamp = timestamp
+        self.used = used
+        self.total = total
+        self.fragmentation = fragmentation
+        self.dedup_ratio = dedup_ratio
+        self.arc_hit_ratio = arc_hit_ratio
+
+    def __str__(self):
+        return "CapacitySample: {} used:{}, total:{}, frag:{}, dedup:{}, arc hit:{}".format(
+            datetime.datetime.fromtimestamp(self.timestamp),
+            self.used,
+            self.total,
+            self.fragmentation,
+            self.dedup_ratio,
+            self.arc_hit_ratio,
+        )
+
+    def pack(self):
+        def _encode(value: float, scale: int):
+            return min(_UNKNOWN - 1, int(round(value * scale))) if value is not None else _UNKNOWN
+
+        return _SAMPLE.pack(
+            self.timestamp,
+            self.used,
+            self.total,
+            _encode(self.fragmentation, 1),
+            _encode(self.dedup_ratio, 100),
+            _encode(self.arc_hit_ratio, 10000),
+        )
+
+    @classmethod
+    def unpack(cls, values: List[int]):
+        # samples of older layouts have no metrics
+        values = list(values) + [_UNKNOWN] * (6 - len(values))
+        timestamp, used, total, fragmentation, dedup_ratio, arc_hit_ratio = values
+        return cls(
+            timestamp,
+            used,
+            total,
+            fragmentation if fragmentation != _UNKNOWN else None,
+            dedup_ratio / 100 if dedup_ratio != _UNKNOWN else None,
+            arc_hit_ratio / 10000 if arc_hit_ratio != _UNKNOWN else None,
+        )
+
+
+class CapacityRing:
+    """A fixed size file of round-robin sample tiers
+
+    Every sample is written to the current slot of every tier, replacing the previous sample of that slot's period, so
+    each tier keeps the last sample per period for as many periods as it has slots.
+    """
+
+    def __init__(self, path: str, tiers: List[List[int]] = None):
+        self.path = path
+        self.tiers = tiers if tiers else RING_TIERS
+
+    def _header(self, magic: bytes = _MAGIC):
+        return _HEADER.pack(magic, len(self.tiers)) + b"".join([_TIER.pack(step, slots) for step, slots in self.tiers])
+
+    def _tier_offsets(self, sample_size: int = _SAMPLE.size):
+        offset = len(self._header())
+        offsets = []
+        for _, slots in self.tiers:
+            offsets.append(offset)
+            offset += slots * sample_size
+        return offsets, offset
+
+    def _is_valid(self):
+        if not os.path.exists(self.path):
+            return False
+        header = self._header()
+        with open(self.path, "rb") as ring_file:
+            return ring_file.read(len(header)) == header
+
+    def _create(self):
+        _, size = self._tier_offsets()
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "wb") as ring_file:
+            ring_file.write(self._header())
+            ring_file.write(b"\0" * (size - len(self._header())))
+        os.replace(tmp_path, self.path)
+
+    def _write(self, ring_file, samples: List[CapacitySample]):
+        offsets, _ = self._tier_offsets()
+        for sample in samples:
+            data = sample.pack()
+            for (step, slots), offset in zip(self.tiers, offsets):
+                ring_file.seek(offset + (sample.timestamp // step % slots) * _SAMPLE.size)
+                ring_file.write(data)
+
+    def append(self, sample: CapacitySample, log: logging.Logger = None):
+        samples = [sample]
+        if not self._is_valid():
+            previous = self.samples()
+            if os.path.exists(self.path) and log:
+                log.info("Converting capacity ring file to the current layout: {}".format(self.path))
+            samples = previous + samples
+            self._create()
+        with open(self.path, "r+b") as ring_file:
+            self._write(ring_file, samples)
+
+    def samples(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "rb") as ring_file:
+            data = ring_file.read()
+        sample_struct = None
+        for magic, layout in [(_MAGIC, _SAMPLE)] + list(_OLD_SAMPLES.items()):
+            if data.startswith(self._header(magic)):
+                sample_struct = layout
+        if not sample_struct:
+            return []
+        offsets, _ = self._tier_offsets(sample_struct.size)
+        samples = {}
+        for (_, slots), offset in zip(self.tiers, offsets):
+            for values in sample_struct.iter_unpack(data[offset : offset + slots * sample_struct.size]):
+                if values[0]:
+                    samples[values[0]] = CapacitySample.unpack(values)
+        return [samples[timestamp] for timestamp in sorted(samples.keys())]
+
+
+class CapacityForecast:
+    def __init__(self, used: float, total: float, growth_per_day: float = None, sample_count: int = 0):
+        self.used = used
+        self.total = total
+        self.growth_per_day = growth_per_day
+        self.sample_count = sample_count
+
+    def __str__(self):
+        return "CapacityForecast: used:{}, total:{}, growth:{}/day, full in:{}".format(
+            self.used, self.total, self.growth_per_day, self.time_to_full
+        )
+
+    @property
+    def time_to_full(self):
+        if not self.growth_per_day or self.growth_per_day <= 0:
+            return None
+        return datetime.timedelta(days=max(0.0, self.total - self.used) / self.growth_per_day)
+
+
+def fit_growth(samples: List[CapacitySample], fit_days: int, now: datetime.datetime = None):
+    """Least squares fit of the used bytes over the last fit_days, with the last sample of every day"""
+    if not samples:
+        return None
+    now = now if now else datetime.datetime.now()
+    since = (now - datetime.timedelta(days=fit_days)).timestamp()
+    daily = {}
+    for sample in samples:
+        if sample.timestamp >= since:
+            daily[sample.timestamp // (24 * 3600)] = sample
+    points = [daily[day] for day in sorted(daily.keys())]
+    latest = samples[-1]
+    if len(points) < 3:
+        return CapacityForecast(latest.used, latest.total, sample_count=len(points))
+
+    xs = [(p.timestamp - points[0].timestamp) / (24 * 3600) for p in points]
+    ys = [float(p.used) for p in points]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(ys) / len(ys)
+    variance = sum([(x - x_mean) ** 2 for x in xs])
+    if variance == 0:
+        return CapacityForecast(latest.used, latest.total, sample_count=len(points))
+    slope = sum([(x - x_mean) * (y - y_mean) for x, y in zip(xs, ys)]) / variance
+    return CapacityForecast(latest.used, latest.total, slope, len(points))
+
+
+def capacity_ring_path(config: Config, pool_name: str):
+    return os.path.join(config._ensure_log_dir(), "capacity-{}.ring".format(pool_name))
+
+
+def record_capacity(config: Config, pool: Pool, status: PoolStatus, log: logging.Logger):
+    ring = CapacityRing(capacity_ring_path(config, pool.name))
+    if status.state != PoolState.ERROR:
+        sample = CapacitySample(int(datetime.datetime.now().timestamp()), int(status.used), int(status.total_size))
+        if isinstance(status.metrics, zfs.ZfsMetrics):
+            sample.fragmentation = status.metrics.fragmentation
+            sample.dedup_ratio = status.metrics.dedup_ratio
+            sample.arc_hit_ratio = status.metrics.arc.hit_ratio if status.metrics.arc else None
+        ring.append(sample, log)
+    forecast = fit_growth(ring.samples(), pool.capacity.fit_days)
+    log.debug("record_capacity({}): {}".format(pool.name, forecast))
+    return forecast
+
+
+def notify_capacity_warning(
+    notifier: notifications.SlackNotifier,
+    pool: Pool,
+    forecast: CapacityForecast,
+    notify_mode: notifications.Mode,
+    log: logging.Logger,
+):
+    time_to_full = forecast.time_to_full if forecast else None
+    if time_to_full is None or time_to_full > datetime.timedelta(days=pool.capacity.warn_days):
+        return
+    title = "{} will be full in {} days".format(pool.name, time_to_full.days)
+    log.warning("{} (growing {}/day)".format(title, fs.to_human_readable(forecast.growth_per_day)))
+    if not notifier or notify_mode == notifications.Mode.NEVER:
+        log.debug("notify_capacity_warning({}, {}): skipping notify".format(pool.name, notify_mode.name))
+        return
+    frame_info = getframeinfo(currentframe())
+    response = notifier.notify(
+        title,
+        notifications.Severity.ERROR,
+        fields={
+            "Path": pool.path,
+            "Utilization": "{:.2%}".format(forecast.used / forecast.total),
+            "Growth": "{}/day".format(fs.to_human_readable(forecast.growth_per_day)),
+            "Projected Full": (datetime.datetime.now() + time_to_full).strftime("%Y-%m-%d"),
+        },
+        file_name=os.path.basename(frame_info.filename),
+        line_number=frame_info.lineno,
+        time=datetime.datetime.now().timestamp(),
+    )
+    if response.is_error():
+        log.error("Error during notify: code: {} message: {}".format(response.code, response.message))
+
+
+def perform_capacity(config: Config, drivers: List[Driver], log: logging.Logger, pool_name: str = None):
+    rows = []
+    for d in drivers:
+        for p in d.pools:
+            if pool_name and p.name != pool_name:
+                continue
+            samples = CapacityRing(capacity_ring_path(config, p.name)).samples()
+            forecast = fit_growth(samples, p.capacity.fit_days)
+            if not forecast:
+                rows.append([p.name, "-", "-", "-", "-", "-", "-", "no samples"])
+                continue
+            time_to_full = forecast.time_to_full
+            latest = samples[-1]
+            rows.append(
+                [
+                    p.name,
+                    fs.to_human_readable(forecast.used),
+                    fs.to_human_readable(forecast.total),
+                    "{}/day".format(fs.to_human_readable(forecast.growth_per_day))
+                    if forecast.growth_per_day is not None
+                    else "-",
+                    "{} days".format(time_to_full.days) if time_to_full is not None else "-",
+                    "{}%".format(latest.fragmentation) if latest.fragmentation is not None else "-",
+                    "{:.1%}".format(latest.arc_hit_ratio) if latest.arc_hit_ratio is not None else "-",
+                    "{} samples, {} used for fit, since {}".format(
+                        len(samples),
+                        forecast.sample_count,
+                        datetime.datetime.fromtimestamp(samples[0].timestamp).strftime("%Y-%m-%d"),
+                    ),
+                ]
+            )
+    print(tabulate(rows, headers=["Pool", "Used", "Total", "Growth", "Full In", "Frag", "ARC Hit", "History"]))
@@ -1,29 +1,74 @@
 import datetime
 import logging
 import os
+import queue
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 
 from inspect import currentframe, getframeinfo
 from typing import List
 
-from abackup import fs, healthchecks as hc, mdadm, notifications, zfs
-from abackup.data import Config, Driver, Pool
+from abackup import fs, healthchecks as hc, mdadm, notifications, spans, zfs
+from abackup.data import Config, Driver, Pool, Thresholds
+from abackup.data.capacity import notify_capacity_warning, record_capacity
 from abackup.fs import PoolState, PoolStatus
+from abackup.metrics import add_job_metrics
 
 
-def gather_pool_status(driver: Driver, pool: Pool, log: logging.Logger):
+def gather_pool_status(
+    driver: Driver,
+    pool: Pool,
+    log: logging.Logger,
+    zfs_collector: zfs.ZfsCollector = None,
+    mdadm_collector: mdadm.MdadmCollector = None,
+):
     if driver.name == "mdadm":
+        if mdadm_collector:
+            return mdadm_collector.pool_status(pool.name, pool.path)
         return mdadm.pool_status(pool.name, pool.path, log)
     elif driver.name == "zfs":
+        if zfs_collector:
+            return zfs_collector.pool_status(pool.name, pool.path)
         return zfs.pool_status(pool.name, pool.path, log)
     else:
         log.error("Invalid driver: {}".format(driver.name))
         return PoolStatus(pool.name, pool.path, fs.PoolState.ERROR, [], 1, 1)
 
 
+def threshold_warnings(status: PoolStatus, thresholds: Thresholds):
+    warnings = []
+    metrics = status.metrics
+    if isinstance(metrics, zfs.ZfsMetrics):
+        if (
+            thresholds.max_fragmentation is not None
+            and metrics.fragmentation is not None
+            and metrics.fragmentation > thresholds.max_fragmentation
+        ):
+            warnings.append("fragmentation {}% above {}%".format(metrics.fragmentation, thresholds.max_fragmentation))
+        if (
+            thresholds.max_capacity is not None
+            and metrics.capacity is not None
+            and metrics.capacity > thresholds.max_capacity
+        ):
+            warnings.append("capacity {}% above {}%".format(metrics.capacity, thresholds.max_capacity))
+        arc = metrics.arc
+        if (
+            thresholds.min_arc_hit_ratio is not None
+            and arc
+            and arc.hits + arc.misses >= max(1, thresholds.min_arc_accesses)
+            and arc.hit_ratio < thresholds.min_arc_hit_ratio
+        ):
+            warnings.append("ARC hit ratio {:.1%} below {:.1%}".format(arc.hit_ratio, thresholds.min_arc_hit_ratio))
+    return warnings
+
+
 def notify_or_log(
     notifier: notifications.SlackNotifier, status: PoolStatus, notify_mode: notifications.Mode, log: logging.Logger
 ):
     log.debug("notify_or_log({}, {})".format(status.pool, notify_mode.name))
+    outliers = [ds for ds in status.drive_status if ds.outlier]
     if not notifier:
         log.debug(
             "notify_or_log({}, {}): skipping notify (because no notifier was supplied), state:{}".format(
@@ -31,10 +76,13 @@ def notify_or_log(
             )
         )
     elif notify_mode == notifications.Mode.ALWAYS or (
-        notify_mode == notifications.Mode.AUTO and status.state != PoolState.HEALTHY
+        notify_mode == notifications.Mode.AUTO and (status.state != PoolState.HEALTHY or outliers or status.warnings)
     ):
         log.info("Sending notifications for {}:{} {}".format(status.pool, status.state.name, notify_mode.name))
-        if status.state == PoolState.HEALTHY:
+        if status.state == PoolState.HEALTHY and (outliers or status.warnings):
+            severity = notifications.Severity.ERROR
+            title = "{} is HEALTHY, with warnings".format(status.pool)
+        elif status.state == PoolState.HEALTHY:
             severity = notifications.Severity.GOOD
             title = "{} is HEALTHY".format(status.pool)
         elif status.state == PoolState.DEGRADED:
@@ -49,9 +97,17 @@ def notify_or_log(
             )
         fields = {
             "Path": status.path,
-            "Utilization": "{:.2%}".format(status.utilization),
+            "Utilization": "{:.2%}".format(status.utilization) if status.total_size else "unknown",
             "Drive Status": "\n".join([str(ds) for ds in status.drive_status]),
         }
+        if outliers:
+            fields["Slow Drives"] = "\n".join(["{}: {}".format(ds.drive, ds.outlier) for ds in outliers])
+        if status.warnings:
+            fields["Warnings"] = "\n".join(status.warnings)
+        if status.metrics:
+            fields["Metrics"] = str(status.metrics)
+        if status.sync and (status.sync.is_active or status.sync.mismatch_count):
+            fields["Sync"] = str(status.sync)
         frame_info = getframeinfo(currentframe())
         response = notifier.notify(
             title,
@@ -75,6 +131,87 @@ def notify_or_log(
         )
 
 
+def write_pool_metrics(config: Config, pool: Pool, status: PoolStatus, duration: float = None):
+    metrics_file = config.metrics_file("abdata_pool_{}".format(pool.name))
+    if not metrics_file:
+        return
+    labels = {"pool": pool.name}
+    add_job_metrics(metrics_file, "abdata_pool", labels, status.state == PoolState.HEALTHY, duration)
+    for state in PoolState:
+        metrics_file.add("abdata_pool_state", 1 if state == status.state else 0, {**labels, "state": state.name})
+    if status.state != PoolState.ERROR:
+        metrics_file.add("abdata_pool_used_bytes", status.used, labels)
+        metrics_file.add("abdata_pool_size_bytes", status.total_size, labels)
+        metrics_file.add("abdata_pool_utilization_ratio", status.utilization, labels)
+    metrics_file.add("abdata_pool_slow_drives", len([ds for ds in status.drive_status if ds.outlier]), labels)
+    metrics_file.add("abdata_pool_warnings", len(status.warnings), labels)
+    if isinstance(status.metrics, zfs.ZfsMetrics):
+        metrics_file.add("abdata_pool_fragmentation_percent", status.metrics.fragmentation, labels)
+        metrics_file.add("abdata_pool_dedup_ratio", status.metrics.dedup_ratio, labels)
+        metrics_file.add("abdata_arc_hit_ratio", status.metrics.arc.hit_ratio if status.metrics.arc else None, labels)
+    metrics_file.write()
+
+
+def report_pool_status(
+    config: Config,
+    pool: Pool,
+    status: PoolStatus,
+    notify_mode: notifications.Mode,
+    log: logging.Logger,
+    healthcheck_run: hc.HealthcheckRun = None,
+    do_healthchecks: bool = True,
+    duration: float = None,
+    parent_span: spans.Span = None,
+):
+    with spans.span("report", pool.name, parent=parent_span, state=status.state.name) as report_span:
+        report_span.ok = status.state == PoolState.HEALTHY
+        with spans.span("notify"):
+            notify_or_log(config.notifier, status, notify_mode, log)
+        with spans.span("metrics"):
+            write_pool_metrics(config, pool, status, duration)
+        with spans.span("capacity"):
+            forecast = record_capacity(config, pool, status, log)
+            notify_capacity_warning(config.notifier, pool, forecast, notify_mode, log)
+
+        if do_healthchecks and pool.healthchecks:
+            with spans.span("healthcheck"):
+                hc.perform_healthcheck(
+                    config.default_healthcheck,
+                    pool.healthchecks,
+                    pool.name,
+                    config.notifier,
+                    notify_mode,
+                    log,
+                    is_fail=status.state != PoolState.HEALTHY,
+                    message="Pool is not healthy: {}".format(status) if status.state != PoolState.HEALTHY else None,
+                    run=healthcheck_run,
+                )
+
+
+def _gather_pool_status_into(
+    index: int,
+    driver: Driver,
+    pool: Pool,
+    log: logging.Logger,
+    zfs_collector: zfs.ZfsCollector,
+    mdadm_collector: mdadm.MdadmCollector,
+    results: queue.Queue,
+    parent_span: spans.Span = None,
+):
+    with spans.span("pool_status", pool.name, parent=parent_span, driver=driver.name) as status_span:
+        try:
+            status = gather_pool_status(driver, pool, log, zfs_collector, mdadm_collector)
+            fs.flag_io_outliers(
+                status.drive_status, pool.io.outlier_factor, pool.io.min_latency_ms, pool.io.min_throughput
+            )
+            status.warnings = threshold_warnings(status, pool.thresholds)
+        except Exception as e:
+            log.exception("Failed to get status of pool: {}".format(pool.name))
+            status = PoolStatus(pool.name, pool.path, PoolState.ERROR, [], 1, 1, str(e))
+        status_span.ok = status.state != PoolState.ERROR
+    results.put((index, status))
+
+
 def perform_check(
     config: Config,
     drivers: List[Driver],
@@ -82,33 +219,91 @@ def perform_check(
     log: logging.Logger,
     pool_name: str = None,
     do_healthchecks: bool = True,
+    pool_names: List[str] = None,
 ):
+    """Check the pools and report their status, False when a pool is not healthy or could not be reported"""
     notify_mode = notifications.Mode(notify)
+    pools = []
     for d in drivers:
         log.info("Driver: {}".format(d.name))
         for p in d.pools:
-            if not pool_name or p.name == pool_name:
+            if (not pool_name or p.name == pool_name) and (pool_names is None or p.name in pool_names):
                 log.info("Pool: {}".format(p.name))
+                pools.append((d, p))
+            else:
+                log.debug("Skipping Pool: {}".format(p.name))
+    if not pools:
+        return True
+
+    zfs_pools = [p for d, p in pools if d.name == "zfs"]
+    zfs_io_seconds = max([p.io.sample_seconds for p in zfs_pools]) if zfs_pools else None
+    zfs_collector = zfs.ZfsCollector(
+        [p.name for p in zfs_pools],
+        log,
+        max([p.timeout for p in zfs_pools]) if zfs_pools else None,
+        zfs_io_seconds,
+    )
+    mdadm_pools = [p for d, p in pools if d.name == "mdadm"]
+    mdadm_collector = mdadm.MdadmCollector(
+        log, io_sample_seconds=max([p.io.sample_seconds for p in mdadm_pools]) if mdadm_pools else None
+    )
 
+    # pools are checked on daemon threads, so a hung status command cannot keep abdata from exiting after its timeout,
+    # notifications and health check pings are sent from a pool of their own while the other pools are still checked
+    success = True
+    with spans.span("check") as check_span:
+        results = queue.Queue()
+        started = time.monotonic()
+        deadlines = {}
+        report_futures = []
+        with ThreadPoolExecutor(max_workers=len(pools)) as notify_executor:
+            healthcheck_runs = {}
+            for i, (d, p) in enumerate(pools):
                 if do_healthchecks and p.healthchecks:
-                    hc.perform_healthcheck_start(
+                    healthcheck_runs[i] = hc.perform_healthcheck_start(
                         config.default_healthcheck, p.healthchecks, p.name, config.notifier, notify_mode, log
                     )
+                deadlines[i] = time.monotonic() + p.timeout
+                threading.Thread(
+                    target=_gather_pool_status_into,
+                    args=(i, d, p, log, zfs_collector, mdadm_collector, results, check_span),
+                    daemon=True,
+                ).start()
 
-                status = gather_pool_status(d, p, log)
+            while deadlines:
+                try:
+                    i, status = results.get(timeout=max(0, min(deadlines.values()) - time.monotonic()))
+                    if i not in deadlines:
+                        continue
+                except queue.Empty:
+                    i = min(deadlines, key=deadlines.get)
+                    p = pools[i][1]
+                    log.error("Timed out after {}s getting status of pool: {}".format(p.timeout, p.name))
+                    status = PoolStatus(
+                        p.name, p.path, PoolState.ERROR, [], 1, 1, "Timed out after {}s".format(p.timeout)
+                    )
+                del deadlines[i]
                 log.info(status)
-                notify_or_log(config.notifier, status, notify_mode, log)
-
-                if do_healthchecks and p.healthchecks:
-                    hc.perform_healthcheck(
-                        config.default_healthcheck,
-                        p.healthchecks,
-                        p.name,
-                        config.notifier,
+                if status.state != PoolState.HEALTHY:
+                    success = False
+                report_futures.append(
+                    notify_executor.submit(
+                        report_pool_status,
+                        config,
+                        pools[i][1],
+                        status,
                         notify_mode,
                         log,
-                        is_fail=status.state != PoolState.HEALTHY,
-                        message="Pool is not healthy: {}".format(status) if status.state != PoolState.HEALTHY else None,
+                        healthcheck_runs.get(i),
+                        do_healthchecks,
+                        time.monotonic() - started,
+                        check_span,
                     )
-            else:
-                log.debug("Skipping Pool: {}".format(p.name))
+                )
+
+        for future in report_futures:
+            if future.exception():
+                log.error("Failed to report pool status: {}".format(future.exception()))
+                success = False
+        check_span.ok = success
+    return success
@@ -0,0 +1,308 @@
+import datetime
+import json
+import logging
+import os
+
+from typing import List
+
+from tabulate import tabulate
+
+from abackup import diskstats, fs, mdadm, zfs
+from abackup.data import Config, Driver, Pool
+from abackup.fs import ScrubProgress
+
+SCRUB_HISTORY_LENGTH = 100
+
+
+class ScrubRun:
+    def __init__(
+        self,
+        started: float,
+        finished: float = None,
+        paused_at: float = None,
+        paused_seconds: float = 0,
+        pause_reason: str = None,
+        done: int = None,
+        total: int = None,
+        errors: int = None,
+        is_external: bool = False,
+    ):
+        # timestamps in seconds since the epoch
+        self.started = started
+        self.finished = finished
+        self.paused_at = paused_at
+        self.paused_seconds = paused_seconds
+        self.pause_reason = pause_reason
+        self.done = done
+        self.total = total
+        self.errors = errors
+        self.is_external = is_external
+
+    def __str__(self):
+        return "ScrubRun: started {}, {}/{} done, paused: {}".format(
+            datetime.datetime.fromtimestamp(self.started), self.done, self.total, self.pause_reason
+        )
+
+    @property
+    def active_seconds(self):
+        end = self.finished if self.finished else datetime.datetime.now().timestamp()
+        return max(0.0, end - self.started - self.paused_seconds)
+
+    @property
+    def throughput(self):
+        if not self.done or not self.active_seconds:
+            return None
+        return self.done / self.active_seconds
+
+    def pause(self, now: float, reason: str):
+        if self.paused_at is None:
+            self.paused_at = now
+        self.pause_reason = reason
+
+    def resume(self, now: float):
+        if self.paused_at is not None:
+            self.paused_seconds += now - self.paused_at
+        self.paused_at = None
+        self.pause_reason = None
+
+
+class ScrubState:
+    def __init__(self, path: str, current: ScrubRun = None, history: List[ScrubRun] = None):
+        self.path = path
+        self.current = current
+        self.history = history if history else []
+
+    @classmethod
+    def load(cls, path: str, log: logging.Logger = None):
+        try:
+            if os.path.exists(path):
+                with open(path, "r") as json_file:
+                    json_dict = json.load(json_file)
+                return cls(
+                    path,
+                    ScrubRun(**json_dict["current"]) if json_dict["current"] else None,
+                    [ScrubRun(**run) for run in json_dict["history"]],
+                )
+        except (KeyError, TypeError, ValueError):
+            if log:
+                log.warning("Failed to read scrub state, starting a new one: {}".format(path))
+        return cls(path)
+
+    def save(self):
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "w") as json_file:
+            json.dump(
+                {
+                    "current": self.current.__dict__ if self.current else None,
+                    "history": [run.__dict__ for run in self.history[-SCRUB_HISTORY_LENGTH:]],
+                },
+                json_file,
+            )
+        os.replace(tmp_path, self.path)
+
+    def last_finished(self):
+        return self.history[-1].finished if self.history else None
+
+
+class ScrubTarget:
+    """The scrub commands of one pool, for the driver the pool belongs to"""
+
+    def __init__(self, driver_name: str, pool: Pool, log: logging.Logger, sysfs_root: str = "/sys"):
+        self.driver_name = driver_name
+        self.pool = pool
+        self.log = log
+        self.sysfs_root = sysfs_root
+
+    def progress(self) -> ScrubProgress:
+        if self.driver_name == "zfs":
+            return zfs.scrub_progress(self.pool.name, self.log)
+        return mdadm.scrub_progress(self.pool.name, self.sysfs_root)
+
+    def scrub(self, pause: bool = False):
+        if self.driver_name == "zfs":
+            return zfs.scrub(self.pool.name, self.log, pause)
+        return mdadm.scrub(self.pool.name, self.log, pause, self.sysfs_root)
+
+    def unpause(self):
+        """Undo a pause of a scrub that is no longer running"""
+        if self.driver_name == "zfs":
+            # a paused zfs scrub is the pool's own state, there is nothing left once it ended
+            return True
+        return mdadm.unpause(self.pool.name, self.log, self.sysfs_root)
+
+    def devices(self):
+        if self.pool.scrub.watch_devices:
+            return self.pool.scrub.watch_devices
+        if self.driver_name == "zfs":
+            return zfs.pool_devices(self.pool.name, self.log)
+        return mdadm.pool_devices(self.pool.name)
+
+
+def scrub_state_path(config: Config, pool_name: str):
+    return os.path.join(config._ensure_log_dir(), "scrub-{}.json".format(pool_name))
+
+
+def is_busy(target: ScrubTarget, devices: List[str], log: logging.Logger):
+    if not devices:
+        return False
+    utilizations = diskstats.sample_utilization(devices, target.pool.scrub.sample_seconds, log=log)
+    utilization = max(utilizations.values()) if utilizations else 0.0
+    log.info(
+        "{}: disk utilization {:.0%} (max {:.0%})".format(
+            target.pool.name, utilization, target.pool.scrub.max_utilization
+        )
+    )
+    return utilization > target.pool.scrub.max_utilization
+
+
+def scrub_tick(config: Config, target: ScrubTarget, log: logging.Logger, now: datetime.datetime = None):
+    """Advance the scrub of one pool: start, pause or resume it and record finished runs"""
+    pool = target.pool
+    now = now if now else datetime.datetime.now()
+    timestamp = now.timestamp()
+    state = ScrubState.load(scrub_state_path(config, pool.name), log)
+    progress = target.progress()
+    if not progress:
+        log.error("Failed to get scrub progress of {}".format(pool.name))
+        return False
+    log.info("{}: {}".format(pool.name, progress))
+
+    success = True
+    if state.current and progress.state == "idle":
+        # a check of md that was stopped while paused leaves its speed limit behind
+        if not target.unpause():
+            success = False
+        state.current.resume(timestamp)
+        state.current.finished = timestamp
+        state.current.errors = progress.errors
+        if state.current.done is not None and state.current.total:
+            state.current.done = state.current.total
+        throughput = state.current.throughput
+        log.info(
+            "{}: scrub finished after {}, {}/s, errors: {}".format(
+                pool.name,
+                datetime.timedelta(seconds=int(state.current.active_seconds)),
+                fs.to_human_readable(throughput) if throughput else "-",
+                progress.errors,
+            )
+        )
+        state.history.append(state.current)
+        state.current = None
+    elif not state.current and progress.state in ["running", "paused"]:
+        log.info("{}: found a scrub that was not started by abdata".format(pool.name))
+        state.current = ScrubRun(timestamp, is_external=True)
+
+    is_in_window = pool.scrub.in_window(now)
+    if progress.state == "idle":
+        last_finished = state.last_finished()
+        is_due = not last_finished or timestamp - last_finished >= pool.scrub.interval_days * 24 * 3600
+        if not is_due:
+            log.info(
+                "{}: scrub not due, last finished {}".format(pool.name, datetime.datetime.fromtimestamp(last_finished))
+            )
+        elif not is_in_window:
+            log.info("{}: scrub due, waiting for window {}".format(pool.name, pool.scrub.window))
+        elif is_busy(target, target.devices(), log):
+            log.info("{}: scrub due, waiting for disk utilization to drop".format(pool.name))
+        elif target.scrub():
+            log.info("{}: scrub started".format(pool.name))
+            state.current = ScrubRun(timestamp)
+        else:
+            success = False
+    elif progress.state == "running":
+        if not is_in_window:
+            if target.scrub(pause=True):
+                log.info("{}: scrub paused, outside of window {}".format(pool.name, pool.scrub.window))
+                state.current.pause(timestamp, "window")
+            else:
+                success = False
+        elif is_busy(target, target.devices(), log):
+            # the utilization includes the scrub itself, so pause and measure again without it
+            if target.scrub(pause=True):
+                devices = target.devices()
+                if is_busy(target, devices, log):
+                    log.info("{}: scrub paused, disks are busy".format(pool.name))
+                    state.current.pause(timestamp, "load")
+                elif target.scrub():
+                    log.info("{}: scrub continues, the utilization was its own".format(pool.name))
+                else:
+                    success = False
+            else:
+                success = False
+    elif progress.state == "paused":
+        if not state.current.pause_reason:
+            log.info("{}: scrub was paused outside of abdata, leaving it paused".format(pool.name))
+        elif is_in_window and not is_busy(target, target.devices(), log):
+            if target.scrub():
+                log.info("{}: scrub resumed".format(pool.name))
+                state.current.resume(timestamp)
+            else:
+                success = False
+    else:
+        log.info("{}: a resilver or repair is running, not scrubbing".format(pool.name))
+        if state.current and state.current.pause_reason:
+            # md pauses with a speed limit that would hold back the recovery too
+            if target.unpause():
+                log.info("{}: scrub pause lifted for the resilver or repair".format(pool.name))
+                state.current.resume(timestamp)
+            else:
+                success = False
+
+    if state.current and progress.state in ["running", "paused"]:
+        state.current.done = progress.done
+        state.current.total = progress.total
+    state.save()
+    return success
+
+
+def perform_scrub(config: Config, drivers: List[Driver], log: logging.Logger, pool_name: str = None):
+    success = True
+    for d in drivers:
+        for p in d.pools:
+            if pool_name and p.name != pool_name:
+                continue
+            if not p.scrub:
+                log.debug("Skipping Pool: {}, no scrub settings".format(p.name))
+                continue
+            lock = fs.FileLock("{}.lock".format(scrub_state_path(config, p.name)), timeout=0)
+            if not lock.acquire():
+                log.info("{}: scrub scheduler already running".format(p.name))
+                continue
+            try:
+                success = scrub_tick(config, ScrubTarget(d.name, p, log), log) and success
+            finally:
+                lock.release()
+    return success
+
+
+def perform_scrub_history(config: Config, drivers: List[Driver], log: logging.Logger, pool_name: str = None):
+    rows = []
+    for d in drivers:
+        for p in d.pools:
+            if pool_name and p.name != pool_name:
+                continue
+            state = ScrubState.load(scrub_state_path(config, p.name), log)
+            runs = state.history + ([state.current] if state.current else [])
+            for run in runs:
+                throughput = run.throughput
+                rows.append(
+                    [
+                        p.name,
+                        datetime.datetime.fromtimestamp(int(run.started)),
+                        (
+                            datetime.datetime.fromtimestamp(int(run.finished))
+                            if run.finished
+                            else "paused ({})".format(run.pause_reason) if run.pause_reason else "running"
+                        ),
+                        datetime.timedelta(seconds=int(run.active_seconds)),
+                        datetime.timedelta(seconds=int(run.paused_seconds)),
+                        fs.to_human_readable(run.done) if run.done is not None else "-",
+                        "{}/s".format(fs.to_human_readable(throughput)) if throughput else "-",
+                        run.errors if run.errors is not None else "-",
+                    ]
+                )
+    print(
+        tabulate(
+            rows, headers=["Pool", "Started", "Finished", "Scrubbing", "Paused", "Scrubbed", "Throughput", "Errors"]
+        )
+    )
@@ -1,16 +1,30 @@
 import logging
 from typing import Dict
 
-from abackup.appcron import AppCronTab
+from abackup.appcron import AppCronTab, AppJob
 from abackup.data import Driver
 
 
-def perform_update_cron(drivers: Dict[str, Driver], abdata_options: str, cron: AppCronTab, log: logging.Logger):
-    do_write_cron = True
+def pool_jobs(drivers: Dict[str, Driver], abdata_options: str, log: logging.Logger):
+    """The scrub and auto_check jobs of the pools of all drivers"""
+    jobs = []
     for driver_name, driver in drivers.items():
         log.info(driver_name)
         for pool in driver.pools:
             log.info(pool.name)
+            if pool.scrub:
+                command = "abdata {} scrub --driver {} --pool {}".format(abdata_options, driver.name, pool.name)
+                comment = "{} scrub".format(pool.name)
+                log.debug("command: {}, comment: {}".format(command, comment))
+                jobs.append(
+                    AppJob(
+                        command,
+                        "abdata",
+                        comment,
+                        project=driver_name,
+                        frequency=pool.scrub.frequency if pool.scrub.frequency else "*/15 * * * *",
+                    )
+                )
             if not pool.auto_check:
                 log.info("skipping {}, no auto_check settings defined".format(pool.name))
                 continue
@@ -21,15 +35,25 @@ def perform_update_cron(drivers: Dict[str, Driver], abdata_options: str, cron: A
                 )
                 comment = "{} @ {}".format(pool.name, auto_check.frequency if auto_check.frequency else "default")
                 log.debug("command: {}, comment: {}".format(command, comment))
-                job = cron.job(
-                    command,
-                    comment,
-                    frequency=auto_check.frequency if auto_check.frequency else "0 0 * * *",
-                    project=driver_name,
+                jobs.append(
+                    AppJob(
+                        command,
+                        "abdata",
+                        comment,
+                        project=driver_name,
+                        frequency=auto_check.frequency if auto_check.frequency else "0 0 * * *",
+                    )
                 )
-                if not job.is_valid():
-                    log.error("job not valid! {}".format(comment))
-                    do_write_cron = False
+    return jobs
+
+
+def perform_update_cron(drivers: Dict[str, Driver], abdata_options: str, cron: AppCronTab, log: logging.Logger):
+    do_write_cron = True
+    for app_job in pool_jobs(drivers, abdata_options, log):
+        job = cron.add(app_job)
+        if not job.is_valid():
+            log.error("job not valid! {}".format(app_job.comment))
+            do_write_cron = False
 
     if do_write_cron:
         cron.write()
@@ -0,0 +1,207 @@
+import logging
+import queue
+import select
+import signal
+import subprocess
+import threading
+import time
+
+from typing import Dict, List
+
+from abackup.data import Config, Driver
+from abackup.data.check import perform_check
+
+# frequent events that say nothing about the health of a pool, e.g. every snapshot is a history_event
+IGNORED_ZFS_EVENTS = ["sysevent.fs.zfs.history_event", "sysevent.fs.zfs.config_sync"]
+
+
+class WatchEvent:
+    def __init__(self, source: str, event_class: str, pool: str = None, received: float = None):
+        self.source = source
+        self.event_class = event_class
+        self.pool = pool
+        # time.monotonic() of when the event was read
+        self.received = received if received is not None else time.monotonic()
+
+    def __str__(self):
+        return "WatchEvent: {} {} pool:{}".format(self.source, self.event_class, self.pool)
+
+
+def parse_zpool_event(lines: List[str]):
+    """Parse one event of `zpool events -H -v`, a line with the time and class followed by indented name = value lines"""
+    event_class = lines[0].split()[-1]
+    pool = None
+    for line in lines[1:]:
+        name, separator, value = line.strip().partition(" = ")
+        if separator and name == "pool":
+            pool = value.strip('"')
+    return WatchEvent("zfs", event_class, pool)
+
+
+class ZpoolEventFollower:
+    """Follows `zpool events -f` on a thread, restarting it when it exits"""
+
+    def __init__(self, events: queue.Queue, log: logging.Logger, retry_seconds: float = 60):
+        self.events = events
+        self.log = log
+        self.retry_seconds = retry_seconds
+        self._process = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._process:
+            self._process.terminate()
+
+    def _follow(self):
+        self._process = subprocess.Popen(
+            ["zpool", "events", "-H", "-f", "-v"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        lines = []
+        for line in self._process.stdout:
+            line = line.rstrip("\n")
+            if lines and (not line.strip() or not line[0].isspace()):
+                self.events.put(parse_zpool_event(lines))
+                lines = []
+            if line.strip():
+                lines.append(line)
+        if lines:
+            self.events.put(parse_zpool_event(lines))
+        return self._process.wait(), self._process.stderr.read().strip()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                returncode, stderr = self._follow()
+                if not self._stop.is_set():
+                    self.log.error("zpool events exited with {}: {}".format(returncode, stderr))
+            except OSError as e:
+                self.log.error("Failed to run zpool events: {}".format(e))
+            self._stop.wait(self.retry_seconds)
+
+
+class MdstatWatcher:
+    """Waits on /proc/mdstat on a thread, md wakes up pollers with POLLPRI whenever an array changes"""
+
+    def __init__(self, events: queue.Queue, log: logging.Logger, mdstat_path: str = "/proc/mdstat"):
+        self.events = events
+        self.log = log
+        self.mdstat_path = mdstat_path
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        try:
+            with open(self.mdstat_path, "rb") as mdstat_file:
+                # reading the whole file acknowledges the changes so far
+                mdstat_file.read()
+                poller = select.poll()
+                poller.register(mdstat_file, select.POLLPRI | select.POLLERR)
+                while not self._stop.is_set():
+                    if poller.poll(1000):
+                        mdstat_file.seek(0)
+                        mdstat_file.read()
+                        self.events.put(WatchEvent("mdadm", "mdstat"))
+        except OSError as e:
+            self.log.error("Failed to watch {}: {}".format(self.mdstat_path, e))
+
+
+def pools_for_event(event: WatchEvent, pool_names: Dict[str, List[str]]):
+    """Names of the watched pools an event may concern, by driver name in pool_names"""
+    names = pool_names.get(event.source, [])
+    if event.source == "zfs":
+        if event.event_class in IGNORED_ZFS_EVENTS:
+            return []
+        if event.pool:
+            return [event.pool] if event.pool in names else []
+    return names
+
+
+def perform_watch(
+    config: Config,
+    drivers: List[Driver],
+    notify: str,
+    log: logging.Logger,
+    do_healthchecks: bool = True,
+    debounce_seconds: float = 5,
+    max_delay_seconds: float = 60,
+    interval_seconds: float = 24 * 3600,
+):
+    """Check pools when zfs or md report a change, and all of them every interval_seconds
+
+    Events are debounced: a check runs once no event came for debounce_seconds, or at the latest max_delay_seconds after
+    the first one, and events read before the check of their pool started are dropped.
+    """
+    pool_names = {d.name: [p.name for p in d.pools] for d in drivers if d.pools}
+    if not pool_names:
+        log.error("No pools to watch")
+        return False
+
+    events = queue.Queue()
+    sources = []
+    if "zfs" in pool_names:
+        sources.append(ZpoolEventFollower(events, log))
+    if "mdadm" in pool_names:
+        sources.append(MdstatWatcher(events, log))
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    for source in sources:
+        source.start()
+
+    all_names = [name for names in pool_names.values() for name in names]
+    checked = {}
+    pending = {}
+    last_event = None
+    next_full_check = time.monotonic()
+    log.info("Watching pools: {}".format(", ".join(all_names)))
+    try:
+        while not stop.is_set():
+            now = time.monotonic()
+            if pending and now >= min(last_event + debounce_seconds, min(pending.values()) + max_delay_seconds):
+                names = sorted(pending.keys())
+            elif now >= next_full_check:
+                names = all_names
+                next_full_check = now + interval_seconds
+            else:
+                names = None
+            if names:
+                log.info("--- Checking {}".format(", ".join(names)))
+                for name in names:
+                    checked[name] = now
+                    pending.pop(name, None)
+                perform_check(config, drivers, notify, log, do_healthchecks=do_healthchecks, pool_names=names)
+                log.info("--- Finished check")
+                continue
+
+            timeout = next_full_check - now
+            if pending:
+                timeout = min(
+                    timeout, min(last_event + debounce_seconds, min(pending.values()) + max_delay_seconds) - now
+                )
+            try:
+                # wake up at least every second to notice a stop
+                event = events.get(timeout=max(0, min(timeout, 1)))
+            except queue.Empty:
+                continue
+            names = [name for name in pools_for_event(event, pool_names) if event.received > checked.get(name, 0)]
+            log.info("{}, pools: {}".format(event, ", ".join(names) if names else "-"))
+            for name in names:
+                pending.setdefault(name, event.received)
+                last_event = event.received
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for source in sources:
+            source.stop()
+    log.info("Stopped watching")
+    return True
@@ -0,0 +1,128 @@
+import logging
+import time
+
+from typing import Dict, List
+
+from abackup.fs import DriveIo
+
+SECTOR_SIZE = 512
+
+
+class DiskStats:
+    """One line of /proc/diskstats, see Documentation/admin-guide/iostats.rst"""
+
+    def __init__(
+        self,
+        name: str,
+        reads: int,
+        sectors_read: int,
+        read_ms: int,
+        writes: int,
+        sectors_written: int,
+        write_ms: int,
+        in_flight: int,
+        io_ms: int,
+        weighted_io_ms: int,
+    ):
+        self.name = name
+        self.reads = reads
+        self.sectors_read = sectors_read
+        self.read_ms = read_ms
+        self.writes = writes
+        self.sectors_written = sectors_written
+        self.write_ms = write_ms
+        self.in_flight = in_flight
+        self.io_ms = io_ms
+        self.weighted_io_ms = weighted_io_ms
+
+    def __str__(self):
+        return "DiskStats: {} reads:{}, writes:{}, io_ms:{}".format(self.name, self.reads, self.writes, self.io_ms)
+
+    @classmethod
+    def from_line(cls, line: str):
+        fields = line.split()
+        # major, minor, name, reads, reads merged, sectors read, read ms, writes, writes merged, sectors written,
+        # write ms, in flight, io ms, weighted io ms, ...
+        values = [int(value) for value in fields[3:14]]
+        return cls(
+            fields[2],
+            values[0],
+            values[2],
+            values[3],
+            values[4],
+            values[6],
+            values[7],
+            values[8],
+            values[9],
+            values[10],
+        )
+
+
+def read_diskstats(path: str = "/proc/diskstats"):
+    stats = {}
+    with open(path, "r") as diskstats_file:
+        for line in diskstats_file:
+            if len(line.split()) >= 14:
+                disk_stats = DiskStats.from_line(line)
+                stats[disk_stats.name] = disk_stats
+    return stats
+
+
+def utilization(before: DiskStats, after: DiskStats, elapsed_ms: float):
+    """Fraction of elapsed_ms the device was busy, like the %util of iostat"""
+    if elapsed_ms <= 0:
+        return 0.0
+    return min(1.0, max(0, after.io_ms - before.io_ms) / elapsed_ms)
+
+
+def drive_io(before: DiskStats, after: DiskStats, elapsed_ms: float):
+    """IOPS, throughput and average latency (the await of iostat) between two samples"""
+    seconds = elapsed_ms / 1000
+    if seconds <= 0:
+        return None
+    reads = after.reads - before.reads
+    writes = after.writes - before.writes
+    io_ms = (after.read_ms - before.read_ms) + (after.write_ms - before.write_ms)
+    return DriveIo(
+        reads / seconds,
+        writes / seconds,
+        (after.sectors_read - before.sectors_read) * SECTOR_SIZE / seconds,
+        (after.sectors_written - before.sectors_written) * SECTOR_SIZE / seconds,
+        io_ms / (reads + writes) if reads + writes else None,
+    )
+
+
+def sample_drive_io(devices: List[str], seconds: float, path: str = "/proc/diskstats") -> Dict[str, DriveIo]:
+    """DriveIo of each of devices over the next seconds, devices missing from diskstats are left out"""
+    before = read_diskstats(path)
+    start = time.monotonic()
+    time.sleep(seconds)
+    after = read_diskstats(path)
+    elapsed_ms = (time.monotonic() - start) * 1000
+    return {
+        device: drive_io(before[device], after[device], elapsed_ms)
+        for device in devices
+        if device in before and device in after
+    }
+
+
+def sample_utilization(
+    devices: List[str], seconds: float, path: str = "/proc/diskstats", log: logging.Logger = None
+) -> Dict[str, float]:
+    """Utilization of each of devices over the next seconds, devices missing from diskstats are left out"""
+    before = read_diskstats(path)
+    start = time.monotonic()
+    time.sleep(seconds)
+    after = read_diskstats(path)
+    elapsed_ms = (time.monotonic() - start) * 1000
+    utilizations = {
+        device: utilization(before[device], after[device], elapsed_ms)
+        for device in devices
+        if device in before and device in after
+    }
+    if log:
+        missing = [device for device in devices if device not in utilizations]
+        if missing:
+            log.warning("Devices not found in {}: {}".format(path, ", ".join(missing)))
+        log.debug("sample_utilization({}s): {}".format(seconds, utilizations))
+    return utilizations
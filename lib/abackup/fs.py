@@ -1,9 +1,12 @@
+import datetime
+import fcntl
 import logging
 import os
-import subprocess
+import time
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from enum import Enum, auto
-from typing import List
+from typing import Any, List
 
 # TODO: add permissions
 def ensure_dir_exists(path: str):
@@ -32,6 +35,46 @@ def find_oldest_file(path: str, prefix: str, extension: str = ""):
     return min(filenames, key=lambda fn: os.stat(os.path.join(path, fn)).st_mtime) if filenames else None
 
 
+class FileLock:
+    def __init__(self, path: str, shared: bool = False, timeout: float = None, poll_interval: float = 1.0):
+        self.path = path
+        self.shared = shared
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._file = None
+
+    @property
+    def is_locked(self):
+        return self._file is not None
+
+    def acquire(self, log: logging.Logger = None):
+        lock_file = open(self.path, "a")
+        operation = (fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX) | fcntl.LOCK_NB
+        start = time.monotonic()
+        is_waiting = False
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), operation)
+                self._file = lock_file
+                return True
+            except BlockingIOError:
+                if self.timeout is not None and time.monotonic() - start >= self.timeout:
+                    lock_file.close()
+                    if log:
+                        log.error("Timed out waiting for lock: {}".format(self.path))
+                    return False
+                if log and not is_waiting:
+                    log.info("Waiting for lock: {}".format(self.path))
+                is_waiting = True
+                time.sleep(self.poll_interval)
+
+    def release(self):
+        if self._file:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
 def to_human_readable(num: float, prefix: str = "", suffix: str = "B"):
     start = False
     for unit in ["", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi"]:
@@ -64,21 +107,119 @@ def get_fs_stats(path: str):
     return FSStats(total_size, available)
 
 
-def get_total_size(path: str, log: logging.Logger = None):
-    command_list = ["du", "-s", path]
+def get_fs_used_size(path: str):
+    stats = os.statvfs(path)
+    return (stats.f_blocks - stats.f_bfree) * stats.f_frsize
+
+
+class TreeStats:
+    def __init__(
+        self, total_bytes: int = 0, file_count: int = 0, dir_count: int = 0, newest_mtime: float = None, errors: int = 0
+    ):
+        self.total_bytes = total_bytes
+        self.file_count = file_count
+        self.dir_count = dir_count
+        self.newest_mtime = newest_mtime
+        self.errors = errors
+
+    def __str__(self):
+        return "TreeStats: size:{}, files:{}, dirs:{}, newest:{}, errors:{}".format(
+            self.total_bytes, self.file_count, self.dir_count, self.newest_mtime, self.errors
+        )
+
+
+class _DirectoryScan:
+    # the directory's own entries only, its subdirectories are scanned separately
+    def __init__(
+        self, own_bytes: int, file_count: int, newest_mtime_ns: int, subdirs: List[str], hardlinks: List[tuple]
+    ):
+        self.own_bytes = own_bytes
+        self.file_count = file_count
+        self.newest_mtime_ns = newest_mtime_ns
+        self.subdirs = subdirs
+        self.hardlinks = hardlinks
+
+
+def _scan_directory(path: str):
+    dir_stat = os.lstat(path)
+    # allocated blocks rather than st_size, so sparse holes are not counted, same as du
+    own_bytes = dir_stat.st_blocks * 512
+    file_count = 0
+    newest_mtime_ns = dir_stat.st_mtime_ns
+    subdirs = []
+    hardlinks = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                    continue
+                entry_stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            file_count += 1
+            newest_mtime_ns = max(newest_mtime_ns, entry_stat.st_mtime_ns)
+            if entry_stat.st_nlink > 1:
+                hardlinks.append((entry_stat.st_dev, entry_stat.st_ino, entry_stat.st_blocks * 512))
+            else:
+                own_bytes += entry_stat.st_blocks * 512
+    return _DirectoryScan(own_bytes, file_count, newest_mtime_ns, subdirs, hardlinks)
+
+
+def scan_tree(path: str, log: logging.Logger = None, workers: int = None):
+    """Walk the tree under path in parallel and sum up the allocated size
+
+    Hardlinked files are counted once. Every file is stat-ed on every scan: a file rewritten in place does not change
+    its directory's mtime, so nothing cheaper than a stat tells whether its size changed.
+    """
     if log:
-        log.debug("Getting dir size: {}".format(" ".join(command_list)))
-    run_out = subprocess.run(command_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    if run_out.returncode == 0:
-        size = int(run_out.stdout.split()[0])
-        if log:
-            log.debug("Got {} kilobytes for {}".format(size, path))
-        return size
-    else:
+        log.debug("fs.scan_tree({})".format(path))
+    stats = TreeStats()
+    newest_mtime_ns = None
+    hardlinks = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(_scan_directory, path): "."}
+        while pending:
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                relative_path = pending.pop(future)
+                try:
+                    scan = future.result()
+                except OSError as e:
+                    if relative_path == ".":
+                        if log:
+                            log.warning("Failed to get dir size! {}: {}".format(path, e))
+                        return False
+                    if log:
+                        log.warning("Failed to scan {}: {}".format(os.path.join(path, relative_path), e))
+                    stats.errors += 1
+                    continue
+                stats.dir_count += 1
+                stats.file_count += scan.file_count
+                stats.total_bytes += scan.own_bytes
+                newest_mtime_ns = max(newest_mtime_ns or 0, scan.newest_mtime_ns)
+                for dev, ino, size in scan.hardlinks:
+                    if (dev, ino) not in hardlinks:
+                        hardlinks.add((dev, ino))
+                        stats.total_bytes += size
+                for subdir in scan.subdirs:
+                    subdir_path = os.path.normpath(os.path.join(relative_path, subdir))
+                    pending[executor.submit(_scan_directory, os.path.join(path, subdir_path))] = subdir_path
+
+    stats.newest_mtime = newest_mtime_ns / 10**9 if newest_mtime_ns is not None else None
+    if log:
+        log.debug("Got {} for {}".format(stats, path))
+    return stats
+
+
+def get_total_size(path: str, log: logging.Logger = None):
+    stats = scan_tree(path, log)
+    if stats is False or stats.errors:
         if log:
             log.warning("Failed to get dir size! {}".format(path))
-            log.warning(run_out.stderr)
         return False
+    # in kilobytes, like du -s
+    return (stats.total_bytes + 1023) // 1024
 
 
 class PoolState(Enum):
@@ -88,13 +229,147 @@ class PoolState(Enum):
     ERROR = auto()
 
 
+class DriveIo:
+    def __init__(
+        self, read_iops: float, write_iops: float, read_bytes: float, write_bytes: float, latency_ms: float = None
+    ):
+        # per second averages over the sample interval
+        self.read_iops = read_iops
+        self.write_iops = write_iops
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+        self.latency_ms = latency_ms
+
+    def __str__(self):
+        return "{:.0f} IOPS, {}/s, {}".format(
+            self.iops,
+            to_human_readable(self.throughput),
+            "{:.1f} ms".format(self.latency_ms) if self.latency_ms is not None else "- ms",
+        )
+
+    @property
+    def iops(self):
+        return self.read_iops + self.write_iops
+
+    @property
+    def throughput(self):
+        return self.read_bytes + self.write_bytes
+
+
 class DriveStatus:
-    def __init__(self, drive: str, state: PoolState):
+    def __init__(self, drive: str, state: PoolState, io: DriveIo = None, outlier: str = None):
         self.drive = drive
         self.state = state
+        self.io = io
+        self.outlier = outlier
+
+    def __str__(self):
+        return "{}   {}{}{}".format(
+            self.drive,
+            self.state.name,
+            "   {}".format(self.io) if self.io else "",
+            "   OUTLIER: {}".format(self.outlier) if self.outlier else "",
+        )
+
+
+def _median(values: List[float]):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def flag_io_outliers(
+    drive_status: List[DriveStatus],
+    factor: float = 3.0,
+    min_latency_ms: float = 10.0,
+    min_throughput: float = 1048576,
+):
+    """Flag drives that are factor times slower than the median of their peers
+
+    Each drive is compared to the median of the other drives of the pool, so this works for two-way mirrors too. Idle
+    pools are not judged: latency only counts above min_latency_ms and throughput only when the peers do at least
+    min_throughput bytes per second.
+    """
+    drives = [ds for ds in drive_status if ds.io]
+    for ds in drives:
+        peers = [peer.io for peer in drives if peer is not ds]
+        if not peers:
+            continue
+        reasons = []
+        peer_latencies = [io.latency_ms for io in peers if io.latency_ms is not None]
+        if ds.io.latency_ms is not None and peer_latencies:
+            peer_latency = _median(peer_latencies)
+            if ds.io.latency_ms >= min_latency_ms and ds.io.latency_ms > factor * peer_latency:
+                reasons.append("latency {:.1f} ms vs {:.1f} ms".format(ds.io.latency_ms, peer_latency))
+        peer_throughput = _median([io.throughput for io in peers])
+        if peer_throughput >= min_throughput and ds.io.throughput * factor < peer_throughput:
+            reasons.append(
+                "throughput {}/s vs {}/s".format(
+                    to_human_readable(ds.io.throughput), to_human_readable(peer_throughput)
+                )
+            )
+        ds.outlier = ", ".join(reasons) if reasons else None
+    return [ds for ds in drives if ds.outlier]
+
+
+class SyncProgress:
+    def __init__(
+        self,
+        action: str,
+        completed: int = None,
+        total: int = None,
+        speed: float = None,
+        mismatch_count: int = None,
+    ):
+        # completed and total in bytes, speed in bytes per second
+        self.action = action
+        self.completed = completed
+        self.total = total
+        self.speed = speed
+        self.mismatch_count = mismatch_count
+
+    def __str__(self):
+        if not self.is_active:
+            progress = "{}".format(self.action)
+        else:
+            progress = "{} {}".format(
+                self.action, "{:.2%}".format(self.fraction) if self.fraction is not None else "pending"
+            )
+            if self.speed:
+                progress += " at {}/s".format(to_human_readable(self.speed))
+            if self.eta is not None:
+                progress += ", ETA {}".format(self.eta)
+        if self.mismatch_count:
+            progress += ", mismatch_cnt: {}".format(self.mismatch_count)
+        return "SyncProgress: {}".format(progress)
+
+    @property
+    def is_active(self):
+        return self.action not in ["idle", "frozen"]
+
+    @property
+    def fraction(self):
+        if self.completed is None or not self.total:
+            return None
+        return self.completed / self.total
+
+    @property
+    def eta(self):
+        if self.completed is None or not self.total or not self.speed:
+            return None
+        return datetime.timedelta(seconds=int((self.total - self.completed) / self.speed))
+
+
+class ScrubProgress:
+    def __init__(self, state: str, done: int = None, total: int = None, errors: int = None):
+        # state is one of running, paused, idle or busy (e.g. a resilver or a repair is running instead)
+        self.state = state
+        self.done = done
+        self.total = total
+        self.errors = errors
 
     def __str__(self):
-        return "{}   {}".format(self.drive, self.state.name)
+        return "ScrubProgress: {} {}/{}, errors:{}".format(self.state, self.done, self.total, self.errors)
 
 
 class PoolStatus:
@@ -107,6 +382,8 @@ class PoolStatus:
         total_size: float,
         used: float,
         message: str = None,
+        sync: SyncProgress = None,
+        metrics: Any = None,
     ):
         self.pool = pool
         self.path = path
@@ -115,15 +392,23 @@ class PoolStatus:
         self.drive_status = drive_status
         self.total_size = total_size
         self.used = used
+        self.sync = sync
+        # driver specific, e.g. zfs.ZfsMetrics
+        self.metrics = metrics
+        # thresholds crossed by a pool that may still be healthy
+        self.warnings = []
 
     def __str__(self):
-        return "PoolStatus: {} ({}) -{}- {:.2%} used\n\t{}{}".format(
+        return "PoolStatus: {} ({}) -{}- {} used\n\t{}{}{}{}{}".format(
             self.pool,
             self.path,
             self.state.name,
-            self.utilization,
+            "{:.2%}".format(self.utilization) if self.total_size else "unknown",
             "\n\t".join([str(ds) for ds in self.drive_status]),
+            "\n\t" + str(self.sync) if self.sync else "",
+            "\n\t" + str(self.metrics) if self.metrics else "",
             "\n\t" + self.message if self.message else "",
+            "".join(["\n\tWARNING: " + warning for warning in self.warnings]),
         )
 
     @property
@@ -1,12 +1,34 @@
+import atexit
 import datetime
+import functools
 import logging
 import os
+import time
 from inspect import Traceback, currentframe, getframeinfo
+from typing import Any, Dict
+from uuid import uuid4
 
 import requests
 
 from abackup import notifications
 
+# pings go out over one session from the dispatcher thread once start_dispatcher is called, synchronously until then
+_session = requests.Session()
+_dispatcher = None
+# failed pings are queued in this abackup.outbox.Outbox when set
+_outbox = None
+
+
+def start_dispatcher(log: logging.Logger, flush_timeout: float = 30, outbox: Any = None):
+    """Send pings from a background thread from now on, they are flushed for up to flush_timeout seconds at exit"""
+    global _dispatcher, _outbox
+    _outbox = outbox
+    if _dispatcher:
+        return
+    _dispatcher = notifications.Dispatcher("healthchecks", log)
+    _dispatcher.start()
+    atexit.register(_dispatcher.flush, flush_timeout)
+
 
 def notify_or_log_error(
     notifier: notifications.SlackNotifier,
@@ -55,10 +77,12 @@ def notify_or_log_error(
 
 
 class HealthcheckResult:
-    def __init__(self, is_fail: bool, code: int, message: str = None):
+    def __init__(self, is_fail: bool, code: int, message: str = None, request: Dict[str, Any] = None):
         self.is_fail = is_fail
         self.code = code
         self.message = message
+        # the request that was made, as an outbox entry
+        self.request = request
 
     @classmethod
     def fail(cls, message: str, code: int = -1):
@@ -71,6 +95,27 @@ class HealthcheckResult:
     def is_error(self):
         return self.is_fail or self.code != 200
 
+    def is_transient(self):
+        """A network error, rate limit or server error, worth trying again later"""
+        return self.request is not None and (self.code == -1 or self.code == 429 or self.code >= 500)
+
+
+class HealthcheckRun:
+    """One run of a job, the run id (rid) lets healthchecks.io match its start and final ping"""
+
+    def __init__(self, rid: str = None, started: float = None):
+        self.rid = rid if rid else str(uuid4())
+        # time.monotonic() of the start ping
+        self.started = started if started is not None else time.monotonic()
+
+    def __str__(self):
+        return "HealthcheckRun: {} {:.1f}s".format(self.rid, self.duration)
+
+    @property
+    def duration(self):
+        """Seconds since the start ping"""
+        return time.monotonic() - self.started
+
 
 class Healthcheck:
     def __init__(
@@ -108,53 +153,79 @@ class Healthcheck:
     def is_valid(self):
         return self.base_url and self.uuid
 
-    def _request_get(self, api: str, timeout: int = 5):
-        if not self.is_valid:
+    def _request(self, method: str, ping: str, api: str, data: str = None, params: Dict[str, str] = None):
+        if not self.is_valid():
             return HealthcheckResult.fail("No base_url or uuid configured!")
-        try:
-            response = requests.get("{}/{}{}".format(self.base_url, self.uuid, api), timeout=timeout)
-            return HealthcheckResult.success(response.status_code, response.text)
-        except requests.exceptions.RequestException:
-            return HealthcheckResult.fail("Exception occurred while requesting GET!")
-
-    def _request_post(self, api: str, data: str = None, timeout: int = 5):
-        if not self.is_valid:
-            return HealthcheckResult.fail("No base_url or uuid configured!")
-        try:
-            response = requests.post("{}/{}{}".format(self.base_url, self.uuid, api), data=data, timeout=timeout)
-            return HealthcheckResult.success(response.status_code, response.text)
-        except requests.exceptions.RequestException:
-            return HealthcheckResult.fail("Exception occurred while requesting POST!")
+        check_url = "{}/{}".format(self.base_url, self.uuid)
+        request = {"check": check_url, "ping": ping, "method": method, "url": check_url + api, "params": params}
+        if data is not None:
+            request["data"] = data
+        result = send_request(request)
+        result.request = request
+        return result
 
-    def notify_start(self):
+    def notify_start(self, run: HealthcheckRun = None):
         if not self.do_notify_start:
             return HealthcheckResult.success(message="skipping healthcheck start ping")
-        return self._request_get("/start")
+        return self._request("GET", "start", "/start", params={"rid": run.rid} if run else None)
 
-    def notify_success(self):
+    def notify_success(self, run: HealthcheckRun = None, duration: float = None):
         if not self.do_notify_success:
             return HealthcheckResult.success(message="skipping healthcheck success ping")
-        return self._request_get("")
+        params = {"rid": run.rid} if run else None
+        if self.do_include_messages and duration is not None:
+            return self._request("POST", "success", "", data="Duration: {:.1f}s".format(duration), params=params)
+        return self._request("GET", "success", "", params=params)
 
-    def notify_failure(self, message: str = None):
+    def notify_failure(self, message: str = None, run: HealthcheckRun = None, duration: float = None):
         if not self.do_notify_failure:
             return HealthcheckResult.success(message="skipping healthcheck failure ping")
+        params = {"rid": run.rid} if run else None
         if self.do_include_messages:
-            return self._request_post("/fail", data=message)
+            if duration is not None:
+                message = "{}\nDuration: {:.1f}s".format(message if message else "", duration).lstrip()
+            return self._request("POST", "fail", "/fail", data=message, params=params)
         else:
-            return self._request_get("/fail")
+            return self._request("GET", "fail", "/fail", params=params)
 
 
-def perform_healthcheck_start(
-    default_check: Healthcheck,
-    check: Healthcheck,
+def send_request(request: Dict[str, Any], timeout: int = 5):
+    """Make a ping request, as described by Healthcheck._request"""
+    try:
+        response = _session.request(
+            request["method"],
+            request["url"],
+            params=request["params"],
+            data=request["data"] if "data" in request else None,
+            timeout=timeout,
+        )
+        return HealthcheckResult.success(response.status_code, response.text)
+    except requests.exceptions.RequestException:
+        return HealthcheckResult.fail("Exception occurred while requesting {}!".format(request["method"]))
+
+
+def resend_ping(entry: Dict[str, Any], log: logging.Logger):
+    """Send a health check entry of the outbox once, False if it should be kept for later"""
+    result = send_request(entry)
+    result.request = entry
+    if result.is_error() and not result.is_transient():
+        log.error("Dropping {} ping for {} from outbox: code: {}".format(entry["ping"], entry["check"], result.code))
+    return not result.is_transient()
+
+
+def _send_ping(
+    ping,
     name: str,
     notifier: notifications.SlackNotifier,
     notify_mode: notifications.Mode,
     log: logging.Logger,
 ):
-    result = default_check.override(check).notify_start()
-    if result.is_error():
+    result = ping()
+    if result.is_error() and result.is_transient() and _outbox:
+        # most likely the network is down, so slack is not tried for the error either
+        log.warning("Healthcheck ping for {} failed, queueing it in the outbox: {}".format(name, result.message))
+        _outbox.append({"kind": "healthcheck", **result.request}, log)
+    elif result.is_error():
         notify_or_log_error(
             notifier,
             name,
@@ -166,6 +237,45 @@ def perform_healthcheck_start(
         )
 
 
+def _dispatch_ping(
+    ping,
+    name: str,
+    notifier: notifications.SlackNotifier,
+    notify_mode: notifications.Mode,
+    log: logging.Logger,
+):
+    if not _dispatcher:
+        _send_ping(ping, name, notifier, notify_mode, log)
+    elif not _dispatcher.submit(_send_ping, ping, name, notifier, notify_mode, log):
+        log.error("Healthcheck queue is full, dropping ping for {}".format(name))
+
+
+def drain_outbox(outbox: Any, notifier: notifications.SlackNotifier, log: logging.Logger):
+    """Queue sending the entries of outbox left by earlier runs, behind the pings of this run"""
+    senders = {"healthcheck": functools.partial(resend_ping, log=log)}
+    if notifier:
+        senders["slack"] = functools.partial(notifier.resend, log=log)
+    if not _dispatcher:
+        outbox.drain(senders, log)
+    elif not _dispatcher.submit(outbox.drain, senders, log):
+        log.error("Healthcheck queue is full, not draining the outbox")
+
+
+def perform_healthcheck_start(
+    default_check: Healthcheck,
+    check: Healthcheck,
+    name: str,
+    notifier: notifications.SlackNotifier,
+    notify_mode: notifications.Mode,
+    log: logging.Logger,
+):
+    """Queue the start ping, the returned run is passed on to perform_healthcheck"""
+    run = HealthcheckRun()
+    log.debug("perform_healthcheck_start({}): {}".format(name, run.rid))
+    _dispatch_ping(functools.partial(default_check.override(check).notify_start, run), name, notifier, notify_mode, log)
+    return run
+
+
 def perform_healthcheck(
     default_check: Healthcheck,
     check: Healthcheck,
@@ -175,18 +285,12 @@ def perform_healthcheck(
     log: logging.Logger,
     is_fail: bool = False,
     message: str = None,
+    run: HealthcheckRun = None,
 ):
+    duration = run.duration if run else None
+    log.debug("perform_healthcheck({}): {}".format(name, run))
     if is_fail:
-        result = default_check.override(check).notify_failure(message)
+        ping = functools.partial(default_check.override(check).notify_failure, message, run, duration)
     else:
-        result = default_check.override(check).notify_success()
-    if result.is_error():
-        notify_or_log_error(
-            notifier,
-            name,
-            notify_mode,
-            log,
-            frame_info=getframeinfo(currentframe()),
-            response_code=result.code,
-            response_message=result.message,
-        )
+        ping = functools.partial(default_check.override(check).notify_success, run, duration)
+    _dispatch_ping(ping, name, notifier, notify_mode, log)
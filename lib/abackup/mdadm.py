@@ -1,54 +1,216 @@
 import logging
+import os
+import threading
 import mdstat
 
-from abackup.fs import DriveStatus, PoolState, PoolStatus, get_fs_stats
+from typing import Any, Dict
 
+from abackup import diskstats
+from abackup.fs import DriveStatus, PoolState, PoolStatus, ScrubProgress, SyncProgress, get_fs_stats
 
-def pool_status(name: str, path: str, log: logging.Logger = None):
-    if log:
-        log.debug("pool_status({}, {})".format(name, path))
-    stats = get_fs_stats(path)
+
+def _read_sysfs_value(md_path: str, attribute: str):
+    try:
+        with open(os.path.join(md_path, attribute), "r") as attribute_file:
+            return attribute_file.read().strip()
+    except OSError:
+        return None
+
+
+def write_sysfs_value(sysfs_root: str, name: str, attribute: str, value: str, log: logging.Logger = None):
+    path = os.path.join(sysfs_root, "block", name, "md", attribute)
     if log:
-        log.debug("pool_status({}, {}): get_fs_stats({}):".format(name, path, path))
-        log.debug(stats)
+        log.info("echo {} > {}".format(value, path))
+    try:
+        with open(path, "w") as attribute_file:
+            attribute_file.write(value)
+        return True
+    except OSError as e:
+        if log:
+            log.error("Failed to write {}: {}".format(path, e))
+        return False
+
+
+def read_sync_progress(sysfs_root: str, name: str):
+    """Read the resync/check progress of md device name from <sysfs_root>/block/<name>/md"""
+    md_path = os.path.join(sysfs_root, "block", name, "md")
+    action = _read_sysfs_value(md_path, "sync_action")
+    if action is None:
+        return None
+
+    completed = None
+    total = None
+    sync_completed = _read_sysfs_value(md_path, "sync_completed")
+    if sync_completed and "/" in sync_completed:
+        # in 512 byte sectors
+        completed, total = [int(sectors) * 512 for sectors in sync_completed.split("/")]
+    sync_speed = _read_sysfs_value(md_path, "sync_speed")
+    # in KiB/s, averaged over the last 30 seconds
+    speed = int(sync_speed) * 1024 if sync_speed and sync_speed.isdigit() else None
+    mismatch_cnt = _read_sysfs_value(md_path, "mismatch_cnt")
+    mismatch_count = int(mismatch_cnt) if mismatch_cnt and mismatch_cnt.isdigit() else None
+    return SyncProgress(action, completed, total, speed, mismatch_count)
+
+
+def mdstat_sync_progress(pool_data: Dict[str, Any]):
+    """Resync progress from the /proc/mdstat entry, for when sysfs is not available"""
+    resync = pool_data["resync"] if "resync" in pool_data else None
+    if not resync:
+        return None
+    speed = resync["speed"]
+    speed = int(speed[: -len("K/sec")]) * 1024 if speed and speed.endswith("K/sec") else None
+    # in 1 KiB blocks
+    return SyncProgress(
+        resync["operation"],
+        resync["resynced"] * 1024 if resync["total"] else None,
+        resync["total"] * 1024 if resync["total"] else None,
+        speed,
+    )
 
-    mdstat_data = mdstat.parse()
-    if name not in mdstat_data["devices"]:
+
+class MdadmCollector:
+    """Reads /proc/mdstat and the md sysfs attributes of all arrays once, cached for the run"""
+
+    def __init__(
+        self,
+        log: logging.Logger = None,
+        mdstat_path: str = "/proc/mdstat",
+        sysfs_root: str = "/sys",
+        diskstats_path: str = "/proc/diskstats",
+        io_sample_seconds: float = None,
+    ):
+        self.log = log
+        self.mdstat_path = mdstat_path
+        self.sysfs_root = sysfs_root
+        self.diskstats_path = diskstats_path
+        self.io_sample_seconds = io_sample_seconds
+        self._devices = None
+        self._sync = None
+        self._io = None
+        self._lock = threading.Lock()
+
+    def _collect(self):
+        if self.log:
+            self.log.debug("MdadmCollector: reading {} and {}".format(self.mdstat_path, self.sysfs_root))
+        self._devices = mdstat.parse(self.mdstat_path)["devices"]
+        self._sync = {}
+        for name, pool_data in self._devices.items():
+            sync = read_sync_progress(self.sysfs_root, name)
+            self._sync[name] = sync if sync else mdstat_sync_progress(pool_data)
+        self._io = {}
+        if self.io_sample_seconds:
+            devices = [disk for pool_data in self._devices.values() for disk in pool_data["disks"].keys()]
+            self._io = diskstats.sample_drive_io(devices, self.io_sample_seconds, self.diskstats_path)
+
+    def pool_status(self, name: str, path: str):
+        log = self.log
         if log:
-            log.error("Pool {} not found in mdstat!".format(name))
-        return PoolStatus(name, path, PoolState.ERROR, [], stats.total_size, stats.used)
-    pool_data = mdstat_data["devices"][name]
-    if log:
-        log.debug("pool_status({}, {}): pool_data:".format(name, path))
-        log.debug(pool_data)
-
-    is_active = pool_data["active"]
-    raid_disks = pool_data["status"]["raid_disks"]
-    non_degraded_disks = pool_data["status"]["non_degraded_disks"]
-    disks = pool_data["disks"]
-    drive_status = [
-        DriveStatus(disk_name, PoolState.DOWN if raw["faulty"] else PoolState.HEALTHY)
-        for disk_name, raw in disks.items()
-    ]
+            log.debug("pool_status({}, {})".format(name, path))
+        stats = get_fs_stats(path)
+        if log:
+            log.debug("pool_status({}, {}): get_fs_stats({}):".format(name, path, path))
+            log.debug(stats)
+
+        # pools are checked concurrently, the first one collects for all of them
+        with self._lock:
+            if self._devices is None:
+                self._collect()
+        if name not in self._devices:
+            if log:
+                log.error("Pool {} not found in mdstat!".format(name))
+            return PoolStatus(name, path, PoolState.ERROR, [], stats.total_size, stats.used)
+        pool_data = self._devices[name]
+        sync = self._sync[name]
+        if log:
+            log.debug("pool_status({}, {}): pool_data:".format(name, path))
+            log.debug(pool_data)
+            log.debug("pool_status({}, {}): sync: {}".format(name, path, sync))
+
+        is_active = pool_data["active"]
+        raid_disks = pool_data["status"]["raid_disks"]
+        non_degraded_disks = pool_data["status"]["non_degraded_disks"]
+        disks = pool_data["disks"]
+        drive_status = [
+            DriveStatus(
+                disk_name,
+                PoolState.DOWN if raw["faulty"] else PoolState.HEALTHY,
+                self._io[disk_name] if disk_name in self._io else None,
+            )
+            for disk_name, raw in disks.items()
+        ]
+
+        if log:
+            log.debug("pool_status({}, {}): is_active: {}".format(name, path, is_active))
+            log.debug("pool_status({}, {}): raid_disks: {}".format(name, path, raid_disks))
+            log.debug("pool_status({}, {}): non_degraded_disks: {}".format(name, path, non_degraded_disks))
+            log.debug(
+                "pool_status({}, {}): drive_status: {}".format(name, path, "\t".join([str(ds) for ds in drive_status]))
+            )
+
+        pool_state = PoolState.HEALTHY
+        if not is_active:
+            pool_state = PoolState.DOWN
+        elif non_degraded_disks < raid_disks:
+            pool_state = PoolState.DEGRADED
+        else:
+            for ds in drive_status:
+                if ds.state == PoolState.DOWN:
+                    pool_state = PoolState.DEGRADED
+        if log:
+            log.info("pool_status({}, {}): pool_state: {}".format(name, path, name))
+
+        return PoolStatus(name, path, pool_state, drive_status, stats.total_size, stats.used, sync=sync)
+
+
+def pool_status(name: str, path: str, log: logging.Logger = None):
+    return MdadmCollector(log).pool_status(name, path)
+
+
+# sync_speed_max in KiB/s while a check is paused, md has no real pause for a running check
+PAUSED_SYNC_SPEED = 1
+
+
+def _is_speed_paused(sysfs_root: str, name: str):
+    speed_max = _read_sysfs_value(os.path.join(sysfs_root, "block", name, "md"), "sync_speed_max")
+    # e.g. "200000 (system)" or "1 (local)"
+    return speed_max is not None and speed_max.split()[0] == str(PAUSED_SYNC_SPEED) and "local" in speed_max
+
+
+def scrub_progress(name: str, sysfs_root: str = "/sys"):
+    sync = read_sync_progress(sysfs_root, name)
+    if not sync:
+        return None
+    if sync.action == "idle":
+        return ScrubProgress("idle", errors=sync.mismatch_count)
+    if sync.action != "check":
+        return ScrubProgress("busy", sync.completed, sync.total)
+    is_paused = _is_speed_paused(sysfs_root, name)
+    return ScrubProgress("paused" if is_paused else "running", sync.completed, sync.total, sync.mismatch_count)
+
+
+def scrub(name: str, log: logging.Logger = None, pause: bool = False, sysfs_root: str = "/sys"):
+    """Start a check of md array name, pause it by limiting sync_speed_max or resume it"""
+    if pause:
+        return write_sysfs_value(sysfs_root, name, "sync_speed_max", str(PAUSED_SYNC_SPEED), log)
+    if not write_sysfs_value(sysfs_root, name, "sync_speed_max", "system", log):
+        return False
+    progress = scrub_progress(name, sysfs_root)
+    if progress and progress.state == "idle":
+        return write_sysfs_value(sysfs_root, name, "sync_action", "check", log)
+    return True
+
+
+def unpause(name: str, log: logging.Logger = None, sysfs_root: str = "/sys"):
+    """Lift the sync_speed_max of a paused check of md array name, without starting a check
+
+    The limit applies to every sync of the array, so it has to go when the check ends or a recovery takes over.
+    """
+    if not _is_speed_paused(sysfs_root, name):
+        return True
+    return write_sysfs_value(sysfs_root, name, "sync_speed_max", "system", log)
 
-    if log:
-        log.debug("pool_status({}, {}): is_active: {}".format(name, path, is_active))
-        log.debug("pool_status({}, {}): raid_disks: {}".format(name, path, raid_disks))
-        log.debug("pool_status({}, {}): non_degraded_disks: {}".format(name, path, non_degraded_disks))
-        log.debug(
-            "pool_status({}, {}): drive_status: {}".format(name, path, "\t".join([str(ds) for ds in drive_status]))
-        )
-
-    pool_state = PoolState.HEALTHY
-    if not is_active:
-        pool_state = PoolState.DOWN
-    elif non_degraded_disks < raid_disks:
-        pool_state = PoolState.DEGRADED
-    else:
-        for ds in drive_status:
-            if ds.state == PoolState.DOWN:
-                pool_state = PoolState.DEGRADED
-    if log:
-        log.info("pool_status({}, {}): pool_state: {}".format(name, path, name))
 
-    return PoolStatus(name, path, pool_state, drive_status, stats.total_size, stats.used)
+def pool_devices(name: str, mdstat_path: str = "/proc/mdstat"):
+    """Kernel names of the member devices of md array name, as used in /proc/diskstats"""
+    devices = mdstat.parse(mdstat_path)["devices"]
+    return list(devices[name]["disks"].keys()) if name in devices else []
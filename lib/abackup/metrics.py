@@ -0,0 +1,158 @@
+import datetime
+import os
+import re
+
+from typing import Dict, List, Tuple
+
+from abackup.usage import CommandUsage
+
+# every metric written, name: (type, help), the names are part of the interface so only ever add to this
+METRICS = {
+    # abackup, labels: project, container
+    "abackup_backup_duration_seconds": ("gauge", "Duration of the last backup of the container"),
+    "abackup_backup_bytes": ("gauge", "Bytes of the backup files written by the last backup"),
+    "abackup_backup_throughput_bytes_per_second": ("gauge", "Bytes written per second by the last backup"),
+    "abackup_backup_failed_commands": ("gauge", "Commands that failed in the last backup"),
+    "abackup_backup_exit_status": ("gauge", "0 if the last backup succeeded, 1 if it failed"),
+    "abackup_backup_last_run_timestamp_seconds": ("gauge", "Unix time the last backup finished"),
+    "abackup_backup_last_success_timestamp_seconds": ("gauge", "Unix time the last successful backup finished"),
+    "abackup_backup_cpu_user_seconds": ("gauge", "User CPU time of the commands run by the last backup"),
+    "abackup_backup_cpu_system_seconds": ("gauge", "System CPU time of the commands run by the last backup"),
+    "abackup_backup_max_rss_bytes": ("gauge", "Largest max RSS of the commands run by the last backup"),
+    "abackup_backup_read_bytes": ("gauge", "Bytes read from storage by the commands run by the last backup"),
+    "abackup_backup_write_bytes": ("gauge", "Bytes written to storage by the commands run by the last backup"),
+    # absync, labels: data, sync, driver (rsync or restic)
+    "absync_sync_duration_seconds": ("gauge", "Duration of the last sync"),
+    "absync_sync_bytes": ("gauge", "Bytes transferred by rsync or added to the repository by restic in the last sync"),
+    "absync_sync_throughput_bytes_per_second": ("gauge", "Bytes transferred or added per second by the last sync"),
+    "absync_sync_files": ("gauge", "Files transferred by rsync or new and changed for restic in the last sync"),
+    "absync_sync_exit_status": ("gauge", "0 if the last sync succeeded, 1 if it failed"),
+    "absync_sync_last_run_timestamp_seconds": ("gauge", "Unix time the last sync finished"),
+    "absync_sync_last_success_timestamp_seconds": ("gauge", "Unix time the last successful sync finished"),
+    "absync_sync_cpu_user_seconds": ("gauge", "User CPU time of the commands run by the last sync"),
+    "absync_sync_cpu_system_seconds": ("gauge", "System CPU time of the commands run by the last sync"),
+    "absync_sync_max_rss_bytes": ("gauge", "Largest max RSS of the commands run by the last sync"),
+    "absync_sync_read_bytes": ("gauge", "Bytes read from storage by the commands run by the last sync"),
+    "absync_sync_write_bytes": ("gauge", "Bytes written to storage by the commands run by the last sync"),
+    # absync restic backup summary of the last sync, labels: data, sync, driver
+    "absync_restic_files_new": ("gauge", "files_new of the restic backup summary"),
+    "absync_restic_files_changed": ("gauge", "files_changed of the restic backup summary"),
+    "absync_restic_files_unmodified": ("gauge", "files_unmodified of the restic backup summary"),
+    "absync_restic_dirs_new": ("gauge", "dirs_new of the restic backup summary"),
+    "absync_restic_dirs_changed": ("gauge", "dirs_changed of the restic backup summary"),
+    "absync_restic_data_added_bytes": ("gauge", "data_added of the restic backup summary"),
+    "absync_restic_total_files_processed": ("gauge", "total_files_processed of the restic backup summary"),
+    "absync_restic_total_bytes_processed": ("gauge", "total_bytes_processed of the restic backup summary"),
+    # absync restic maintenance, labels: repo
+    "absync_maintenance_duration_seconds": ("gauge", "Duration of the last maintenance of the repository"),
+    "absync_maintenance_exit_status": ("gauge", "0 if the last maintenance succeeded, 1 if it failed"),
+    "absync_maintenance_last_run_timestamp_seconds": ("gauge", "Unix time the last maintenance finished"),
+    "absync_maintenance_last_success_timestamp_seconds": ("gauge", "Unix time of the last successful maintenance"),
+    "absync_maintenance_cpu_user_seconds": ("gauge", "User CPU time of the commands run by the last maintenance"),
+    "absync_maintenance_cpu_system_seconds": ("gauge", "System CPU time of the commands run by the last maintenance"),
+    "absync_maintenance_max_rss_bytes": ("gauge", "Largest max RSS of the commands run by the last maintenance"),
+    "absync_maintenance_read_bytes": ("gauge", "Bytes read from storage by the commands run by the last maintenance"),
+    "absync_maintenance_write_bytes": ("gauge", "Bytes written to storage by the commands run by the last maintenance"),
+    # abdata, labels: pool
+    "abdata_pool_duration_seconds": ("gauge", "Duration of getting the status of the pool in the last check"),
+    "abdata_pool_state": ("gauge", "1 for the state of the pool in the last check, 0 for the others, label: state"),
+    "abdata_pool_used_bytes": ("gauge", "Used bytes of the pool"),
+    "abdata_pool_size_bytes": ("gauge", "Total bytes of the pool"),
+    "abdata_pool_utilization_ratio": ("gauge", "Used fraction of the pool"),
+    "abdata_pool_slow_drives": ("gauge", "Drives of the pool flagged as slow in the last check"),
+    "abdata_pool_warnings": ("gauge", "Thresholds exceeded by the pool in the last check"),
+    "abdata_pool_fragmentation_percent": ("gauge", "Free space fragmentation of the zfs pool"),
+    "abdata_pool_dedup_ratio": ("gauge", "Dedup ratio of the zfs pool"),
+    "abdata_arc_hit_ratio": ("gauge", "ARC hit ratio while the zfs pool was checked"),
+    "abdata_pool_exit_status": ("gauge", "0 if the pool was healthy in the last check, 1 if not"),
+    "abdata_pool_last_run_timestamp_seconds": ("gauge", "Unix time of the last check of the pool"),
+    "abdata_pool_last_success_timestamp_seconds": ("gauge", "Unix time of the last check the pool was healthy in"),
+}
+
+
+def _escape(value: str):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]):
+    if not labels:
+        return ""
+    return "{{{}}}".format(",".join('{}="{}"'.format(k, _escape(v)) for k, v in sorted(labels.items())))
+
+
+class MetricsFile:
+    """The metrics of one job in the node_exporter textfile format, rewritten as a whole by every run of the job"""
+
+    def __init__(self, directory: str, job: str):
+        self.path = os.path.join(directory, "{}.prom".format(re.sub(r"[^A-Za-z0-9_.-]", "_", job)))
+        self._samples = {}
+
+    def add(self, name: str, value: float, labels: Dict[str, str] = None):
+        if name not in METRICS:
+            raise KeyError("Undocumented metric: {}".format(name))
+        if value is not None:
+            self._samples.setdefault(name, []).append((labels if labels else {}, value))
+
+    def previous_value(self, name: str, labels: Dict[str, str] = None):
+        """The value of a sample in the file written by the previous run, None if there is none"""
+        prefix = "{}{} ".format(name, _format_labels(labels))
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "r") as prom_file:
+            for line in prom_file:
+                if line.startswith(prefix):
+                    try:
+                        return float(line[len(prefix) :])
+                    except ValueError:
+                        return None
+        return None
+
+    def write(self):
+        lines = []
+        for name in sorted(self._samples.keys()):
+            metric_type, help_text = METRICS[name]
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            samples: List[Tuple[Dict[str, str], float]] = self._samples[name]
+            for labels, value in samples:
+                lines.append("{}{} {}".format(name, _format_labels(labels), float(value)))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # node_exporter only reads *.prom, so it never sees a partial file
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "w") as prom_file:
+            prom_file.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+
+
+def add_job_metrics(
+    metrics_file: MetricsFile,
+    prefix: str,
+    labels: Dict[str, str],
+    success: bool,
+    duration: float = None,
+    size: float = None,
+    usage: CommandUsage = None,
+):
+    """The metrics every job has, <prefix>_duration_seconds, _exit_status and the last run and success timestamps
+
+    A failed run keeps the last success timestamp of the previous file. With a size, _bytes and
+    _throughput_bytes_per_second are added as well, with the usage of the commands run by the job _cpu_user_seconds,
+    _cpu_system_seconds, _max_rss_bytes, _read_bytes and _write_bytes.
+    """
+    now = datetime.datetime.now().timestamp()
+    metrics_file.add("{}_duration_seconds".format(prefix), duration, labels)
+    metrics_file.add("{}_exit_status".format(prefix), 0 if success else 1, labels)
+    metrics_file.add("{}_last_run_timestamp_seconds".format(prefix), now, labels)
+    last_success_name = "{}_last_success_timestamp_seconds".format(prefix)
+    last_success = now if success else metrics_file.previous_value(last_success_name, labels)
+    metrics_file.add(last_success_name, last_success, labels)
+    if size is not None:
+        metrics_file.add("{}_bytes".format(prefix), size, labels)
+        if duration:
+            metrics_file.add("{}_throughput_bytes_per_second".format(prefix), size / duration, labels)
+    if usage is not None:
+        metrics_file.add("{}_cpu_user_seconds".format(prefix), usage.user_time, labels)
+        metrics_file.add("{}_cpu_system_seconds".format(prefix), usage.system_time, labels)
+        metrics_file.add("{}_max_rss_bytes".format(prefix), usage.max_rss, labels)
+        metrics_file.add("{}_read_bytes".format(prefix), usage.read_bytes, labels)
+        metrics_file.add("{}_write_bytes".format(prefix), usage.write_bytes, labels)
@@ -1,3 +1,8 @@
+import atexit
+import logging
+import threading
+import time
+
 from enum import Enum
 from typing import Any, Dict, List
 
@@ -16,7 +21,12 @@ class SlackResponse:
         self.message = message
 
     def is_error(self):
-        return self.code != 200
+        # 202 is returned for notifications that are queued to be sent in the background
+        return self.code not in [200, 202]
+
+    def is_transient(self):
+        """A network error, rate limit or server error, worth trying again later"""
+        return self.code == -1 or self.code == 429 or self.code >= 500
 
 
 class SlackField:
@@ -124,17 +134,152 @@ def build_slack_data(
     return SlackData(attachments=[attachment])
 
 
+class Dispatcher:
+    """Runs queued calls in the order they were submitted on a background thread"""
+
+    def __init__(self, name: str, log: logging.Logger, max_queue: int = 100):
+        self.name = name
+        self.log = log
+        self.max_queue = max_queue
+        self._queue = []
+        self._pending = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, function, *args):
+        """Queue function(*args), False if the queue is full"""
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                return False
+            self._queue.append((function, args))
+            self._pending += 1
+            self._condition.notify_all()
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                function, args = self._queue.pop(0)
+            try:
+                function(*args)
+            except Exception:
+                self.log.exception("{}: queued call failed".format(self.name))
+            finally:
+                with self._condition:
+                    self._pending -= 1
+                    self._condition.notify_all()
+
+    def flush(self, timeout: float):
+        """Wait up to timeout seconds for the queued calls to finish, False if some did not"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.log.error("{}: {} queued call(s) not done after {}s".format(self.name, self._pending, timeout))
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+
 class SlackNotifier:
-    def __init__(self, api_url: str, username: str = None, channel: str = None):
+    def __init__(
+        self,
+        api_url: str,
+        username: str = None,
+        channel: str = None,
+        timeout: float = 10,
+        retries: int = 3,
+        min_interval: float = 1,
+        background: bool = True,
+        flush_timeout: float = 30,
+    ):
         self.api_url = api_url
         self.username = username
         self.channel = channel
+        self.timeout = timeout
+        self.retries = retries
+        self.min_interval = min_interval
+        self.background = background
+        self.flush_timeout = flush_timeout
+        self.dispatcher = None
+        # an abackup.outbox.Outbox for notifications that could not be delivered
+        self.outbox = None
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._last_post = None
+
+    def start_dispatcher(self, log: logging.Logger):
+        """Queue notifications from now on, they are flushed for up to flush_timeout seconds at exit"""
+        if not self.background or self.dispatcher:
+            return
+        self.dispatcher = Dispatcher("slack", log)
+        self.dispatcher.start()
+        atexit.register(self.dispatcher.flush, self.flush_timeout)
+
+    def _deliver(self, data: SlackData):
+        response = self.notify_raw(data)
+        if response.is_error() and response.is_transient() and self.outbox:
+            self.outbox.append({"kind": "slack", "data": data.to_data()})
+            return SlackResponse(
+                202, "queued in outbox after: code: {} message: {}".format(response.code, response.message)
+            )
+        return response
+
+    def _send(self, data: SlackData):
+        response = self._deliver(data)
+        if response.is_error():
+            self.dispatcher.log.error(
+                "Error during notify: code: {} message: {}".format(response.code, response.message)
+            )
+        elif response.code == 202:
+            self.dispatcher.log.warning("Notify: {}".format(response.message))
+
+    def resend(self, entry: Dict[str, Any], log: logging.Logger):
+        """Send a slack entry of the outbox once, False if it should be kept for later"""
+        try:
+            response = self._post(entry["data"])
+        except requests.exceptions.RequestException as e:
+            log.debug("resend: {}".format(e))
+            return False
+        result = SlackResponse(response.status_code, response.text)
+        if result.is_error() and not result.is_transient():
+            log.error("Dropping notification from outbox: code: {} message: {}".format(result.code, result.message))
+        return not result.is_transient()
+
+    def _post(self, payload: Dict[str, Any]):
+        # slack accepts about one message per second on a webhook
+        with self._lock:
+            if self._last_post is not None:
+                time.sleep(max(0.0, self._last_post + self.min_interval - time.monotonic()))
+            try:
+                return self._session.post(self.api_url, json=payload, timeout=self.timeout)
+            finally:
+                self._last_post = time.monotonic()
 
     def notify_raw(self, data: SlackData):
         data.username = self.username
         data.channel = self.channel
-        response = requests.post(self.api_url, json=data.to_data())
-        return SlackResponse(response.status_code, response.text)
+        delay = 1
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                response = self._post(data.to_data())
+                result = SlackResponse(response.status_code, response.text)
+                if response.status_code != 429 and response.status_code < 500:
+                    return result
+                retry_after = response.headers.get("Retry-After")
+            except requests.exceptions.RequestException as e:
+                result = SlackResponse(-1, "Exception occurred while posting to slack: {}".format(e))
+            if attempt < self.retries:
+                time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else delay)
+                delay = min(delay * 2, 30)
+        return result
 
     def notify(
         self,
@@ -148,4 +293,9 @@ class SlackNotifier:
     ):
         if not fields:
             fields = {}
-        return self.notify_raw(build_slack_data(title, severity, description, fields, file_name, line_number, time))
+        data = build_slack_data(title, severity, description, fields, file_name, line_number, time)
+        if self.dispatcher:
+            if not self.dispatcher.submit(self._send, data):
+                return SlackResponse(-1, "Notification queue is full, dropping notification")
+            return SlackResponse(202, "queued")
+        return self._deliver(data)
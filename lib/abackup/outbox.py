@@ -0,0 +1,115 @@
+import datetime
+import json
+import logging
+import os
+
+from typing import Any, Callable, Dict, List
+from uuid import uuid4
+
+from abackup import fs
+
+# a sender returns True when the entry was delivered or can never be, False to keep it for a later run
+Sender = Callable[[Dict[str, Any]], bool]
+
+
+class Outbox:
+    """Notifications and health check pings that could not be delivered, kept in a JSON lines file
+
+    Entries are dicts with a "kind" ("slack" or "healthcheck"), the rest of their content is up to their sender.
+    Health check entries name their "check" and "ping", a start ping is dropped once a later ping of its check is queued.
+    """
+
+    def __init__(self, path: str, max_entries: int = 500):
+        self.path = path
+        self.max_entries = max_entries
+
+    def __str__(self):
+        return "Outbox: {}".format(self.path)
+
+    def _lock(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        lock = fs.FileLock("{}.lock".format(self.path), poll_interval=0.05)
+        lock.acquire()
+        return lock
+
+    def _read(self):
+        entries = []
+        if os.path.exists(self.path):
+            with open(self.path, "r") as outbox_file:
+                for line in outbox_file:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        return entries
+
+    def _write(self, entries: List[Dict[str, Any]]):
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "w") as outbox_file:
+            for entry in entries:
+                outbox_file.write("{}\n".format(json.dumps(entry)))
+        os.replace(tmp_path, self.path)
+
+    def entries(self):
+        lock = self._lock()
+        try:
+            return self._read()
+        finally:
+            lock.release()
+
+    def append(self, entry: Dict[str, Any], log: logging.Logger = None):
+        entry = {"id": uuid4().hex, "created": datetime.datetime.now().timestamp(), **entry}
+        lock = self._lock()
+        try:
+            entries = self._read()
+            if entry["kind"] == "healthcheck":
+                entries = [
+                    e
+                    for e in entries
+                    if not (e["kind"] == "healthcheck" and e["check"] == entry["check"] and e["ping"] == "start")
+                ]
+            entries.append(entry)
+            if len(entries) > self.max_entries:
+                if log:
+                    log.warning("Outbox full, dropping {} oldest entries".format(len(entries) - self.max_entries))
+                entries = entries[-self.max_entries :]
+            self._write(entries)
+        finally:
+            lock.release()
+        if log:
+            log.info("Queued {} entry in outbox: {}".format(entry["kind"], self.path))
+
+    def _remove(self, entry_id: str):
+        lock = self._lock()
+        try:
+            self._write([e for e in self._read() if e["id"] != entry_id])
+        finally:
+            lock.release()
+
+    def drain(self, senders: Dict[str, Sender], log: logging.Logger):
+        """Send the queued entries in order, stopping at the first that still cannot be delivered
+
+        Entries are removed one by one once sent, so entries queued meanwhile are kept and a run that exits mid drain
+        sends at most one entry twice.
+        """
+        if not os.path.exists(self.path):
+            return True
+        drain_lock = fs.FileLock("{}.drain.lock".format(self.path), timeout=0)
+        if not drain_lock.acquire():
+            log.debug("Outbox is being drained by another run: {}".format(self.path))
+            return True
+        try:
+            entries = self.entries()
+            if entries:
+                log.info("Draining {} entries from outbox: {}".format(len(entries), self.path))
+            for count, entry in enumerate(entries):
+                sender = senders.get(entry["kind"])
+                if not sender:
+                    log.warning("No sender for {} entry in outbox, dropping it".format(entry["kind"]))
+                elif not sender(entry):
+                    log.warning("Outbox still not deliverable, {} entries left".format(len(entries) - count))
+                    return False
+                self._remove(entry["id"])
+            return True
+        finally:
+            drain_lock.release()
@@ -1,10 +1,11 @@
 from ast import Pass
+import datetime
 import logging
 import json
 import re
 
 from subprocess import CompletedProcess
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Tuple
 
 from abackup import Command
 
@@ -188,16 +189,12 @@ class ForgetResult(ResticResult):
 
         remove_entries = []
 
-        # there should only be one line
+        # there should only be one line, a list with a group per set of tags, host and paths
         lines = completed_process.stdout.split("\n")
         for line in lines:
-            if not line.startswith("{"):
+            if not line.startswith("["):
                 continue
-            json_list = json.loads(line)
-            if len(json_list) > 1:
-                raise RuntimeError("too many elements in json output of forget command")
-            json_dict = json_list[0]
-            remove_list = json_dict["remove"]
+            remove_list = [remove for group in json.loads(line) if group.get("remove") for remove in group["remove"]]
             for remove in remove_list:
 
                 def _get_field(key: str, default=None):
@@ -276,6 +273,43 @@ class PruneResult(ResticResult):
         return cls(to_repack, this_removes, to_delete, total_prune, remaining, unused_size_after_prune, True)
 
 
+class ListResult(ResticResult):
+    def __init__(self, ids: List[str], command_succeeded: bool):
+        self.ids = ids
+        super().__init__("list", command_succeeded)
+
+    @classmethod
+    def from_output(cls, completed_process: CompletedProcess, log: logging.Logger):
+        if completed_process.returncode != 0:
+            return ResticResult.from_output("list", completed_process, log)
+
+        id_regex = re.compile(r"^([0-9a-f]{64})$")
+        ids = []
+        for line in completed_process.stdout.split("\n"):
+            id_match = id_regex.match(line.strip())
+            if id_match:
+                ids.append(id_match.group(1))
+        return cls(ids, True)
+
+
+class SnapshotsResult(ResticResult):
+    def __init__(self, snapshots: List[Dict[str, Any]], command_succeeded: bool):
+        self.snapshots = snapshots
+        super().__init__("snapshots", command_succeeded)
+
+    @classmethod
+    def from_output(cls, completed_process: CompletedProcess, log: logging.Logger):
+        if completed_process.returncode != 0:
+            return ResticResult.from_output("snapshots", completed_process, log)
+
+        snapshots = []
+        for line in completed_process.stdout.split("\n"):
+            if not line.startswith("["):
+                continue
+            snapshots.extend(json.loads(line))
+        return cls(snapshots, True)
+
+
 class ResticWrapper:
     def __init__(self, password_provider: PasswordProvider, connection: RepoConnection):
         self.password_provider = password_provider
@@ -302,7 +336,11 @@ class ResticWrapper:
                     elif v is True:
                         options_string += "--{} ".format(k)
                     elif isinstance(v, list):
-                        if k == "tags":
+                        if k == "tags" and v and all(isinstance(t, list) for t in v):
+                            # each inner list is a separate tag group, restic matches any of the groups
+                            for tag_group in v:
+                                options_string += "--{} {} ".format("tag", ",".join(tag_group))
+                        elif k == "tags":
                             options_string += "--{} {} ".format("tag", ",".join(v))
                         else:
                             options_string += "--{} {} ".format(k, ",".join(v))
@@ -409,3 +447,283 @@ class ResticWrapper:
         return PruneResult.from_output(
             self._run_command("prune", log, global_options, options, universal_newlines=True), log
         )
+
+    def list(self, log: logging.Logger, object_type: str, global_options: Dict[str, Any] = None):
+        log.debug("ResticWrapper::list({})".format(object_type))
+        return ListResult.from_output(
+            self._run_command("list", log, global_options, args=[object_type], universal_newlines=True), log
+        )
+
+    def snapshots(
+        self,
+        log: logging.Logger,
+        global_options: Dict[str, Any] = None,
+        options: Dict[str, Any] = None,
+        args: List[str] = None,
+    ):
+        log.debug("ResticWrapper::snapshots()")
+        return SnapshotsResult.from_output(
+            self._run_command(
+                "snapshots",
+                log,
+                global_options,
+                {**(options if options else {}), "json": True},
+                args=args,
+                universal_newlines=True,
+            ),
+            log,
+        )
+
+
+# Forget policy, mirrors the rules of restic forget (internal/restic/snapshot_policy.go)
+
+
+class PolicyDuration:
+    def __init__(self, years: int = 0, months: int = 0, days: int = 0, hours: int = 0):
+        self.years = years
+        self.months = months
+        self.days = days
+        self.hours = hours
+
+    def __str__(self):
+        return "".join(
+            "{}{}".format(v, unit)
+            for v, unit in [(self.years, "y"), (self.months, "m"), (self.days, "d"), (self.hours, "h")]
+            if v
+        )
+
+    @classmethod
+    def parse(cls, duration_string: str):
+        values = {"y": 0, "m": 0, "d": 0, "h": 0}
+        for number, unit in re.findall(r"(\d+)([ymdh])", duration_string):
+            values[unit] += int(number)
+        if not re.fullmatch(r"(\d+[ymdh])+", duration_string):
+            raise ValueError("invalid duration: {}".format(duration_string))
+        return cls(values["y"], values["m"], values["d"], values["h"])
+
+    def is_zero(self):
+        return not (self.years or self.months or self.days or self.hours)
+
+    def subtract_from(self, timestamp: datetime.datetime):
+        # like go's time.AddDate, overflowing days are normalized into the following month
+        month_index = timestamp.year * 12 + timestamp.month - 1 - self.years * 12 - self.months
+        first_of_month = timestamp.replace(year=month_index // 12, month=month_index % 12 + 1, day=1)
+        return (
+            first_of_month
+            + datetime.timedelta(days=timestamp.day - 1)
+            - datetime.timedelta(days=self.days, hours=self.hours)
+        )
+
+
+class ExpirePolicy:
+    bucket_keys = ["last", "hourly", "daily", "weekly", "monthly", "yearly"]
+
+    def __init__(
+        self,
+        counts: Dict[str, int] = None,
+        within: PolicyDuration = None,
+        within_buckets: Dict[str, PolicyDuration] = None,
+        tags: List[List[str]] = None,
+    ):
+        self.counts = counts if counts else {}
+        self.within = within
+        self.within_buckets = within_buckets if within_buckets else {}
+        self.tags = tags if tags else []
+
+    def __str__(self):
+        parts = ["keep {} {}".format(v if v != -1 else "unlimited", k) for k, v in self.counts.items() if v]
+        if self.within:
+            parts.append("keep within {}".format(self.within))
+        parts.extend("keep {} within {}".format(k, v) for k, v in self.within_buckets.items())
+        parts.extend("keep tag {}".format(",".join(t)) for t in self.tags)
+        return ", ".join(parts)
+
+    @classmethod
+    def from_options(cls, options: Dict[str, Any]):
+        def _count(value: Any):
+            return -1 if value == "unlimited" else int(value)
+
+        counts = {}
+        within_buckets = {}
+        for key in cls.bucket_keys:
+            if "keep-{}".format(key) in options:
+                counts[key] = _count(options["keep-{}".format(key)])
+            if key != "last" and "keep-within-{}".format(key) in options:
+                within_buckets[key] = PolicyDuration.parse(options["keep-within-{}".format(key)])
+        within = PolicyDuration.parse(options["keep-within"]) if "keep-within" in options else None
+        return cls(
+            counts, within, within_buckets, parse_tag_groups(options["keep-tag"] if "keep-tag" in options else [])
+        )
+
+    def is_empty(self):
+        return (
+            not any(self.counts.values())
+            and (not self.within or self.within.is_zero())
+            and not self.within_buckets
+            and not self.tags
+        )
+
+
+def parse_tag_groups(tags: Any):
+    if isinstance(tags, str):
+        tags = [tags]
+    groups = []
+    for tag_group in tags:
+        if isinstance(tag_group, list):
+            groups.append(tag_group)
+        else:
+            groups.append([tag for tag in tag_group.split(",") if tag])
+    return groups
+
+
+def _bucket_value(key: str, timestamp: datetime.datetime, nr: int):
+    if key == "last":
+        return nr
+    if key == "hourly":
+        return timestamp.year * 1000000 + timestamp.month * 10000 + timestamp.day * 100 + timestamp.hour
+    if key == "daily":
+        return timestamp.year * 10000 + timestamp.month * 100 + timestamp.day
+    if key == "weekly":
+        year, week, _ = timestamp.isocalendar()
+        return year * 100 + week
+    if key == "monthly":
+        return timestamp.year * 100 + timestamp.month
+    return timestamp.year
+
+
+def apply_policy(snapshots: List[Dict[str, Any]], policy: ExpirePolicy, parse_time: Callable[[str], datetime.datetime]):
+    # newest first, stable like restic's sort
+    snapshots = sorted(snapshots, key=lambda snapshot: parse_time(snapshot["time"]), reverse=True)
+    reasons = {}
+    if policy.is_empty() or not snapshots:
+        return snapshots, [], reasons
+
+    keep = []
+    remove = []
+    latest = parse_time(snapshots[0]["time"])
+    counts = {key: policy.counts[key] for key in ExpirePolicy.bucket_keys if key in policy.counts}
+    last_values = {key: None for key in ExpirePolicy.bucket_keys}
+    last_within_values = {key: None for key in policy.within_buckets.keys()}
+    for nr, snapshot in enumerate(snapshots):
+        timestamp = parse_time(snapshot["time"])
+        is_oldest = nr == len(snapshots) - 1
+        snapshot_reasons = []
+
+        # tags are not counted
+        snapshot_tags = snapshot["tags"] if "tags" in snapshot and snapshot["tags"] else []
+        for tag_group in policy.tags:
+            if set(tag_group).issubset(snapshot_tags):
+                snapshot_reasons.append("has tags {}".format(",".join(tag_group)))
+
+        if policy.within and not policy.within.is_zero() and timestamp > policy.within.subtract_from(latest):
+            snapshot_reasons.append("within {}".format(policy.within))
+
+        for key, count in counts.items():
+            # -1 means "keep all"
+            if count > 0 or count == -1:
+                value = _bucket_value(key, timestamp, nr)
+                # the oldest snapshot is also kept while a bucket has counts left, maximizing the history length
+                if value != last_values[key] or is_oldest:
+                    last_values[key] = value
+                    if count > 0:
+                        counts[key] = count - 1
+                    snapshot_reasons.append("{} snapshot".format(key))
+
+        for key, duration in policy.within_buckets.items():
+            if timestamp > duration.subtract_from(latest):
+                value = _bucket_value(key, timestamp, nr)
+                if value != last_within_values[key] or is_oldest:
+                    last_within_values[key] = value
+                    snapshot_reasons.append("{} within {}".format(key, duration))
+
+        if snapshot_reasons:
+            keep.append(snapshot)
+            reasons[snapshot["id"]] = snapshot_reasons
+        else:
+            remove.append(snapshot)
+
+    return keep, remove, reasons
+
+
+def filter_snapshots(
+    snapshots: List[Dict[str, Any]],
+    hosts: List[str] = None,
+    tag_groups: List[List[str]] = None,
+    paths: List[str] = None,
+):
+    def _matches(snapshot: Dict[str, Any]):
+        if hosts and snapshot["hostname"] not in hosts:
+            return False
+        snapshot_tags = snapshot["tags"] if "tags" in snapshot and snapshot["tags"] else []
+        if tag_groups and not any(set(tag_group).issubset(snapshot_tags) for tag_group in tag_groups):
+            return False
+        if paths and not set(paths).issubset(snapshot["paths"]):
+            return False
+        return True
+
+    return [snapshot for snapshot in snapshots if _matches(snapshot)]
+
+
+def group_snapshots(snapshots: List[Dict[str, Any]], group_by: str = "host,paths"):
+    group_by_fields = [field for field in group_by.split(",") if field] if group_by else []
+    groups = {}
+    for snapshot in snapshots:
+        key = []
+        if "host" in group_by_fields:
+            key.append(("host", snapshot["hostname"]))
+        if "paths" in group_by_fields:
+            key.append(("paths", tuple(sorted(snapshot["paths"]))))
+        if "tags" in group_by_fields:
+            key.append(("tags", tuple(sorted(snapshot["tags"] if "tags" in snapshot and snapshot["tags"] else []))))
+        groups.setdefault(tuple(key), []).append(snapshot)
+    return groups
+
+
+class ForgetSimulationGroup:
+    def __init__(
+        self,
+        key: Tuple[Any, ...],
+        keep: List[Dict[str, Any]],
+        remove: List[Dict[str, Any]],
+        reasons: Dict[str, List[str]],
+    ):
+        self.key = key
+        self.keep = keep
+        self.remove = remove
+        self.reasons = reasons
+
+    def __str__(self):
+        return ", ".join(
+            "{}: {}".format(name, value if isinstance(value, str) else ",".join(value)) for name, value in self.key
+        )
+
+    @property
+    def reclaimable_bytes(self):
+        # upper bound, data added by a removed snapshot may still be referenced by a kept one
+        return sum(
+            snapshot["summary"]["data_added"]
+            for snapshot in self.remove
+            if "summary" in snapshot and "data_added" in snapshot["summary"]
+        )
+
+
+def simulate_forget(
+    snapshots: List[Dict[str, Any]], options: Dict[str, Any], parse_time: Callable[[str], datetime.datetime]
+):
+    def _as_list(value: Any):
+        if value is None:
+            return None
+        return value if isinstance(value, list) else [value]
+
+    policy = ExpirePolicy.from_options(options)
+    snapshots = filter_snapshots(
+        snapshots,
+        _as_list(options["host"] if "host" in options else None),
+        parse_tag_groups(options["tags"]) if "tags" in options else None,
+        _as_list(options["path"] if "path" in options else None),
+    )
+    groups = group_snapshots(snapshots, options["group-by"] if "group-by" in options else "host,paths")
+    return policy, [
+        ForgetSimulationGroup(key, *apply_policy(group_snapshots_, policy, parse_time))
+        for key, group_snapshots_ in groups.items()
+    ]
@@ -0,0 +1,54 @@
+import os
+import yaml
+
+from typing import Dict
+
+from abackup import config
+
+DEFAULT_CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".abackup")
+
+
+class Limits:
+    def __init__(self, max_jobs: int = 2, max_jobs_per_app: Dict[str, int] = None):
+        self.max_jobs = max_jobs
+        self.max_jobs_per_app = max_jobs_per_app if max_jobs_per_app else {}
+
+    def __str__(self):
+        return "Limits: max_jobs:{} max_jobs_per_app:{}".format(self.max_jobs, self.max_jobs_per_app)
+
+
+class Config(config.BaseConfig):
+    def __init__(self, path: str, no_log: bool, debug: bool, start_background: bool = True):
+        super().__init__("abackup-scheduler", os.path.dirname(path), no_log, debug, start_background=start_background)
+
+        self.path = path
+        self.no_log = no_log
+        self.debug = debug
+        # the config files of the apps whose jobs are scheduled, None for apps that are not
+        self.backup_config = None
+        self.projects = []
+        self.sync_config = None
+        self.data_config = None
+        self.limits = Limits()
+        self.reload_check_interval = 10
+        self.status_path = os.path.join(self.log_root, "status.json")
+
+        if path and os.path.isfile(path):
+            with open(path, "r") as stream:
+                self._raw = yaml.safe_load(stream)
+            if self._raw is None:
+                self._raw = {}
+            if "backup" in self._raw:
+                backup = self._raw["backup"] if self._raw["backup"] else {}
+                self.backup_config = os.path.expanduser(
+                    backup.get("config", os.path.join(DEFAULT_CONFIG_DIR, "backup.yml"))
+                )
+                self.projects = [os.path.abspath(os.path.expanduser(p)) for p in backup.get("projects", [])]
+            if "sync" in self._raw:
+                sync = self._raw["sync"] if self._raw["sync"] else {}
+                self.sync_config = os.path.expanduser(sync.get("config", os.path.join(DEFAULT_CONFIG_DIR, "sync.yml")))
+            if "data" in self._raw:
+                data = self._raw["data"] if self._raw["data"] else {}
+                self.data_config = os.path.expanduser(data.get("config", os.path.join(DEFAULT_CONFIG_DIR, "data.yml")))
+            self.limits = Limits(self._raw.get("max_jobs", self.limits.max_jobs), self._raw.get("max_jobs_per_app"))
+            self.reload_check_interval = self._raw.get("reload_check_interval", self.reload_check_interval)
@@ -0,0 +1,100 @@
+import datetime
+
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+WEEKDAYS = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+SPECIALS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+# a schedule with no match within this many days never matches, e.g. the 30th of February
+MAX_DAYS_AHEAD = 4 * 366
+
+
+def _parse_value(value: str, names: list, offset: int):
+    if value.lower() in names:
+        return names.index(value.lower()) + offset
+    return int(value)
+
+
+def _parse_field(field: str, minimum: int, maximum: int, names: list = None, offset: int = 0):
+    """The set of values field matches, with the cron syntax of lists, ranges, steps and names"""
+    names = names if names else []
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_value = part.split("/", 1)
+            step = int(step_value)
+            if step < 1:
+                raise ValueError("Step of {} is not positive".format(field))
+        if part == "*":
+            start, end = minimum, maximum
+        elif "-" in part:
+            start_value, end_value = part.split("-", 1)
+            start, end = _parse_value(start_value, names, offset), _parse_value(end_value, names, offset)
+        else:
+            start = _parse_value(part, names, offset)
+            # a single value with a step runs from it to the end, as in cron
+            end = maximum if step > 1 else start
+        if start < minimum or end > maximum or start > end:
+            raise ValueError("{} is not within {}-{}".format(part, minimum, maximum))
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """When a cron expression fires, for the same frequency settings that are written to the crontab
+
+    Supports the five fields with lists, ranges, steps and month and weekday names, and the @yearly, @monthly, @weekly,
+    @daily and @hourly shortcuts. Like cron, a job whose day of month and day of week are both restricted fires on
+    either.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = SPECIALS.get(expression.strip().lower(), expression).split()
+        if len(fields) != 5:
+            raise ValueError("Not a cron expression of five fields: {}".format(expression))
+        self.minutes = sorted(_parse_field(fields[0], 0, 59))
+        self.hours = sorted(_parse_field(fields[1], 0, 23))
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12, MONTHS, 1)
+        # 7 is sunday as well
+        self.weekdays = set([d % 7 for d in _parse_field(fields[4], 0, 7, WEEKDAYS)])
+        self._any_day = fields[2].startswith("*")
+        self._any_weekday = fields[4].startswith("*")
+
+    def __str__(self):
+        return "CronSchedule: {}".format(self.expression)
+
+    def matches_day(self, day: datetime.date):
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        # isoweekday is 7 for sunday
+        in_weekdays = day.isoweekday() % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def matches(self, minute: datetime.datetime):
+        return minute.minute in self.minutes and minute.hour in self.hours and self.matches_day(minute.date())
+
+    def next_after(self, after: datetime.datetime):
+        """The first minute after after that the schedule fires at, None if there is none"""
+        start = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        day = start.date()
+        for _ in range(MAX_DAYS_AHEAD):
+            if self.matches_day(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime.datetime.combine(day, datetime.time(hour, minute))
+                        if candidate >= start:
+                            return candidate
+            day += datetime.timedelta(days=1)
+        return None
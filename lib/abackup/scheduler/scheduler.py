@@ -0,0 +1,528 @@
+import datetime
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+from typing import Dict, List
+
+from tabulate import tabulate
+
+from abackup.appcron import AppCronTab, AppJob
+from abackup.backup.project import ProjectConfig
+from abackup.backup.updatecron import auto_backup_jobs
+from abackup.data import Config as DataConfig
+from abackup.data.updatecron import pool_jobs
+from abackup.scheduler import DEFAULT_CONFIG_DIR, Config
+from abackup.scheduler.cron import CronSchedule
+from abackup.sync import Config as SyncConfig
+from abackup.sync.updatecron import sync_jobs
+from abackup.usage import run_with_usage
+
+APPS = ["abackup", "absync", "abdata"]
+# minutes missed while the scheduler was busy, e.g. reloading, are caught up on for at most this long
+MAX_CATCH_UP_MINUTES = 10
+
+
+class ScheduledJob:
+    """An AppJob with its parsed schedule"""
+
+    def __init__(self, app_job: AppJob, schedule: CronSchedule):
+        self.app_job = app_job
+        self.schedule = schedule
+
+    def __str__(self):
+        return "ScheduledJob: {} @ {}".format(self.name, self.app_job.frequency)
+
+    @property
+    def name(self):
+        return self.app_job.cron_comment
+
+    @property
+    def key(self):
+        return "{} @ {}".format(self.app_job.cron_comment, self.app_job.frequency)
+
+
+class JobState:
+    def __init__(
+        self,
+        last_started: float = None,
+        last_finished: float = None,
+        last_duration: float = None,
+        last_ok: bool = None,
+        runs: int = 0,
+        failures: int = 0,
+        skipped: int = 0,
+    ):
+        # idle, queued while waiting for a free slot, or running
+        self.state = "idle"
+        self.last_started = last_started
+        self.last_finished = last_finished
+        self.last_duration = last_duration
+        self.last_ok = last_ok
+        self.runs = runs
+        self.failures = failures
+        # firings skipped as the previous run was still queued or running
+        self.skipped = skipped
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "last_started": self.last_started,
+            "last_finished": self.last_finished,
+            "last_duration": self.last_duration,
+            "last_ok": self.last_ok,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+        }
+
+    @classmethod
+    def from_dict(cls, state_dict: dict):
+        return cls(
+            state_dict.get("last_started"),
+            state_dict.get("last_finished"),
+            state_dict.get("last_duration"),
+            state_dict.get("last_ok"),
+            state_dict.get("runs", 0),
+            state_dict.get("failures", 0),
+            state_dict.get("skipped", 0),
+        )
+
+
+class Limiter:
+    """A semaphore whose limit can change while slots are taken, None for no limit
+
+    Lowering the limit lets the runs holding a slot finish, new ones wait until fewer than the new limit run.
+    """
+
+    def __init__(self, limit: int = None):
+        self.limit = limit
+        self.taken = 0
+        self._condition = threading.Condition()
+
+    def resize(self, limit: int = None):
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+
+    def __enter__(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.limit is None or self.taken < self.limit)
+            self.taken += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._condition:
+            self.taken -= 1
+            self._condition.notify_all()
+
+
+def _app_options(config: Config, config_path: str, default_config_path: str):
+    """The options the app's CLI would have been run with from cron, also passed on to the remote absync by syncs"""
+    options = []
+    if config.debug:
+        options.append("--debug")
+    if config.no_log:
+        options.append("--no-log")
+    if config_path != default_config_path:
+        options.extend(["--config", config_path])
+    return " ".join(options)
+
+
+def _scheduled(app_jobs: List[AppJob], log: logging.Logger):
+    jobs = []
+    for app_job in app_jobs:
+        try:
+            schedule = CronSchedule(app_job.frequency)
+        except ValueError as e:
+            log.error("{}: not scheduled, invalid frequency {}: {}".format(app_job.cron_comment, app_job.frequency, e))
+            continue
+        jobs.append(ScheduledJob(app_job, schedule))
+    return jobs
+
+
+def load_jobs(config: Config, log: logging.Logger):
+    """The scheduled jobs of the configured apps, loading their configs, and the config files they were loaded from"""
+    jobs = []
+    paths = [config.path, os.path.join(os.path.dirname(config.path), "conf.yml")]
+    if config.backup_config:
+        options = _app_options(config, config.backup_config, os.path.join(DEFAULT_CONFIG_DIR, "backup.yml"))
+        paths.extend([config.backup_config, os.path.join(os.path.dirname(config.backup_config), "conf.yml")])
+        for project_path in config.projects:
+            # named after its directory, as abackup does
+            project_name = os.path.basename(os.path.dirname(project_path))
+            project_config = ProjectConfig(project_path)
+            app_jobs = auto_backup_jobs(project_name, project_config, project_config.containers, options, log)
+            jobs.extend(_scheduled(app_jobs, log))
+            paths.append(project_path)
+    if config.sync_config:
+        options = _app_options(config, config.sync_config, os.path.join(DEFAULT_CONFIG_DIR, "sync.yml"))
+        sync_config = SyncConfig(config.sync_config, config.no_log, config.debug, start_background=False)
+        app_jobs = sync_jobs(
+            sync_config.owned_data, sync_config.stored_data, sync_config.restic_repositories, options, log
+        )
+        jobs.extend(_scheduled(app_jobs, log))
+        paths.extend([config.sync_config, os.path.join(os.path.dirname(config.sync_config), "conf.yml")])
+    if config.data_config:
+        options = _app_options(config, config.data_config, os.path.join(DEFAULT_CONFIG_DIR, "data.yml"))
+        data_config = DataConfig(config.data_config, config.no_log, config.debug, start_background=False)
+        jobs.extend(_scheduled(pool_jobs(data_config.drivers, options, log), log))
+        paths.extend([config.data_config, os.path.join(os.path.dirname(config.data_config), "conf.yml")])
+    return jobs, sorted(set(paths))
+
+
+def _mtime(path: str):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _minute(moment: datetime.datetime):
+    return moment.replace(second=0, microsecond=0)
+
+
+class Scheduler:
+    """Runs the commands of the jobs of the configured apps when their frequency fires, as cron would
+
+    Each run is a process of its own with the app's configs as they are on disk then. At most limits.max_jobs jobs run
+    at once, and at most max_jobs_per_app of an app, the others wait queued for a free slot. A job that fires while its
+    previous run is still queued or running is skipped. The configs are loaded again once one of their files changed or
+    on SIGHUP.
+    """
+
+    def __init__(self, config: Config, log: logging.Logger):
+        self.config = config
+        self.log = log
+        self.jobs = []
+        self.states = {}
+        self.load_error = None
+        self.loaded = None
+        self.started = time.time()
+        self._mtimes = {}
+        # kept across reloads, so the runs started before a reload count against the new limits
+        self._limit = Limiter()
+        self._app_limits = {app: Limiter() for app in APPS}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._status_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._reload_requested = False
+
+    def load(self):
+        """Load the configs and jobs, or keep the ones loaded before if that fails"""
+        try:
+            config = Config(self.config.path, self.config.no_log, self.config.debug, start_background=False)
+            jobs, paths = load_jobs(config, self.log)
+        except Exception as e:
+            # a broken edit of a config must not stop the jobs that were scheduled so far
+            self.load_error = "{}: {}".format(type(e).__name__, e)
+            self.log.error("Failed to load the configs, keeping the jobs loaded before: {}".format(self.load_error))
+            self._mtimes = {path: _mtime(path) for path in self._mtimes.keys()}
+            return False
+        with self._lock:
+            self.config = config
+            self.log = config.log
+            self.jobs = jobs
+            for job in jobs:
+                if job.key not in self.states:
+                    self.states[job.key] = JobState()
+            self._limit.resize(config.limits.max_jobs)
+            for app, app_limit in self._app_limits.items():
+                app_limit.resize(config.limits.max_jobs_per_app.get(app))
+            self._mtimes = {path: _mtime(path) for path in paths}
+            self.load_error = None
+            self.loaded = time.time()
+        self.log.info("Loaded {} jobs, {}".format(len(jobs), config.limits))
+        return True
+
+    def restore_states(self):
+        """Keep the run history of the jobs from the status file of the previous run"""
+        status = read_status(self.config.status_path)
+        if not status:
+            return
+        for job_dict in status.get("jobs", []):
+            self.states[job_dict["key"]] = JobState.from_dict(job_dict)
+
+    def reload(self):
+        self._reload_requested = True
+        self._wake.set()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+    def _changed(self):
+        return any([_mtime(path) != mtime for path, mtime in self._mtimes.items()])
+
+    def fire(self, job: ScheduledJob):
+        with self._lock:
+            state = self.states[job.key]
+            if state.state != "idle":
+                state.skipped += 1
+                self.log.warning("{}: still {}, skipping this run".format(job.name, state.state))
+                return
+            state.state = "queued"
+            thread = threading.Thread(target=self._run, args=(job, state), name=job.name)
+            self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+        self.log.info("{}: queued".format(job.name))
+        thread.start()
+
+    def _run(self, job: ScheduledJob, state: JobState):
+        # the app's slot is taken first, so a job waiting for it does not hold one of the global slots
+        with self._app_limits[job.app_job.app], self._limit:
+            if self._stopping:
+                with self._lock:
+                    state.state = "idle"
+                self.log.info("{}: not started, stopping".format(job.name))
+                return
+            with self._lock:
+                state.state = "running"
+                state.last_started = time.time()
+            self.write_status()
+            self.log.info("{}: started: {}".format(job.name, job.app_job.command))
+            started = time.monotonic()
+            run_result = None
+            try:
+                # through the shell like cron, the app logs and records its spans as it would from the crontab
+                run_result = run_with_usage(["/bin/sh", "-c", job.app_job.command])
+            except OSError as e:
+                self.log.error("{}: failed to start: {}".format(job.name, e))
+            ok = run_result is not None and run_result.returncode == 0
+            duration = time.monotonic() - started
+            with self._lock:
+                state.state = "idle"
+                state.last_finished = time.time()
+                state.last_duration = duration
+                state.last_ok = ok
+                state.runs += 1
+                if not ok:
+                    state.failures += 1
+        if ok:
+            self.log.info("{}: finished in {:.1f}s, {}".format(job.name, duration, run_result.usage))
+        elif run_result is not None:
+            self.log.error(
+                "{}: failed after {:.1f}s with exit code {}".format(job.name, duration, run_result.returncode)
+            )
+        self.write_status()
+
+    def tick(self, minutes: List[datetime.datetime]):
+        """Fire the jobs scheduled in any of minutes, once each"""
+        for job in list(self.jobs):
+            if any([job.schedule.matches(minute) for minute in minutes]):
+                self.fire(job)
+
+    def status(self, stopped: float = None):
+        now = datetime.datetime.now()
+        with self._lock:
+            jobs = []
+            for job in self.jobs:
+                next_run = job.schedule.next_after(now)
+                jobs.append(
+                    {
+                        "key": job.key,
+                        "app": job.app_job.app,
+                        "project": job.app_job.project,
+                        "comment": job.app_job.comment,
+                        "frequency": job.app_job.frequency,
+                        "command": job.app_job.command,
+                        "next_run": next_run.timestamp() if next_run else None,
+                        **self.states[job.key].to_dict(),
+                    }
+                )
+            return {
+                "pid": os.getpid(),
+                "started": self.started,
+                "stopped": stopped,
+                "loaded": self.loaded,
+                "load_error": self.load_error,
+                "config_files": sorted(self._mtimes.keys()),
+                "max_jobs": self.config.limits.max_jobs,
+                "max_jobs_per_app": self.config.limits.max_jobs_per_app,
+                "jobs": jobs,
+            }
+
+    def write_status(self, stopped: float = None):
+        status = self.status(stopped)
+        path = self.config.status_path
+        with self._status_lock:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = "{}.tmp".format(path)
+                with open(tmp_path, "w") as json_file:
+                    json.dump(status, json_file)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                self.log.error("Failed to write the status to {}: {}".format(path, e))
+
+    def warn_about_crontab(self):
+        """Jobs still in the crontab run from there as well, after update-cron was used before the scheduler"""
+        for app in APPS:
+            try:
+                cron_jobs = AppCronTab(app, None).jobs()
+            except (OSError, ValueError) as e:
+                self.log.debug("Could not read the crontab: {}".format(e))
+                return
+            if cron_jobs:
+                self.log.warning(
+                    "{} {} jobs are in the crontab as well and also run from there, remove them with crontab -e".format(
+                        len(cron_jobs), app
+                    )
+                )
+
+    def run(self):
+        """Schedule the jobs until SIGTERM or SIGINT, then wait for the running jobs to finish"""
+        self.restore_states()
+        if not self.load():
+            return False
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.reload())
+        self.warn_about_crontab()
+        self.write_status()
+        self.log.info("Scheduler started, pid {}".format(os.getpid()))
+
+        last_minute = _minute(datetime.datetime.now())
+        while not self._stopping:
+            now = datetime.datetime.now()
+            to_next_minute = 60 - now.second - now.microsecond / 1000000
+            self._wake.wait(min(self.config.reload_check_interval, to_next_minute))
+            self._wake.clear()
+            if self._stopping:
+                break
+            if self._reload_requested or self._changed():
+                self._reload_requested = False
+                self.log.info("Configs changed, reloading")
+                self.load()
+                self.write_status()
+            minute = _minute(datetime.datetime.now())
+            if minute < last_minute:
+                # the clock was set back, the minutes up to last_minute already fired
+                last_minute = minute
+            elif minute > last_minute:
+                first = max(last_minute, minute - datetime.timedelta(minutes=MAX_CATCH_UP_MINUTES))
+                minutes = []
+                while first < minute:
+                    first += datetime.timedelta(minutes=1)
+                    minutes.append(first)
+                self.tick(minutes)
+                last_minute = minute
+                self.write_status()
+
+        with self._lock:
+            threads = [t for t in self._threads if t.is_alive()]
+        self.log.info("Stopping, waiting for {} running or queued jobs".format(len(threads)))
+        for thread in threads:
+            thread.join()
+        self.write_status(stopped=time.time())
+        self.log.info("Scheduler stopped")
+        return True
+
+
+def perform_run(config: Config, log: logging.Logger):
+    return Scheduler(config, log).run()
+
+
+def read_status(path: str):
+    try:
+        with open(path, "r") as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_running(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_time(timestamp: float):
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M") if timestamp else "-"
+
+
+def _format_result(job_dict: Dict):
+    if job_dict["last_ok"] is None:
+        return "-"
+    result = "ok" if job_dict["last_ok"] else "failed"
+    return "{} in {:.0f}s".format(result, job_dict["last_duration"])
+
+
+def print_jobs(jobs: List[Dict]):
+    rows = [
+        [
+            j["app"],
+            j["project"],
+            j["comment"],
+            j["frequency"],
+            j["state"],
+            _format_time(j["next_run"]),
+            _format_time(j["last_started"]),
+            _format_result(j),
+            j["runs"],
+            j["failures"],
+            j["skipped"],
+        ]
+        for j in sorted(jobs, key=lambda j: (j["app"], j["project"] or "", j["comment"]))
+    ]
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "App",
+                "Project",
+                "Job",
+                "Frequency",
+                "State",
+                "Next run",
+                "Last run",
+                "Last result",
+                "Runs",
+                "Failures",
+                "Skipped",
+            ],
+        )
+    )
+
+
+def perform_status(config: Config, log: logging.Logger):
+    status = read_status(config.status_path)
+    if not status:
+        log.error("No scheduler status in {}, abackup-scheduler run has not run yet".format(config.status_path))
+        return False
+    if status["stopped"]:
+        print("Stopped at {}".format(_format_time(status["stopped"])))
+    elif _is_running(status["pid"]):
+        print("Running since {}, pid {}".format(_format_time(status["started"]), status["pid"]))
+    else:
+        print("Not running, pid {} exited without stopping".format(status["pid"]))
+    print(
+        "Configs loaded at {}, max jobs: {}, per app: {}".format(
+            _format_time(status["loaded"]),
+            status["max_jobs"],
+            ", ".join(["{} {}".format(app, limit) for app, limit in status["max_jobs_per_app"].items()]) or "-",
+        )
+    )
+    if status["load_error"]:
+        print("Reloading the configs failed, the jobs loaded before are kept: {}".format(status["load_error"]))
+    print()
+    print_jobs(status["jobs"])
+    return True
+
+
+def perform_jobs(config: Config, log: logging.Logger):
+    """Load the jobs like the scheduler would and print them, to check the configs"""
+    scheduler = Scheduler(config, log)
+    scheduler.restore_states()
+    if not scheduler.load():
+        return False
+    print_jobs(scheduler.status()["jobs"])
+    return True
@@ -0,0 +1,315 @@
+import contextlib
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+from typing import Any, Dict, List
+from uuid import uuid4
+
+from tabulate import tabulate
+
+from abackup.fs import to_human_readable
+from abackup.usage import CommandUsage
+
+# spans are appended to this SpanRecorder once start_recording is called, and only timed until then
+_recorder = None
+# the stack of open spans of each thread
+_local = threading.local()
+_usage_lock = threading.Lock()
+
+
+class Span:
+    """A timed phase of a run, e.g. a container backup or a single command, nested under the span open when it started
+
+    The spans under one root span form a trace, the trace id is the id of its root span.
+    """
+
+    def __init__(self, name: str, target: str = None, parent: "Span" = None, attributes: Dict[str, Any] = None):
+        self.id = uuid4().hex[:16]
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else self.id
+        self.parent_id = parent.id if parent else None
+        self.name = name
+        self.target = target
+        self.attributes = attributes if attributes else {}
+        self.ok = True
+        # the summed up CommandUsage of the commands run within the span
+        self.usage = None
+        self.started = datetime.datetime.now().timestamp()
+        self.duration = None
+        self._started = time.monotonic()
+
+    def __str__(self):
+        return "Span: {} {} duration:{} ok:{}".format(self.name, self.target, self.duration, self.ok)
+
+    def set(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+    def add_usage(self, usage: CommandUsage):
+        """Add the usage of a command to this span and the spans it is nested in"""
+        with _usage_lock:
+            span = self
+            while span:
+                span.usage = span.usage + usage if span.usage else usage
+                span = span.parent
+
+    def finish(self):
+        self.duration = time.monotonic() - self._started
+
+    def to_dict(self):
+        return {
+            "trace": self.trace_id,
+            "id": self.id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "target": self.target,
+            "start": self.started,
+            "duration": self.duration,
+            "ok": self.ok,
+            "attributes": self.attributes,
+            "usage": self.usage.to_dict() if self.usage else None,
+        }
+
+
+class SpanRecorder:
+    """Appends finished spans to a JSON lines file, rotated to <path>.1 once it grows past max_bytes"""
+
+    def __init__(self, path: str, max_bytes: int = 10485760):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def write(self, span: Span):
+        line = "{}\n".format(json.dumps(span.to_dict()))
+        with self._lock:
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, "{}.1".format(self.path))
+                with open(self.path, "a") as spans_file:
+                    spans_file.write(line)
+            except OSError:
+                # timings are not worth failing a backup over
+                pass
+
+
+def start_recording(path: str):
+    """Write the spans of this process to path from now on"""
+    global _recorder
+    _recorder = SpanRecorder(path)
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def current_span():
+    """The innermost open span of this thread, to pass as parent to the spans of threads it starts"""
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def current_usage():
+    """The CommandUsage of the commands run so far within the current span of this thread, None if there were none"""
+    current = current_span()
+    return current.usage if current else None
+
+
+@contextlib.contextmanager
+def span(name: str, target: str = None, parent: Span = None, **attributes: Any):
+    """Time the with block as a span named name, under parent or else the current span of this thread
+
+    The span is failed when the block raises or sets span.ok to False.
+    """
+    stack = _stack()
+    new_span = Span(name, target, parent if parent else current_span(), attributes)
+    stack.append(new_span)
+    try:
+        yield new_span
+    except BaseException:
+        new_span.ok = False
+        raise
+    finally:
+        new_span.finish()
+        stack.remove(new_span)
+        if _recorder:
+            _recorder.write(new_span)
+
+
+#######################################################################################################################
+# Profile
+#######################################################################################################################
+
+
+class Trace:
+    def __init__(self, trace_id: str, spans: List[Dict[str, Any]]):
+        self.id = trace_id
+        self.spans = spans
+        self.root = next((s for s in spans if s["id"] == trace_id), None)
+        self.started = min([s["start"] for s in spans])
+        self.duration = max([s["start"] + s["duration"] for s in spans]) - self.started
+
+    def __str__(self):
+        return "Trace: {} {} duration:{}".format(self.id, self.label, self.duration)
+
+    @property
+    def label(self):
+        # the root span of an unfinished run is missing, e.g. when it was killed
+        return span_label(self.root) if self.root else "(incomplete)"
+
+    @property
+    def ok(self):
+        return all([s["ok"] for s in self.spans])
+
+    def walk(self):
+        """(depth, span, path of labels) of all spans, depth first in start order"""
+        ids = set([s["id"] for s in self.spans])
+        children = {}
+        for s in sorted(self.spans, key=lambda s: s["start"]):
+            # spans whose parent is missing are shown at the top
+            parent = s["parent"] if s["parent"] in ids else None
+            children.setdefault(parent, []).append(s)
+
+        def _walk(parent_id: str, depth: int, path: List[str]):
+            for s in children.get(parent_id, []):
+                span_path = path + [span_label(s)]
+                yield depth, s, span_path
+                yield from _walk(s["id"], depth + 1, span_path)
+
+        return list(_walk(None, 0, []))
+
+
+def span_label(span_dict: Dict[str, Any]):
+    return "{} {}".format(span_dict["name"], span_dict["target"]) if span_dict["target"] else span_dict["name"]
+
+
+def read_traces(path: str):
+    """The traces in path and its rotated file, oldest first"""
+    spans = {}
+    for spans_path in ["{}.1".format(path), path]:
+        if not os.path.exists(spans_path):
+            continue
+        with open(spans_path, "r") as spans_file:
+            for line in spans_file:
+                try:
+                    span_dict = json.loads(line)
+                except ValueError:
+                    continue
+                spans.setdefault(span_dict["trace"], []).append(span_dict)
+    return sorted([Trace(trace_id, trace_spans) for trace_id, trace_spans in spans.items()], key=lambda t: t.started)
+
+
+def find_trace(traces: List[Trace], trace_id: str):
+    matches = [t for t in traces if t.id.startswith(trace_id)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def _format_seconds(seconds: float):
+    return "{:.2f}s".format(seconds) if seconds is not None else "-"
+
+
+def _bar(offset: float, duration: float, total: float, width: int = 40):
+    if not total:
+        return ""
+    start = int(offset / total * width)
+    # tabulate strips leading spaces
+    return "." * start + "#" * max(1, int(round(duration / total * width)))
+
+
+def print_traces(traces: List[Trace]):
+    rows = [
+        [
+            t.id[:8],
+            datetime.datetime.fromtimestamp(t.started).strftime("%Y-%m-%d %H:%M:%S"),
+            t.label,
+            _format_seconds(t.duration),
+            len(t.spans),
+            "ok" if t.ok else "failed",
+        ]
+        for t in traces
+    ]
+    print(tabulate(rows, headers=["Run", "Started", "Root", "Duration", "Spans", "Status"]))
+
+
+def print_trace(trace: Trace):
+    rows = []
+    for depth, s, _ in trace.walk():
+        offset = s["start"] - trace.started
+        # spans recorded before commands were accounted have no usage
+        usage = CommandUsage.from_dict(s["usage"]) if s.get("usage") else None
+        rows.append(
+            [
+                "| " * depth + span_label(s),
+                "+{}".format(_format_seconds(offset)),
+                _format_seconds(s["duration"]),
+                "{:.1%}".format(s["duration"] / trace.duration) if trace.duration else "-",
+                _format_seconds(usage.cpu_time) if usage else "-",
+                to_human_readable(usage.max_rss) if usage else "-",
+                to_human_readable(usage.read_bytes) if usage else "-",
+                to_human_readable(usage.write_bytes) if usage else "-",
+                "" if s["ok"] else "failed",
+                _bar(offset, s["duration"], trace.duration),
+            ]
+        )
+    print(
+        "Run {} started {}, {}".format(
+            trace.id, datetime.datetime.fromtimestamp(trace.started), _format_seconds(trace.duration)
+        )
+    )
+    print(
+        tabulate(
+            rows,
+            headers=["Span", "Start", "Duration", "Share", "CPU", "Max RSS", "Read", "Written", "Status", "Timeline"],
+        )
+    )
+
+
+def print_trace_comparison(base: Trace, other: Trace):
+    """Durations of the spans of both traces by their path of labels, repeated spans summed"""
+    durations = {}
+    for index, trace in enumerate([base, other]):
+        for depth, s, path in trace.walk():
+            key = tuple(path)
+            if key not in durations:
+                durations[key] = [depth, 0.0, 0.0]
+            durations[key][index + 1] += s["duration"]
+    rows = []
+    for path, (depth, base_duration, other_duration) in durations.items():
+        rows.append(
+            [
+                "| " * depth + path[-1],
+                _format_seconds(base_duration),
+                _format_seconds(other_duration),
+                "{:+.2f}s".format(other_duration - base_duration),
+                "{:+.0%}".format(other_duration / base_duration - 1) if base_duration else "-",
+            ]
+        )
+    print("Run {} compared to run {}".format(other.id, base.id))
+    print(tabulate(rows, headers=["Span", base.id[:8], other.id[:8], "Change", "Change %"]))
+
+
+def perform_profile(path: str, log: logging.Logger, run: str = None, compare: str = None, last: int = 20):
+    traces = read_traces(path)
+    if not traces:
+        log.error("No spans recorded in {}".format(path))
+        return False
+    if not run:
+        print_traces(traces[-last:])
+        return True
+    trace = find_trace(traces, run)
+    if not trace:
+        log.error("No single run matches {}".format(run))
+        return False
+    if not compare:
+        print_trace(trace)
+        return True
+    other = find_trace(traces, compare)
+    if not other:
+        log.error("No single run matches {}".format(compare))
+        return False
+    print_trace_comparison(trace, other)
+    return True
@@ -1,3 +1,4 @@
+import copy
 import logging
 import os
 import platform
@@ -154,6 +155,7 @@ class ResticCommand:
         options: Dict[str, Any] = None,
         default_options: Dict[str, Any] = None,
         skip_defaults: bool = None,
+        default_tags: List[str] = None,
     ):
         self.command = command
         self.options = options
@@ -162,13 +164,19 @@ class ResticCommand:
                 self.options = {**default_options, **options}
             else:
                 self.options = default_options
+        if not skip_defaults and default_tags:
+            self.options["tags"] = self.options["tags"] + default_tags if "tags" in self.options else default_tags
+        # the options as configured, runs add their tags to self.options
+        self.configured_options = copy.deepcopy(self.options) if self.options else {}
 
     @staticmethod
-    def construct(command: str, options: Dict[str, Any] = None, skip_defaults: bool = None):
+    def construct(
+        command: str, options: Dict[str, Any] = None, skip_defaults: bool = None, rolling_subsets: int = None
+    ):
         if command == "backup":
             return ResticBackupCommand(options, skip_defaults)
         if command == "check":
-            return ResticCheckCommand(options, skip_defaults)
+            return ResticCheckCommand(options, skip_defaults, rolling_subsets)
         if command == "forget":
             return ResticForgetCommand(options, skip_defaults)
         if command == "prune":
@@ -188,6 +196,13 @@ class ResticCommand:
         else:
             self.options["tags"].append(tag)
 
+    def set_tag_groups_option(self, group_tags: List[str]):
+        """One tag group per tag of group_tags, each with the configured tags, so it can be set again for every run"""
+        if not self.options:
+            self.options = {}
+        common_tags = self.configured_options["tags"] if "tags" in self.configured_options else []
+        self.options["tags"] = [common_tags + [tag] for tag in group_tags]
+
     def append_tag_option(self, existing_tag: str, new_tag: str):
         if self.options and "tags" in self.options:
             if existing_tag in self.options["tags"]:
@@ -211,10 +226,7 @@ class ResticCommand:
 class ResticBackupCommand(ResticCommand):
     def __init__(self, options: Dict[str, Any] = None, skip_defaults: bool = None):
         defaults = {}
-        super().__init__("backup", options, defaults, skip_defaults)
-        if not skip_defaults:
-            default_tags = ["abackup"]
-            self.options["tags"] = self.options["tags"] + default_tags if "tags" in self.options else default_tags
+        super().__init__("backup", options, defaults, skip_defaults, default_tags=["abackup"])
 
     def run(
         self,
@@ -227,9 +239,16 @@ class ResticBackupCommand(ResticCommand):
 
 
 class ResticCheckCommand(ResticCommand):
-    def __init__(self, options: Dict[str, Any] = None, skip_defaults: bool = None):
+    def __init__(self, options: Dict[str, Any] = None, skip_defaults: bool = None, rolling_subsets: int = None):
         defaults = {}
         super().__init__("check", options, defaults, skip_defaults)
+        self.rolling_subsets = rolling_subsets
+
+    def set_read_data_subset_option(self, subset: int, subset_count: int):
+        if not self.options:
+            self.options = {}
+        self.options.pop("read-data", None)
+        self.options["read-data-subset"] = "{}/{}".format(subset, subset_count)
 
     def run(
         self,
@@ -244,10 +263,7 @@ class ResticCheckCommand(ResticCommand):
 class ResticForgetCommand(ResticCommand):
     def __init__(self, options: Dict[str, Any] = None, skip_defaults: bool = None):
         defaults = {"host": platform.node(), "group-by": "paths"}
-        super().__init__("forget", options, defaults, skip_defaults)
-        if not skip_defaults:
-            default_tags = ["abackup"]
-            self.options["tags"] = self.options["tags"] + default_tags if "tags" in self.options else default_tags
+        super().__init__("forget", options, defaults, skip_defaults, default_tags=["abackup"])
 
     def run(
         self,
@@ -280,9 +296,28 @@ class ResticDriver:
         self.commands = [ResticCommand.construct(**command) for command in commands]
 
 
+class ResticMaintenance:
+    def __init__(
+        self,
+        commands: List[Dict[str, Any]],
+        frequency: str = None,
+        notify: str = None,
+        healthchecks: Dict[str, str] = None,
+        global_options: Dict[str, Any] = None,
+        wait_timeout: int = None,
+    ):
+        self.commands = [ResticCommand.construct(**command) for command in commands]
+        self.frequency = frequency
+        self.notify = notifications.Mode(notify) if notify else notifications.Mode.AUTO
+        self.healthchecks = hc.Healthcheck(**healthchecks) if healthchecks else None
+        self.global_options = ResticGlobalOptions.default().mask(ResticGlobalOptions(global_options))
+        self.wait_timeout = wait_timeout
+
+
 class ResticRepository:
-    def __init__(self, password_provider: Dict[str, str], backend: Dict[str, str]):
+    def __init__(self, password_provider: Dict[str, str], backend: Dict[str, str], maintenance: Dict[str, Any] = None):
         self.password_provider = PasswordProvider(**password_provider)
+        self.maintenance = ResticMaintenance(**maintenance) if maintenance else None
         self.backend = None
         if backend["type"] == "rest":
             backend["settings"]["password_provider"] = PasswordProvider(**backend["settings"]["password_provider"])
@@ -339,9 +374,13 @@ class DataDir:
                     self.restic_options = self.restic_options.mask(ResticGlobalOptions(**entry["settings"]))
 
 
+def is_maintenance_command(command: ResticCommand):
+    return isinstance(command, (ResticCheckCommand, ResticForgetCommand, ResticPruneCommand))
+
+
 class Config(config.BaseConfig):
-    def __init__(self, path: str, no_log: bool, debug: bool):
-        super().__init__("absync", os.path.dirname(path), no_log, debug)
+    def __init__(self, path: str, no_log: bool, debug: bool, start_background: bool = True):
+        super().__init__("absync", os.path.dirname(path), no_log, debug, start_background=start_background)
 
         self.owned_data = {}
         self.stored_data = {}
@@ -363,3 +402,22 @@ class Config(config.BaseConfig):
                 self.restic_repositories = {
                     name: ResticRepository(**value) for name, value in self._raw["restic_repositories"].items()
                 }
+
+    def restic_snapshot_index_path(self, repo_name: str):
+        return os.path.join(self._ensure_log_dir(), "restic-{}-snapshots.json".format(repo_name))
+
+    def restic_check_state_path(self, repo_name: str):
+        return os.path.join(self._ensure_log_dir(), "restic-{}-check.json".format(repo_name))
+
+    def restic_repo_lock_path(self, repo_name: str):
+        return os.path.join(self._ensure_log_dir(), "restic-{}.lock".format(repo_name))
+
+    def data_names_for_restic_repo(self, repo_name: str):
+        return [
+            name
+            for name, data_dir in self.owned_data.items()
+            if any(
+                isinstance(auto_sync.driver, ResticDriver) and auto_sync.driver.settings.repo_name == repo_name
+                for auto_sync in data_dir.auto_sync
+            )
+        ]
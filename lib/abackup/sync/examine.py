@@ -1,3 +1,4 @@
+import datetime
 import logging
 
 import tabulate
@@ -5,15 +6,28 @@ from tabulate import tabulate
 
 from abackup import appcron, fs
 from abackup.sync import Config, syncinfo
+from abackup.sync.restic import ResticCheckState, maintenance_info_name
+from abackup.sync.sizes import get_data_sizes
+from abackup.sync.snapshots import load_snapshot_index, parse_snapshot_time
 
 
-def perform_examine(config: Config, cron: appcron.AppCronTab, log: logging.Logger):
+def perform_examine(
+    config: Config, cron: appcron.AppCronTab, log: logging.Logger, fresh: bool = False, absync_options: str = None
+):
+    sizes = get_data_sizes(
+        config,
+        [data_dir.path for data_dir in list(config.owned_data.values()) + list(config.stored_data.values())],
+        log,
+        fresh,
+        absync_options,
+    )
+
     # print owned_data
     rows = [
-        [name, data_dir.path, fs.to_human_readable(fs.get_total_size(data_dir.path, log), prefix="Ki")]
+        [name, data_dir.path, sizes[data_dir.path], sizes[data_dir.path].age_str()]
         for name, data_dir in config.owned_data.items()
     ]
-    print(tabulate(rows, headers=["Owned Data", "Directory", "Size"]))
+    print(tabulate(rows, headers=["Owned Data", "Directory", "Size", "Size Source"]))
     print()
 
     # print latest syncs for owned_data
@@ -64,10 +78,10 @@ def perform_examine(config: Config, cron: appcron.AppCronTab, log: logging.Logge
 
     # print stored_data
     rows = [
-        [name, data_dir.path, fs.to_human_readable(fs.get_total_size(data_dir.path, log), prefix="Ki")]
+        [name, data_dir.path, sizes[data_dir.path], sizes[data_dir.path].age_str()]
         for name, data_dir in config.stored_data.items()
     ]
-    print(tabulate(rows, headers=["Stored Data", "Directory", "Size"]))
+    print(tabulate(rows, headers=["Stored Data", "Directory", "Size", "Size Source"]))
     print()
 
     # print latest syncs for stored_data
@@ -98,8 +112,98 @@ def perform_examine(config: Config, cron: appcron.AppCronTab, log: logging.Logge
     print(tabulate(rows, headers=["Stored Data", "Last Sync", "Origin", "Files", "Sent/Received", "Duration"]))
     print()
 
+    # print latest maintenance for restic_repositories
+    rows = []
+    for repo_name, repo in config.restic_repositories.items():
+        if not repo.maintenance:
+            continue
+        sync_infos = syncinfo.read_sync_infos(config, maintenance_info_name(repo_name))
+        if sync_infos:
+            for info in sync_infos:
+                rows.append(
+                    [
+                        repo_name,
+                        "{:7}: {}".format(info.sync_type, info.timestamp),
+                        ", ".join(
+                            "{} {}".format(k, v) for k, v in info.transfer_info.items() if not k.endswith("_info")
+                        ),
+                        info.duration,
+                    ]
+                )
+        else:
+            rows.append([repo_name, "unknown", "-", "-"])
+    if rows:
+        print(tabulate(rows, headers=["Restic Repository", "Last Maintenance", "Commands", "Duration"]))
+        print()
+
+    # print snapshot index for restic_repositories
+    rows = []
+    for repo_name in config.restic_repositories.keys():
+        index = load_snapshot_index(config, repo_name, log)
+        if index.refreshed:
+            latest = index.latest()
+            rows.append(
+                [
+                    repo_name,
+                    len(index.snapshots),
+                    parse_snapshot_time(latest["time"]).replace(microsecond=0, tzinfo=None) if latest else "-",
+                    index.refreshed,
+                ]
+            )
+    if rows:
+        print(tabulate(rows, headers=["Restic Repository", "Snapshots", "Latest Snapshot", "Index Refreshed"]))
+        print()
+
+    # print rolling data verification for restic_repositories
+    rows = []
+    for repo_name in config.restic_repositories.keys():
+        check_state = ResticCheckState.load(config.restic_check_state_path(repo_name), log=log)
+        if check_state:
+            rows.append(
+                [
+                    repo_name,
+                    "{}/{} ({:.2%})".format(
+                        check_state.verified_subsets, check_state.subset_count, check_state.coverage
+                    ),
+                    check_state.last_verified if check_state.last_verified else "-",
+                    check_state.last_cycle_completed if check_state.last_cycle_completed else "-",
+                ]
+            )
+    if rows:
+        print(tabulate(rows, headers=["Restic Repository", "Cycle Coverage", "Last Verified", "Last Full Verify"]))
+        print()
+
     # print cron
     print("Crontab:")
     for job in cron.jobs():
         print(job)
     print()
+
+
+def perform_history(config: Config, data_name: str, days: int, log: logging.Logger, sync_name: str = None):
+    if (
+        data_name not in config.owned_data
+        and data_name not in config.stored_data
+        and data_name not in [maintenance_info_name(repo_name) for repo_name in config.restic_repositories.keys()]
+    ):
+        log.critical("{} data directory not present in config!".format(data_name))
+        return False
+
+    since = datetime.datetime.now() - datetime.timedelta(days=days) if days else None
+    rows = []
+    for info in syncinfo.read_sync_history(config, data_name, since=since, sync_name=sync_name):
+        if "pull" in info.location_info:
+            transferred = "{} (-{}) {}".format(
+                info.transfer_info["sync_count"], info.transfer_info["sync_deleted"], info.transfer_info["sync_bytes"]
+            )
+        else:
+            transferred = ", ".join(
+                "{} {}".format(k, v) for k, v in info.transfer_info.items() if not k.endswith("_info")
+            )
+            if "backup_info" in info.transfer_info and "data_added" in info.transfer_info["backup_info"]:
+                transferred += " ({} added)".format(
+                    fs.to_human_readable(info.transfer_info["backup_info"]["data_added"])
+                )
+        rows.append([info.name, "{:7}: {}".format(info.sync_type, info.timestamp), transferred, info.duration])
+    print(tabulate(rows, headers=["Sync", "Time", "Transferred", "Duration"]))
+    return True
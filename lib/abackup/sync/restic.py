@@ -1,9 +1,11 @@
 import datetime
+import json
 import logging
+import os
 
 from typing import Any, Dict, List
 
-from abackup import healthchecks as hc, notifications
+from abackup import fs, healthchecks as hc, notifications
 from abackup.restic import BackupResult, CheckResult, ForgetResult, PruneResult, ResticResult, ResticWrapper
 from abackup.sync import (
     AutoSync,
@@ -16,8 +18,98 @@ from abackup.sync import (
     ResticGlobalOptions,
     ResticPruneCommand,
     ResticRepository,
+    is_maintenance_command,
     syncinfo,
 )
+from abackup.sync.snapshots import refresh_snapshot_index
+
+
+class ResticCheckState:
+    def __init__(
+        self,
+        subset_count: int,
+        next_subset: int = 1,
+        cycle_started: datetime.datetime = None,
+        last_verified: datetime.datetime = None,
+        last_cycle_completed: datetime.datetime = None,
+    ):
+        self.subset_count = subset_count
+        self.next_subset = next_subset
+        self.cycle_started = cycle_started
+        self.last_verified = last_verified
+        self.last_cycle_completed = last_cycle_completed
+
+    def __str__(self):
+        return "ResticCheckState: subset {}/{}, coverage {:.2%}, last verified {}".format(
+            self.next_subset, self.subset_count, self.coverage, self.last_verified
+        )
+
+    @property
+    def verified_subsets(self):
+        return self.next_subset - 1
+
+    @property
+    def coverage(self):
+        return self.verified_subsets / self.subset_count
+
+    def advance(self):
+        now = datetime.datetime.now().replace(microsecond=0)
+        if self.next_subset == 1:
+            self.cycle_started = now
+        self.last_verified = now
+        if self.next_subset >= self.subset_count:
+            self.last_cycle_completed = now
+            self.next_subset = 1
+        else:
+            self.next_subset += 1
+
+    def to_json(self):
+        def _format(timestamp: datetime.datetime):
+            return timestamp.isoformat() if timestamp else None
+
+        return {
+            "subset_count": self.subset_count,
+            "next_subset": self.next_subset,
+            "cycle_started": _format(self.cycle_started),
+            "last_verified": _format(self.last_verified),
+            "last_cycle_completed": _format(self.last_cycle_completed),
+        }
+
+    @classmethod
+    def from_json(cls, json_dict: Dict[str, Any]):
+        def _get_timestamp(key: str):
+            value = json_dict[key] if key in json_dict else None
+            return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S") if value else None
+
+        return cls(
+            json_dict["subset_count"],
+            json_dict["next_subset"],
+            _get_timestamp("cycle_started"),
+            _get_timestamp("last_verified"),
+            _get_timestamp("last_cycle_completed"),
+        )
+
+    @classmethod
+    def load(cls, path: str, subset_count: int = None, log: logging.Logger = None):
+        state = None
+        try:
+            if os.path.exists(path):
+                with open(path, "r") as json_file:
+                    state = cls.from_json(json.load(json_file))
+        except (KeyError, TypeError, ValueError):
+            if log:
+                log.warning("Failed to read restic check state, starting a new cycle: {}".format(path))
+        if subset_count is None:
+            return state
+        if not state or state.subset_count != subset_count:
+            if state and log:
+                log.info("restic check subset count changed to {}, starting a new cycle".format(subset_count))
+            return cls(subset_count, last_cycle_completed=state.last_cycle_completed if state else None)
+        return state
+
+    def save(self, path: str):
+        with open(path, "w") as json_file:
+            print(json.dumps(self.to_json(), indent=4), file=json_file)
 
 
 class ResticInfo(syncinfo.SyncInfo):
@@ -80,10 +172,15 @@ class ResticInfo(syncinfo.SyncInfo):
             },
         )
 
-    def update_with_check_result(self, result: CheckResult):
-        if not result.succeeded:
+    def update_with_check_result(self, result: CheckResult, check_state: ResticCheckState = None):
+        if not result.succeeded or not check_state:
             return self.update_with_result(result)
-        return self.update_with_result(result)
+        return self.update_with_result(
+            result,
+            {
+                "read_data_subset": "{}/{}".format(check_state.next_subset, check_state.subset_count),
+            },
+        )
 
     def update_with_forget_result(self, result: ForgetResult):
         if not result.succeeded:
@@ -123,6 +220,33 @@ class ResticInfo(syncinfo.SyncInfo):
         return m
 
 
+def run_check_command(
+    command: ResticCheckCommand,
+    restic_wrapper: ResticWrapper,
+    log: logging.Logger,
+    global_options: Dict[str, Any],
+    sync_info: ResticInfo,
+    check_state_path: str = None,
+):
+    check_state = None
+    if command.rolling_subsets:
+        if not check_state_path:
+            log.warning("no state available for rolling restic check, running check on first subset")
+            check_state = ResticCheckState(command.rolling_subsets)
+        else:
+            check_state = ResticCheckState.load(check_state_path, command.rolling_subsets, log)
+        log.info("Verifying restic data subset {}/{}".format(check_state.next_subset, check_state.subset_count))
+        command.set_read_data_subset_option(check_state.next_subset, check_state.subset_count)
+    result = command.run(restic_wrapper, log, global_options)
+    sync_info.update_with_check_result(result, check_state)
+    if result.succeeded and check_state:
+        check_state.advance()
+        if check_state_path:
+            check_state.save(check_state_path)
+        log.info(check_state)
+    return result
+
+
 def do_restic(
     repo_name: str,
     repo: ResticRepository,
@@ -132,6 +256,7 @@ def do_restic(
     path: str,
     log: logging.Logger,
     sync_type: str = "manual",
+    check_state_path: str = None,
 ):
     log.debug(
         "do_restic({}, {}, #commands:{}, {}, {}, {})".format(
@@ -154,8 +279,9 @@ def do_restic(
             result = command.run(restic_wrapper, log, global_options.global_options, args=[path])
             sync_info.update_with_backup_result(result)
         elif isinstance(command, ResticCheckCommand):
-            result = command.run(restic_wrapper, log, global_options.global_options)
-            sync_info.update_with_check_result(result)
+            result = run_check_command(
+                command, restic_wrapper, log, global_options.global_options, sync_info, check_state_path
+            )
         elif isinstance(command, ResticForgetCommand):
             command.enable_json_output()
             command.append_tag_option("abackup", data_name)
@@ -192,24 +318,46 @@ def do_auto_restic(
     repo = config.restic_repositories[repo_name]
 
     sync_info = None
+    healthcheck_run = None
 
     if do_healthchecks and auto_sync.healthchecks:
-        hc.perform_healthcheck_start(
+        healthcheck_run = hc.perform_healthcheck_start(
             config.default_healthcheck, auto_sync.healthchecks, repo_name, config.notifier, notify_mode, log
         )
 
     log.info("running restic with {} repo on {}".format(repo_name, data_dir.path))
 
-    ret = do_restic(
-        repo_name,
-        repo,
-        data_dir.restic_options.mask(auto_sync.driver.settings.global_options),
-        auto_sync.driver.commands,
-        data_name,
-        data_dir.path,
-        log,
-        sync_type,
-    )
+    commands = auto_sync.driver.commands
+    if repo.maintenance:
+        skipped_commands = [command.command for command in commands if is_maintenance_command(command)]
+        if skipped_commands:
+            log.info(
+                "skipping {} for {}, handled by maintenance of {} repo".format(
+                    ", ".join(skipped_commands), data_name, repo_name
+                )
+            )
+        commands = [command for command in commands if not is_maintenance_command(command)]
+
+    # shared so syncs of different data dirs run side by side, but never during maintenance of the repo
+    repo_lock = fs.FileLock(config.restic_repo_lock_path(repo_name), shared=True)
+    repo_lock.acquire(log)
+    try:
+        ret = do_restic(
+            repo_name,
+            repo,
+            data_dir.restic_options.mask(auto_sync.driver.settings.global_options),
+            commands,
+            data_name,
+            data_dir.path,
+            log,
+            sync_type,
+            config.restic_check_state_path(repo_name),
+        )
+    finally:
+        repo_lock.release()
+
+    if ret:
+        refresh_snapshot_index(config, repo_name, repo, log)
 
     error_message = None
     if not ret:
@@ -229,6 +377,125 @@ def do_auto_restic(
             log,
             is_fail=not sync_info,
             message=error_message,
+            run=healthcheck_run,
+        )
+
+    return sync_info
+
+
+def maintenance_info_name(repo_name: str):
+    return "restic-{}".format(repo_name)
+
+
+def do_restic_maintenance(
+    repo_name: str,
+    repo: ResticRepository,
+    data_names: List[str],
+    log: logging.Logger,
+    sync_type: str = "manual",
+    check_state_path: str = None,
+):
+    maintenance = repo.maintenance
+    log.debug(
+        "do_restic_maintenance({}, {}, #commands:{}, {}, {})".format(
+            repo_name, maintenance.global_options.global_options, len(maintenance.commands), data_names, sync_type
+        )
+    )
+    restic_wrapper = ResticWrapper(repo.password_provider, repo.backend)
+    repo.backend.disable_status_updates()
+
+    sync_info = ResticInfo("maintenance", sync_type, repo_name, "<{} data dirs>".format(len(data_names)))
+
+    global_options = maintenance.global_options.global_options
+    for command in maintenance.commands:
+        result = None
+        if isinstance(command, ResticForgetCommand):
+            if not data_names:
+                log.warning("no data directories use {} repo, skipping restic forget".format(repo_name))
+                continue
+            log.info("Running restic forget for {}...".format(", ".join(data_names)))
+            command.enable_json_output()
+            command.set_tag_groups_option(data_names)
+            result = command.run(restic_wrapper, log, global_options)
+            sync_info.update_with_forget_result(result)
+        elif isinstance(command, ResticCheckCommand):
+            log.info("Running restic check...")
+            result = run_check_command(command, restic_wrapper, log, global_options, sync_info, check_state_path)
+        elif isinstance(command, ResticPruneCommand):
+            log.info("Running restic prune...")
+            result = command.run(restic_wrapper, log, global_options)
+            sync_info.update_with_prune_result(result)
+        else:
+            log.warning("restic {} is not a maintenance command, skipping".format(command.command))
+            continue
+
+        if not result.succeeded:
+            log.error("restic {} failed!".format(command.command))
+            return None
+        log.info("restic {} succeeded.".format(command.command))
+
+    return sync_info
+
+
+def do_auto_restic_maintenance(
+    config: Config,
+    repo_name: str,
+    repo: ResticRepository,
+    notify: str,
+    log: logging.Logger,
+    sync_type: str = "manual",
+    do_healthchecks: bool = True,
+):
+    notify_mode = notifications.Mode(notify)
+    maintenance = repo.maintenance
+    data_names = config.data_names_for_restic_repo(repo_name)
+
+    sync_info = None
+    healthcheck_run = None
+
+    if do_healthchecks and maintenance.healthchecks:
+        healthcheck_run = hc.perform_healthcheck_start(
+            config.default_healthcheck, maintenance.healthchecks, repo_name, config.notifier, notify_mode, log
+        )
+
+    log.info("running restic maintenance on {} repo".format(repo_name))
+
+    # exclusive, waits for the syncs of the repo that are running now to finish first, not for ones yet to start
+    repo_lock = fs.FileLock(config.restic_repo_lock_path(repo_name), timeout=maintenance.wait_timeout)
+    ret = None
+    error_message = None
+    if repo_lock.acquire(log):
+        try:
+            ret = do_restic_maintenance(
+                repo_name, repo, data_names, log, sync_type, config.restic_check_state_path(repo_name)
+            )
+        finally:
+            repo_lock.release()
+    else:
+        error_message = "Timed out waiting for syncs of {} to finish!".format(repo_name)
+
+    if ret:
+        refresh_snapshot_index(config, repo_name, repo, log)
+
+    if not ret:
+        if not error_message:
+            error_message = "Failed maintenance of {}!".format(repo_name)
+        syncinfo.handle_failed_sync(config.notifier, repo_name, repo_name, False, error_message, notify_mode, log)
+    else:
+        syncinfo.handle_sync_results(config.notifier, repo_name, repo_name, False, ret, notify_mode, log)
+        sync_info = ret
+
+    if do_healthchecks and maintenance.healthchecks:
+        hc.perform_healthcheck(
+            config.default_healthcheck,
+            maintenance.healthchecks,
+            repo_name,
+            config.notifier,
+            notify_mode,
+            log,
+            is_fail=not sync_info,
+            message=error_message,
+            run=healthcheck_run,
         )
 
     return sync_info
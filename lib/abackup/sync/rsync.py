@@ -5,8 +5,9 @@ import re
 import subprocess
 from typing import List, Union
 
-from abackup import RemoteCommand, build_commands, fs, healthchecks as hc, notifications
+from abackup import RemoteCommand, build_commands, fs, healthchecks as hc, notifications, spans
 from abackup.prepare import rsync as prepare_rsync
+from abackup.usage import run_with_usage
 
 from abackup.sync import AutoSync, Config, DataDir, Remote, RsyncOptions, syncinfo
 
@@ -105,6 +106,48 @@ def get_stored_path_from_remote(stored_data_name: str, remote: Remote, absync_op
     return get_path_from_remote("stored-path", stored_data_name, remote, absync_options, log)
 
 
+def parse_rsync_output(stdout: str, pull: bool = False):
+    """The (sync_count, sync_deleted, sync_bytes, transferred_files, deleted_files) of the output of rsync --stats
+    --info=del --info=name, the transferred files are cut off with a "..." after the first 1000
+    """
+    deleted_files = []
+    transferred_files = []
+    max_transferred_files = 1000
+    sync_count = 0
+    sync_deleted = 0
+    sync_bytes = 0
+    deleted_files_regex = re.compile(r"^deleting\s+(.*)$")
+    transferred_regex = re.compile(r"^([^/]+/(?:[^/]+/*)*)$")
+    count_regex = re.compile(r"Number of regular files transferred:\s+([\d,]+)")
+    deleted_regex = re.compile(r"Number of deleted files:\s+([\d,]+)")
+    if pull:
+        bytes_regex = re.compile(r"Total bytes received:\s+([\d,]+)")
+    else:
+        bytes_regex = re.compile(r"Total bytes sent:\s+([\d,]+)")
+    for line in stdout.split("\n"):
+        deleted_files_match = deleted_files_regex.match(line)
+        count_match = count_regex.search(line)
+        deleted_match = deleted_regex.search(line)
+        bytes_match = bytes_regex.search(line)
+        if deleted_files_match:
+            deleted_files.append(deleted_files_match.group(1))
+        elif len(transferred_files) < max_transferred_files:
+            transferred_match = transferred_regex.match(line)
+            if transferred_match:
+                tf = transferred_match.group(1)
+                if not tf.startswith("created directory") and not tf.endswith("bytes/sec"):
+                    transferred_files.append(transferred_match.group(1))
+        if count_match:
+            sync_count = locale.atoi(count_match.group(1))
+        if deleted_match:
+            sync_deleted = locale.atoi(deleted_match.group(1))
+        if bytes_match:
+            sync_bytes = locale.atoi(bytes_match.group(1))
+    if len(transferred_files) == max_transferred_files:
+        transferred_files.append("...")
+    return sync_count, sync_deleted, sync_bytes, transferred_files, deleted_files
+
+
 def do_rsync(
     origin: Union[str, List],
     destination: str,
@@ -138,46 +181,20 @@ def do_rsync(
     log.info("Running rsync...")
     log.debug(command_list)
     timestamp = datetime.datetime.now()
-    run_out = subprocess.run(command_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    with spans.span("command", "rsync", command=" ".join(command_list)[:120]) as command_span:
+        run_out = run_with_usage(command_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        command_span.ok = run_out.returncode == 0
+        command_span.set(returncode=run_out.returncode)
+        command_span.add_usage(run_out.usage)
     duration = datetime.datetime.now() - timestamp
+    log.info("Command rsync: {}".format(run_out.usage))
 
     if run_out.returncode == 0:
         log.info("rsync succeeded")
-        deleted_files = []
-        transferred_files = []
-        max_transferred_files = 1000
-        sync_count = 0
-        sync_deleted = 0
-        sync_bytes = 0
-        deleted_files_regex = re.compile(r"^deleting\s+(.*)$")
-        transferred_regex = re.compile(r"^([^/]+/(?:[^/]+/*)*)$")
-        count_regex = re.compile(r"Number of regular files transferred:\s+([\d,]+)")
-        deleted_regex = re.compile(r"Number of deleted files:\s+([\d,]+)")
-        if pull:
-            bytes_regex = re.compile(r"Total bytes received:\s+([\d,]+)")
-        else:
-            bytes_regex = re.compile(r"Total bytes sent:\s+([\d,]+)")
-        for line in run_out.stdout.split("\n"):
-            deleted_files_match = deleted_files_regex.match(line)
-            count_match = count_regex.search(line)
-            deleted_match = deleted_regex.search(line)
-            bytes_match = bytes_regex.search(line)
-            if deleted_files_match:
-                deleted_files.append(deleted_files_match.group(1))
-            elif len(transferred_files) < max_transferred_files:
-                transferred_match = transferred_regex.match(line)
-                if transferred_match:
-                    tf = transferred_match.group(1)
-                    if not tf.startswith("created directory") and not tf.endswith("bytes/sec"):
-                        transferred_files.append(transferred_match.group(1))
-            if count_match:
-                sync_count = locale.atoi(count_match.group(1))
-            if deleted_match:
-                sync_deleted = locale.atoi(deleted_match.group(1))
-            if bytes_match:
-                sync_bytes = locale.atoi(bytes_match.group(1))
-        if len(transferred_files) == max_transferred_files:
-            transferred_files.append("...")
+        with spans.span("parse_rsync_output", lines=run_out.stdout.count("\n")):
+            sync_count, sync_deleted, sync_bytes, transferred_files, deleted_files = parse_rsync_output(
+                run_out.stdout, pull
+            )
         info = RsyncInfo(
             sync_name,
             sync_type,
@@ -220,8 +237,9 @@ def do_auto_rsync(
     remote_name = auto_sync.driver.settings.remote_name
     remote = config.remotes[remote_name]
 
+    healthcheck_run = None
     if do_healthchecks and auto_sync.healthchecks:
-        hc.perform_healthcheck_start(
+        healthcheck_run = hc.perform_healthcheck_start(
             config.default_healthcheck, auto_sync.healthchecks, remote_name, config.notifier, notify_mode, log
         )
 
@@ -296,6 +314,7 @@ def do_auto_rsync(
             log,
             is_fail=sync_info is None,
             message=error_message,
+            run=healthcheck_run,
         )
 
     return sync_info
@@ -0,0 +1,164 @@
+import datetime
+import json
+import logging
+import os
+import shlex
+import subprocess
+
+from typing import Dict, List
+
+from abackup import fs, zfs
+from abackup.sync import Config
+
+
+class DataSize:
+    def __init__(self, size: int, source: str, measured: datetime.datetime = None):
+        self.size = size
+        self.source = source
+        self.measured = measured
+
+    def __str__(self):
+        return fs.to_human_readable(self.size) if self.size is not None else "-"
+
+    def age_str(self):
+        if self.size is None:
+            return self.source
+        if not self.measured:
+            return "{}, now".format(self.source)
+        age = datetime.datetime.now() - self.measured
+        if age < datetime.timedelta(hours=1):
+            age_str = "{}m".format(int(age.total_seconds() // 60))
+        elif age < datetime.timedelta(days=2):
+            age_str = "{}h".format(int(age.total_seconds() // 3600))
+        else:
+            age_str = "{}d".format(age.days)
+        return "{}, {} old".format(self.source, age_str)
+
+
+class SizeCache:
+    def __init__(self, path: str):
+        self.path = path
+        self.sizes = {}
+
+    @classmethod
+    def load(cls, path: str):
+        cache = cls(path)
+        try:
+            if os.path.exists(path):
+                with open(path, "r") as json_file:
+                    cache.sizes = {
+                        k: DataSize(v["size"], "scan", datetime.datetime.strptime(v["measured"], "%Y-%m-%dT%H:%M:%S"))
+                        for k, v in json.load(json_file).items()
+                    }
+        except (KeyError, TypeError, ValueError):
+            cache.sizes = {}
+        return cache
+
+    def save(self):
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "w") as json_file:
+            json.dump(
+                {
+                    k: {"size": v.size, "measured": v.measured.replace(microsecond=0).isoformat()}
+                    for k, v in self.sizes.items()
+                },
+                json_file,
+            )
+        os.replace(tmp_path, self.path)
+
+    def is_stale(self, path: str, max_age: datetime.timedelta):
+        return path not in self.sizes or datetime.datetime.now() - self.sizes[path].measured > max_age
+
+
+def size_cache_path(config: Config):
+    return os.path.join(config._ensure_log_dir(), "sizes.json")
+
+
+def cheap_size(path: str, zfs_used: Dict[str, int]):
+    real_path = os.path.realpath(path)
+    if real_path in zfs_used:
+        return DataSize(zfs_used[real_path], "zfs")
+    if os.path.ismount(real_path):
+        return DataSize(fs.get_fs_used_size(real_path), "statvfs")
+    return None
+
+
+def scanned_size(path: str, log: logging.Logger):
+    stats = fs.scan_tree(path, log)
+    if stats is False:
+        return None
+    return DataSize(stats.total_bytes, "scan", datetime.datetime.now())
+
+
+def refresh_sizes(config: Config, paths: List[str], log: logging.Logger):
+    lock = fs.FileLock("{}.lock".format(size_cache_path(config)), timeout=0)
+    if not lock.acquire():
+        log.info("size refresh already running")
+        return True
+    try:
+        zfs_used = zfs.dataset_used_by_mountpoint(log)
+        success = True
+        for path in paths:
+            if cheap_size(path, zfs_used):
+                continue
+            size = scanned_size(path, log)
+            if not size:
+                success = False
+                continue
+            # reload for every path, examine may be reading the cache meanwhile
+            cache = SizeCache.load(size_cache_path(config))
+            cache.sizes[path] = size
+            cache.save()
+            log.info("size of {}: {}".format(path, size))
+        return success
+    finally:
+        lock.release()
+
+
+def start_background_refresh(absync_options: str, log: logging.Logger):
+    command = "absync {} refresh-sizes".format(absync_options)
+    log.info("Starting size refresh in the background: {}".format(command))
+    try:
+        subprocess.Popen(
+            shlex.split(command),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError as e:
+        log.warning("Failed to start size refresh: {}".format(e))
+
+
+def get_data_sizes(
+    config: Config,
+    paths: List[str],
+    log: logging.Logger,
+    fresh: bool = False,
+    absync_options: str = None,
+    max_age: datetime.timedelta = datetime.timedelta(days=1),
+):
+    zfs_used = zfs.dataset_used_by_mountpoint(log)
+    cache = SizeCache.load(size_cache_path(config))
+    sizes = {}
+    do_refresh = False
+    for path in paths:
+        size = cheap_size(path, zfs_used)
+        if not size and fresh:
+            size = scanned_size(path, log)
+            if size:
+                cache.sizes[path] = size
+        if not size and path in cache.sizes:
+            size = cache.sizes[path]
+        if not size:
+            size = DataSize(None, "scanning in background" if absync_options is not None else "unknown")
+        if size.source == "scan" and cache.is_stale(path, max_age):
+            do_refresh = True
+        elif size.size is None:
+            do_refresh = True
+        sizes[path] = size
+    if fresh:
+        cache.save()
+    elif do_refresh and absync_options is not None:
+        start_background_refresh(absync_options, log)
+    return sizes
@@ -0,0 +1,263 @@
+import copy
+import datetime
+import json
+import logging
+import os
+import tempfile
+
+from typing import Any, Dict, List
+
+from tabulate import tabulate
+
+from abackup import fs
+from abackup.restic import ResticWrapper, simulate_forget
+from abackup.sync import Config, ResticDriver, ResticForgetCommand, ResticGlobalOptions, ResticRepository
+
+
+def parse_snapshot_time(time_string: str):
+    # restic writes nanoseconds and a utc offset, e.g. 2023-01-02T03:04:05.123456789+01:00
+    date_part, _, rest = time_string.partition(".")
+    if not rest:
+        return datetime.datetime.fromisoformat(time_string)
+    offset_index = max(rest.find("+"), rest.find("-"), rest.find("Z"))
+    fraction = rest[:offset_index] if offset_index >= 0 else rest
+    offset = rest[offset_index:] if offset_index >= 0 else ""
+    if offset == "Z":
+        offset = "+00:00"
+    return datetime.datetime.fromisoformat("{}.{}{}".format(date_part, fraction[:6].ljust(6, "0"), offset))
+
+
+class ResticSnapshotIndex:
+    def __init__(self, path: str, snapshots: Dict[str, Dict[str, Any]] = None, refreshed: datetime.datetime = None):
+        self.path = path
+        self.snapshots = snapshots if snapshots else {}
+        self.refreshed = refreshed
+
+    def __str__(self):
+        return "ResticSnapshotIndex: {} snapshots, refreshed {}".format(len(self.snapshots), self.refreshed)
+
+    @classmethod
+    def load(cls, path: str, log: logging.Logger = None):
+        try:
+            if os.path.exists(path):
+                with open(path, "r") as json_file:
+                    json_dict = json.load(json_file)
+                refreshed = json_dict["refreshed"] if "refreshed" in json_dict else None
+                return cls(
+                    path,
+                    json_dict["snapshots"],
+                    datetime.datetime.strptime(refreshed, "%Y-%m-%dT%H:%M:%S") if refreshed else None,
+                )
+        except (KeyError, TypeError, ValueError):
+            if log:
+                log.warning("Failed to read restic snapshot index, starting a new one: {}".format(path))
+        return cls(path)
+
+    def save(self):
+        # a temp file of its own, refreshes of the same repo may save at once, e.g. after syncs of two data dirs
+        fd, tmp_path = tempfile.mkstemp(
+            prefix="{}.".format(os.path.basename(self.path)), dir=os.path.dirname(self.path)
+        )
+        try:
+            with os.fdopen(fd, "w") as json_file:
+                json.dump(
+                    {
+                        "refreshed": self.refreshed.isoformat() if self.refreshed else None,
+                        "snapshots": self.snapshots,
+                    },
+                    json_file,
+                )
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def refresh(
+        self,
+        restic_wrapper: ResticWrapper,
+        log: logging.Logger,
+        global_options: Dict[str, Any] = None,
+        batch_size: int = 100,
+    ):
+        log.debug("ResticSnapshotIndex::refresh({})".format(self.path))
+        list_result = restic_wrapper.list(log, "snapshots", global_options)
+        if not list_result.succeeded:
+            log.error("Failed to list restic snapshots!")
+            return False
+
+        remote_ids = set(list_result.ids)
+        removed_ids = [snapshot_id for snapshot_id in self.snapshots.keys() if snapshot_id not in remote_ids]
+        new_ids = sorted(remote_ids.difference(self.snapshots.keys()))
+        log.info("restic snapshot index: {} new, {} removed".format(len(new_ids), len(removed_ids)))
+
+        for snapshot_id in removed_ids:
+            del self.snapshots[snapshot_id]
+        for i in range(0, len(new_ids), batch_size):
+            snapshots_result = restic_wrapper.snapshots(log, global_options, args=new_ids[i : i + batch_size])
+            if not snapshots_result.succeeded:
+                log.error("Failed to get restic snapshots!")
+                return False
+            for snapshot in snapshots_result.snapshots:
+                self.snapshots[snapshot["id"]] = snapshot
+
+        self.refreshed = datetime.datetime.now().replace(microsecond=0)
+        self.save()
+        return True
+
+    def find(self, tags: List[str] = None, host: str = None, path: str = None):
+        def _matches(snapshot: Dict[str, Any]):
+            if tags and not set(tags).issubset(snapshot["tags"] if "tags" in snapshot else []):
+                return False
+            if host and snapshot["hostname"] != host:
+                return False
+            if path and path not in snapshot["paths"]:
+                return False
+            return True
+
+        return sorted(
+            [snapshot for snapshot in self.snapshots.values() if _matches(snapshot)],
+            key=lambda snapshot: parse_snapshot_time(snapshot["time"]),
+        )
+
+    def latest(self, tags: List[str] = None, host: str = None, path: str = None):
+        snapshots = self.find(tags, host, path)
+        return snapshots[-1] if snapshots else None
+
+
+def load_snapshot_index(config: Config, repo_name: str, log: logging.Logger = None):
+    return ResticSnapshotIndex.load(config.restic_snapshot_index_path(repo_name), log)
+
+
+def refresh_snapshot_index(config: Config, repo_name: str, repo: ResticRepository, log: logging.Logger):
+    index = load_snapshot_index(config, repo_name, log)
+    restic_wrapper = ResticWrapper(repo.password_provider, repo.backend)
+    global_options = ResticGlobalOptions.default()
+    if repo.maintenance:
+        global_options = repo.maintenance.global_options
+    if not index.refresh(restic_wrapper, log, global_options.global_options):
+        return None
+    log.info(index)
+    return index
+
+
+def perform_list_snapshots(
+    config: Config, log: logging.Logger, only_repo_name: str = None, only_data_name: str = None, refresh: bool = False
+):
+    if only_repo_name and only_repo_name not in config.restic_repositories:
+        log.critical("{} restic repository not present in config!".format(only_repo_name))
+        return False
+
+    success = True
+    rows = []
+    for repo_name, repo in config.restic_repositories.items():
+        if only_repo_name and repo_name != only_repo_name:
+            continue
+        if refresh:
+            index = refresh_snapshot_index(config, repo_name, repo, log)
+            if not index:
+                success = False
+                continue
+        else:
+            index = load_snapshot_index(config, repo_name, log)
+        for snapshot in index.find(tags=[only_data_name] if only_data_name else None):
+            summary = snapshot["summary"] if "summary" in snapshot else {}
+            rows.append(
+                [
+                    repo_name,
+                    snapshot["short_id"],
+                    parse_snapshot_time(snapshot["time"]).replace(microsecond=0, tzinfo=None),
+                    snapshot["hostname"],
+                    ",".join(snapshot["tags"]) if "tags" in snapshot else "",
+                    "\n".join(snapshot["paths"]),
+                    fs.to_human_readable(summary["data_added"]) if "data_added" in summary else "-",
+                ]
+            )
+    print(tabulate(rows, headers=["Restic Repository", "ID", "Time", "Host", "Tags", "Paths", "Data Added"]))
+    return success
+
+
+def configured_forget_options(config: Config, repo_name: str, only_data_name: str = None):
+    repo = config.restic_repositories[repo_name]
+    if only_data_name:
+        data_dir = config.owned_data[only_data_name]
+        for auto_sync in data_dir.auto_sync:
+            if isinstance(auto_sync.driver, ResticDriver) and auto_sync.driver.settings.repo_name == repo_name:
+                for command in auto_sync.driver.commands:
+                    if isinstance(command, ResticForgetCommand) and not repo.maintenance:
+                        forget_command = ResticForgetCommand(copy.deepcopy(command.options), skip_defaults=True)
+                        forget_command.append_tag_option("abackup", only_data_name)
+                        return forget_command.options
+    data_names = [only_data_name] if only_data_name else config.data_names_for_restic_repo(repo_name)
+    forget_command = ResticForgetCommand()
+    if repo.maintenance:
+        for command in repo.maintenance.commands:
+            if isinstance(command, ResticForgetCommand):
+                forget_command = ResticForgetCommand(copy.deepcopy(command.options), skip_defaults=True)
+    forget_command.set_tag_groups_option(data_names)
+    return forget_command.options
+
+
+def perform_simulate_forget(
+    config: Config,
+    repo_name: str,
+    policy_options: Dict[str, Any],
+    log: logging.Logger,
+    only_data_name: str = None,
+    show_all: bool = False,
+):
+    if repo_name not in config.restic_repositories:
+        log.critical("{} restic repository not present in config!".format(repo_name))
+        return False
+    if only_data_name and only_data_name not in config.owned_data:
+        log.critical("{} data directory not present in config!".format(only_data_name))
+        return False
+
+    index = load_snapshot_index(config, repo_name, log)
+    if not index.refreshed:
+        log.error(
+            "No snapshot index for {}, run: absync snapshots --refresh --repo-name {}".format(repo_name, repo_name)
+        )
+        return False
+
+    options = configured_forget_options(config, repo_name, only_data_name)
+    if any(key.startswith("keep-") for key in policy_options.keys()):
+        options = {k: v for k, v in options.items() if not k.startswith("keep-")}
+    options = {**options, **policy_options}
+    log.debug("perform_simulate_forget({}, {}): options: {}".format(repo_name, only_data_name, options))
+
+    policy, groups = simulate_forget(list(index.snapshots.values()), options, parse_snapshot_time)
+    print("Policy: {}".format(policy if not policy.is_empty() else "empty, all snapshots are kept"))
+    print("Snapshot index refreshed: {}".format(index.refreshed))
+    print()
+
+    remove_count = 0
+    reclaimable_bytes = 0
+    for group in groups:
+        rows = []
+        kept_ids = {snapshot["id"] for snapshot in group.keep}
+        for snapshot in sorted(group.keep + group.remove, key=lambda s: parse_snapshot_time(s["time"]), reverse=True):
+            is_kept = snapshot["id"] in kept_ids
+            if is_kept and not show_all:
+                continue
+            rows.append(
+                [
+                    snapshot["short_id"],
+                    parse_snapshot_time(snapshot["time"]).replace(microsecond=0, tzinfo=None),
+                    ",".join(snapshot["tags"]) if "tags" in snapshot and snapshot["tags"] else "",
+                    "keep" if is_kept else "remove",
+                    ", ".join(group.reasons.get(snapshot["id"], [])),
+                ]
+            )
+        print("Group: {} -- keep {}, remove {}".format(group, len(group.keep), len(group.remove)))
+        if rows:
+            print(tabulate(rows, headers=["ID", "Time", "Tags", "Action", "Reasons"]))
+        print()
+        remove_count += len(group.remove)
+        reclaimable_bytes += group.reclaimable_bytes
+
+    print(
+        "{} snapshot(s) would be removed, reclaiming at most {} (from snapshot summaries)".format(
+            remove_count, fs.to_human_readable(reclaimable_bytes)
+        )
+    )
+    return True
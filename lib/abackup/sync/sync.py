@@ -1,11 +1,26 @@
 import logging
 import re
+import time
 
 from typing import Dict
 
+from abackup import spans
+from abackup.metrics import add_job_metrics
 from abackup.sync import AutoSync, Config, DataDir, Remote, ResticDriver, RsyncDriver, syncinfo
-from abackup.sync.restic import do_auto_restic
-from abackup.sync.rsync import RsyncOptions, do_auto_rsync, do_rsync
+from abackup.sync.restic import do_auto_restic, do_auto_restic_maintenance, maintenance_info_name
+from abackup.sync.rsync import RsyncInfo, RsyncOptions, do_auto_rsync, do_rsync
+
+# restic backup summary field: metric
+RESTIC_SUMMARY_METRICS = {
+    "files_new": "absync_restic_files_new",
+    "files_changed": "absync_restic_files_changed",
+    "files_unmodified": "absync_restic_files_unmodified",
+    "dirs_new": "absync_restic_dirs_new",
+    "dirs_changed": "absync_restic_dirs_changed",
+    "data_added": "absync_restic_data_added_bytes",
+    "total_files_processed": "absync_restic_total_files_processed",
+    "total_bytes_processed": "absync_restic_total_bytes_processed",
+}
 
 
 def perform_rsync(
@@ -63,13 +78,15 @@ def perform_rsync(
     else:
         log.info("syncing {} with {}".format(origin, destination))
 
-    ret = do_rsync(
-        origin, destination, data_dir.rsync_options.mask(RsyncOptions(delete, max_delete)), log, remote, pull=pull
-    )
+    with spans.span("rsync", data_name) as rsync_span:
+        ret = do_rsync(
+            origin, destination, data_dir.rsync_options.mask(RsyncOptions(delete, max_delete)), log, remote, pull=pull
+        )
+        rsync_span.ok = ret is not None
 
-    if ret:
-        syncinfo.write_sync_infos([ret], config, data_name)
-        return True
+        if ret:
+            syncinfo.write_sync_infos([ret], config, data_name)
+            return True
     return False
 
 
@@ -116,6 +133,29 @@ def perform_auto_sync(
             )
         return None
 
+    def write_metrics(name: str, auto_sync: AutoSync, sync_info: syncinfo.SyncInfo, duration: float):
+        metrics_file = config.metrics_file("absync_sync_{}_{}".format(name, auto_sync.sync_name))
+        if not metrics_file:
+            return
+        is_restic = isinstance(auto_sync.driver, ResticDriver)
+        labels = {"data": name, "sync": auto_sync.sync_name, "driver": "restic" if is_restic else "rsync"}
+        size = None
+        files = None
+        if isinstance(sync_info, RsyncInfo):
+            size = sync_info.sync_bytes
+            files = sync_info.sync_count
+        elif sync_info and "backup_info" in sync_info.transfer_info:
+            summary = sync_info.transfer_info["backup_info"]
+            size = summary["data_added"]
+            files = summary["files_new"] + summary["files_changed"]
+            for key, metric in RESTIC_SUMMARY_METRICS.items():
+                metrics_file.add(metric, summary[key], labels)
+        add_job_metrics(
+            metrics_file, "absync_sync", labels, sync_info is not None, duration, size, spans.current_usage()
+        )
+        metrics_file.add("absync_sync_files", files, labels)
+        metrics_file.write()
+
     def process_data_dir(name: str, data_dir: DataDir, is_stored_data: bool):
         if only_data_name and name != only_data_name:
             return True
@@ -124,21 +164,75 @@ def perform_auto_sync(
         for auto_sync in data_dir.auto_sync:
             if only_sync_name and auto_sync.sync_name != only_sync_name:
                 continue
-            sync_info = process_auto_sync(auto_sync, is_stored_data)
+            started = time.monotonic()
+            with spans.span("auto_sync", "{}/{}".format(name, auto_sync.sync_name)) as sync_span:
+                sync_info = process_auto_sync(auto_sync, is_stored_data)
+                sync_span.ok = sync_info is not None
+                write_metrics(name, auto_sync, sync_info, time.monotonic() - started)
             if sync_info is None:
                 sync_succeeded = False
             else:
                 sync_infos.append(sync_info)
         if len(sync_infos) > 0:
-            syncinfo.write_sync_infos(sync_infos, config, name)
+            with spans.span("sync_info", name):
+                syncinfo.write_sync_infos(sync_infos, config, name)
         return sync_succeeded
 
     sync_succeeded = True
 
-    for name, data_dir in config.owned_data.items():
-        sync_succeeded = process_data_dir(name, data_dir, is_stored_data=False) and sync_succeeded
+    with spans.span("sync", sync_type) as sync_span:
+        for name, data_dir in config.owned_data.items():
+            sync_succeeded = process_data_dir(name, data_dir, is_stored_data=False) and sync_succeeded
 
-    for name, data_dir in config.stored_data.items():
-        sync_succeeded = process_data_dir(name, data_dir, is_stored_data=True) and sync_succeeded
+        for name, data_dir in config.stored_data.items():
+            sync_succeeded = process_data_dir(name, data_dir, is_stored_data=True) and sync_succeeded
+        sync_span.ok = sync_succeeded
 
     return sync_succeeded
+
+
+def perform_restic_maintenance(
+    config: Config,
+    notify: str,
+    log: logging.Logger,
+    only_repo_name: str = None,
+    sync_type: str = "manual",
+    do_healthchecks: bool = True,
+):
+    if only_repo_name:
+        if only_repo_name not in config.restic_repositories:
+            log.critical("{} restic repository not present in config!".format(only_repo_name))
+            return False
+        log.info("\tonly for {}".format(only_repo_name))
+
+    maintenance_succeeded = True
+
+    with spans.span("maintenance", sync_type) as maintenance_span:
+        for repo_name, repo in config.restic_repositories.items():
+            if only_repo_name and repo_name != only_repo_name:
+                continue
+            if not repo.maintenance:
+                log.info("skipping {}, no maintenance settings defined".format(repo_name))
+                continue
+            started = time.monotonic()
+            with spans.span("repo", repo_name) as repo_span:
+                sync_info = do_auto_restic_maintenance(config, repo_name, repo, notify, log, sync_type, do_healthchecks)
+                repo_span.ok = sync_info is not None
+            metrics_file = config.metrics_file("absync_maintenance_{}".format(repo_name))
+            if metrics_file:
+                add_job_metrics(
+                    metrics_file,
+                    "absync_maintenance",
+                    {"repo": repo_name},
+                    sync_info is not None,
+                    time.monotonic() - started,
+                    usage=repo_span.usage,
+                )
+                metrics_file.write()
+            if sync_info is None:
+                maintenance_succeeded = False
+            else:
+                syncinfo.write_sync_infos([sync_info], config, maintenance_info_name(repo_name))
+        maintenance_span.ok = maintenance_succeeded
+
+    return maintenance_succeeded
@@ -6,7 +6,7 @@ import json
 from inspect import currentframe, getframeinfo
 from typing import Any, Dict, List
 
-from abackup import notifications
+from abackup import fs, notifications
 from abackup.sync import Config
 
 
@@ -99,47 +99,156 @@ def deserialize_sync_infos(json_string: str):
     return [unjsonify_sync_info(json_rep) for _, json_rep in json.loads(json_string).items()]
 
 
-class SyncInfosSerializer:
-    def __init__(self, config: Config, data_name: str):
-        self.json_file_path = os.path.join(config.log_root, "{}-latest.json".format(data_name))
+class SyncHistory:
+    # bulky fields dropped from sealed segments during compaction
+    compacted_fields = ["transferred_files", "deleted_files", "marked_for_removal", "stdout", "stderr"]
 
-    def serialize(self, sync_infos: List[SyncInfo]):
+    def __init__(self, log_root: str, data_name: str, max_segment_bytes: int = 1048576):
+        self.log_root = log_root
+        self.data_name = data_name
+        self.max_segment_bytes = max_segment_bytes
+        self.history_path = os.path.join(log_root, "{}-history.jsonl".format(data_name))
+        self.latest_path = os.path.join(log_root, "{}-latest.json".format(data_name))
+        self.lock_path = os.path.join(log_root, "{}-history.lock".format(data_name))
+
+    def _lock(self, shared: bool = False):
+        lock = fs.FileLock(self.lock_path, shared=shared)
+        lock.acquire()
+        return lock
+
+    def _read_latest(self):
+        try:
+            if not os.path.exists(self.latest_path):
+                return None
+            with open(self.latest_path, "r") as json_file:
+                return deserialize_sync_infos(json_file.read())
+        except (TypeError, ValueError):
+            return None
+
+    def _write_latest(self, sync_infos: List[SyncInfo]):
+        tmp_path = "{}.tmp".format(self.latest_path)
+        with open(tmp_path, "w") as json_file:
+            print(serialize_sync_infos(sync_infos), file=json_file)
+        os.replace(tmp_path, self.latest_path)
+
+    def sealed_segments(self):
+        prefix = "{}-history.".format(self.data_name)
+        return sorted(
+            os.path.join(self.log_root, filename)
+            for filename in fs.find_files(self.log_root, prefix, ".jsonl")
+            if filename != os.path.basename(self.history_path)
+        )
+
+    def _seal_active_segment(self, last_timestamp: datetime.datetime):
+        sealed_path = os.path.join(
+            self.log_root, "{}-history.{}.jsonl".format(self.data_name, last_timestamp.strftime("%Y%m%d%H%M%S"))
+        )
+        os.replace(self.history_path, sealed_path)
+        self._compact_segment(sealed_path)
+
+    def _compact_segment(self, path: str):
+        def _strip(info: Dict[str, Any]):
+            return {
+                k: _strip(v) if isinstance(v, dict) else v for k, v in info.items() if k not in self.compacted_fields
+            }
+
+        tmp_path = "{}.tmp".format(path)
+        with open(path, "r") as segment, open(tmp_path, "w") as compacted:
+            for line in segment:
+                try:
+                    print(json.dumps(_strip(json.loads(line))), file=compacted)
+                except ValueError:
+                    continue
+        os.replace(tmp_path, path)
+
+    def append(self, sync_infos: List[SyncInfo]):
+        lock = self._lock()
         try:
-            previous_sync_infos = self.deserialize()
-            if not previous_sync_infos:
-                previous_sync_infos = []
-            sync_infos_dict = {sync_info.name: sync_info for sync_info in previous_sync_infos}
+            latest = self._read_latest()
+            if latest and not os.path.exists(self.history_path) and not self.sealed_segments():
+                # seed the history with the runs of the former latest-only file
+                with open(self.history_path, "a") as history_file:
+                    for sync_info in latest:
+                        print(json.dumps(jsonify_sync_info(sync_info)), file=history_file)
+            with open(self.history_path, "a") as history_file:
+                for sync_info in sync_infos:
+                    print(json.dumps(jsonify_sync_info(sync_info)), file=history_file)
+            latest_dict = {sync_info.name: sync_info for sync_info in latest} if latest else {}
             for sync_info in sync_infos:
-                sync_infos_dict[sync_info.name] = sync_info
-            with open(self.json_file_path, "w") as json_file:
-                print(serialize_sync_infos(sync_infos_dict.values()), file=json_file)
+                latest_dict[sync_info.name] = sync_info
+            self._write_latest(list(latest_dict.values()))
+            if os.path.getsize(self.history_path) > self.max_segment_bytes:
+                self._seal_active_segment(max(sync_info.timestamp for sync_info in sync_infos))
             return True
-        except TypeError:
-            return False
-        except ValueError:
+        except (TypeError, ValueError):
             return False
+        finally:
+            lock.release()
 
-    def deserialize(self):
+    def latest(self):
+        lock = self._lock(shared=True)
         try:
-            if not os.path.exists(self.json_file_path):
-                return False
-            with open(self.json_file_path, "r") as json_file:
-                return deserialize_sync_infos(json_file.read())
-        except TypeError:
-            return False
-        except ValueError:
-            return False
+            latest = self._read_latest()
+            if latest is None:
+                latest_dict = {}
+                for sync_info in self._read_segments(self.sealed_segments() + [self.history_path]):
+                    latest_dict[sync_info.name] = sync_info
+                latest = list(latest_dict.values())
+            return latest
+        finally:
+            lock.release()
+
+    def _read_segments(self, paths: List[str]):
+        sync_infos = []
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, "r") as segment:
+                for line in segment:
+                    try:
+                        sync_infos.append(unjsonify_sync_info(json.loads(line)))
+                    except ValueError:
+                        continue
+        return sync_infos
+
+    def query(
+        self, since: datetime.datetime = None, until: datetime.datetime = None, sync_name: str = None
+    ) -> List[SyncInfo]:
+        def _segment_end(path: str):
+            return datetime.datetime.strptime(path.rsplit(".", 2)[-2], "%Y%m%d%H%M%S")
+
+        # sealed segments are named after their last run, so older ones can be skipped without reading them
+        lock = self._lock(shared=True)
+        try:
+            paths = [path for path in self.sealed_segments() if not since or _segment_end(path) >= since]
+            sync_infos = self._read_segments(paths + [self.history_path])
+        finally:
+            lock.release()
+        return [
+            sync_info
+            for sync_info in sync_infos
+            if (not since or sync_info.timestamp >= since)
+            and (not until or sync_info.timestamp <= until)
+            and (not sync_name or sync_info.name == sync_name)
+        ]
 
 
 def write_sync_infos(sync_infos: List[SyncInfo], config: Config, data_name: str):
-    serializer = SyncInfosSerializer(config, data_name)
-    return serializer.serialize(sync_infos)
+    return SyncHistory(config._ensure_log_dir(), data_name).append(sync_infos)
 
 
 def read_sync_infos(config: Config, data_name: str):
-    serializer = SyncInfosSerializer(config, data_name)
-    sync_infos = serializer.deserialize()
-    return sync_infos if sync_infos else []
+    return SyncHistory(config._ensure_log_dir(), data_name).latest()
+
+
+def read_sync_history(
+    config: Config,
+    data_name: str,
+    since: datetime.datetime = None,
+    until: datetime.datetime = None,
+    sync_name: str = None,
+):
+    return SyncHistory(config._ensure_log_dir(), data_name).query(since, until, sync_name)
 
 
 # Helpers
@@ -1,46 +1,81 @@
 import logging
 from typing import Dict
 
-from abackup.appcron import AppCronTab
-from abackup.sync import DataDir
+from abackup.appcron import AppCronTab, AppJob
+from abackup.sync import DataDir, ResticRepository
 
 
-def add_command_to_cron(name: str, data_dir: DataDir, absync_options: str, cron: AppCronTab, log: logging.Logger):
-    do_write_cron = True
+def auto_sync_jobs(name: str, data_dir: DataDir, absync_options: str, log: logging.Logger):
+    """The jobs of the auto_sync settings of the owned_data or stored_data name"""
+    jobs = []
     log.info(name)
     if not data_dir.auto_sync:
         log.info("skipping {}, no auto_sync settings defined".format(name))
-    else:
-        for auto_sync in data_dir.auto_sync:
-            healthchecks_option = "--healthchecks" if auto_sync.healthchecks else ""
-            command = "absync {} auto --sync-type auto --data-name {} --sync-name {} --notify {} {}".format(
-                absync_options, name, auto_sync.sync_name, auto_sync.notify.value, healthchecks_option
-            )
-            comment = "{}".format(auto_sync.sync_name)
-            log.debug("command: {}, comment: {}".format(command, comment))
-            job = cron.job(
-                command, comment, frequency=auto_sync.frequency if auto_sync.frequency else "0 0 * * *", project=name
-            )
-            if not job.is_valid():
-                log.error("job not valid! {}".format(comment))
-                do_write_cron = False
-    return do_write_cron
+        return jobs
+    for auto_sync in data_dir.auto_sync:
+        healthchecks_option = "--healthchecks" if auto_sync.healthchecks else ""
+        command = "absync {} auto --sync-type auto --data-name {} --sync-name {} --notify {} {}".format(
+            absync_options, name, auto_sync.sync_name, auto_sync.notify.value, healthchecks_option
+        )
+        comment = "{}".format(auto_sync.sync_name)
+        log.debug("command: {}, comment: {}".format(command, comment))
+        frequency = auto_sync.frequency if auto_sync.frequency else "0 0 * * *"
+        jobs.append(AppJob(command, "absync", comment, project=name, frequency=frequency))
+    return jobs
+
+
+def maintenance_jobs(repo_name: str, repo: ResticRepository, absync_options: str, log: logging.Logger):
+    """The job of the maintenance settings of the restic repository repo_name"""
+    log.info(repo_name)
+    if not repo.maintenance:
+        log.info("skipping {}, no maintenance settings defined".format(repo_name))
+        return []
+    healthchecks_option = "--healthchecks" if repo.maintenance.healthchecks else ""
+    command = "absync {} maintain --sync-type auto --repo-name {} --notify {} {}".format(
+        absync_options, repo_name, repo.maintenance.notify.value, healthchecks_option
+    )
+    comment = "maintenance"
+    log.debug("command: {}, comment: {}".format(command, comment))
+    frequency = repo.maintenance.frequency if repo.maintenance.frequency else "0 4 * * *"
+    return [AppJob(command, "absync", comment, project=repo_name, frequency=frequency)]
+
+
+def sync_jobs(
+    owned_data: Dict[str, DataDir],
+    stored_data: Dict[str, DataDir],
+    restic_repositories: Dict[str, ResticRepository],
+    absync_options: str,
+    log: logging.Logger,
+):
+    """The jobs of all auto_sync and maintenance settings"""
+    jobs = []
+    log.info("jobs for owned_data")
+    for name, data_dir in owned_data.items():
+        jobs.extend(auto_sync_jobs(name, data_dir, absync_options, log))
+    log.info("jobs for stored_data")
+    for name, data_dir in stored_data.items():
+        jobs.extend(auto_sync_jobs(name, data_dir, absync_options, log))
+    log.info("jobs for restic_repositories")
+    for repo_name, repo in restic_repositories.items():
+        jobs.extend(maintenance_jobs(repo_name, repo, absync_options, log))
+    return jobs
 
 
 def perform_update_cron(
     owned_data: Dict[str, DataDir],
     stored_data: Dict[str, DataDir],
+    restic_repositories: Dict[str, ResticRepository],
     absync_options: str,
     cron: AppCronTab,
     log: logging.Logger,
 ):
     do_write_cron = True
-    log.info("updating cron for owned_data")
-    for name, data_dir in owned_data.items():
-        do_write_cron = add_command_to_cron(name, data_dir, absync_options, cron, log) and do_write_cron
-    log.info("updating cron for stored_data")
-    for name, data_dir in stored_data.items():
-        do_write_cron = add_command_to_cron(name, data_dir, absync_options, cron, log) and do_write_cron
+    log.info("updating cron")
+    for app_job in sync_jobs(owned_data, stored_data, restic_repositories, absync_options, log):
+        job = cron.add(app_job)
+        if not job.is_valid():
+            log.error("job not valid! {}".format(app_job.comment))
+            do_write_cron = False
     if do_write_cron:
         cron.write()
         return True
@@ -0,0 +1,146 @@
+import os
+import subprocess
+import threading
+
+from typing import Any, Dict, List
+
+from abackup.fs import to_human_readable
+
+# ru_inblock and ru_oublock count 512 byte blocks
+BLOCK_SIZE = 512
+
+
+class CommandUsage:
+    """CPU time, peak memory and storage I/O of a process and the children it waited for
+
+    For a docker exec or ssh command this is the usage of the client, not of what it runs in the container or remotely.
+    The max RSS is at least the RSS of the forking process, Linux keeps the high water mark of the memory before exec.
+    """
+
+    def __init__(
+        self,
+        user_time: float = 0.0,
+        system_time: float = 0.0,
+        max_rss: int = 0,
+        read_bytes: int = 0,
+        write_bytes: int = 0,
+        count: int = 1,
+    ):
+        self.user_time = user_time
+        self.system_time = system_time
+        self.max_rss = max_rss
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+        # the number of processes summed up
+        self.count = count
+
+    def __str__(self):
+        return "CommandUsage: user:{:.2f}s, sys:{:.2f}s, max rss:{}, read:{}, written:{}".format(
+            self.user_time,
+            self.system_time,
+            to_human_readable(self.max_rss),
+            to_human_readable(self.read_bytes),
+            to_human_readable(self.write_bytes),
+        )
+
+    def __add__(self, other: "CommandUsage"):
+        return CommandUsage(
+            self.user_time + other.user_time,
+            self.system_time + other.system_time,
+            max(self.max_rss, other.max_rss),
+            self.read_bytes + other.read_bytes,
+            self.write_bytes + other.write_bytes,
+            self.count + other.count,
+        )
+
+    @property
+    def cpu_time(self):
+        return self.user_time + self.system_time
+
+    def to_dict(self):
+        return {
+            "user_time": self.user_time,
+            "system_time": self.system_time,
+            "max_rss": self.max_rss,
+            "read_bytes": self.read_bytes,
+            "write_bytes": self.write_bytes,
+            "count": self.count,
+        }
+
+    @classmethod
+    def from_dict(cls, usage_dict: Dict[str, Any]):
+        return cls(**usage_dict)
+
+
+def read_proc_io(pid: int, proc_root: str = "/proc"):
+    """The read_bytes and write_bytes of /proc/<pid>/io, the bytes fetched from and sent to storage, None if unreadable
+
+    Readable until the process is reaped, and only for processes of the same user.
+    """
+    try:
+        with open(os.path.join(proc_root, str(pid), "io"), "r") as io_file:
+            values = dict([line.split(":", 1) for line in io_file.read().splitlines() if ":" in line])
+        return int(values["read_bytes"]), int(values["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def run_with_usage(
+    args: List[str],
+    input: Any = None,
+    stdout: Any = None,
+    stderr: Any = None,
+    universal_newlines: bool = None,
+):
+    """subprocess.run without check or timeout that also sets the CommandUsage of the process as usage of the result
+
+    The CPU time and max RSS come from wait4, the I/O bytes from /proc/<pid>/io read before the process is reaped, or
+    from the block counts of wait4 when that cannot be read.
+    """
+    process = subprocess.Popen(
+        args,
+        stdin=subprocess.PIPE if input is not None else None,
+        stdout=stdout,
+        stderr=stderr,
+        universal_newlines=universal_newlines,
+    )
+    outputs = {}
+
+    def _write_input():
+        try:
+            process.stdin.write(input)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    def _read(name: str, pipe: Any):
+        outputs[name] = pipe.read()
+        pipe.close()
+
+    threads = []
+    if input is not None:
+        threads.append(threading.Thread(target=_write_input, daemon=True))
+    for name, pipe in [("stdout", process.stdout), ("stderr", process.stderr)]:
+        if pipe:
+            threads.append(threading.Thread(target=_read, args=(name, pipe), daemon=True))
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # wait without reaping, so /proc/<pid>/io is still there
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        io = read_proc_io(process.pid)
+        _, status, rusage = os.wait4(process.pid, 0)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    if io is None:
+        io = rusage.ru_inblock * BLOCK_SIZE, rusage.ru_oublock * BLOCK_SIZE
+    result = subprocess.CompletedProcess(args, process.returncode, outputs.get("stdout"), outputs.get("stderr"))
+    # ru_maxrss is in KiB on Linux
+    result.usage = CommandUsage(rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss * 1024, io[0], io[1])
+    return result
@@ -1,8 +1,13 @@
+import json
 import logging
+import os
 import re
 import subprocess
+import threading
 
-from abackup.fs import DriveStatus, FSStats, PoolState, PoolStatus
+from typing import Any, Dict, List
+
+from abackup.fs import DriveIo, DriveStatus, FSStats, PoolState, PoolStatus, ScrubProgress, to_human_readable
 
 
 def pool_stats(name: str, path: str, log: logging.Logger = None):
@@ -24,28 +29,47 @@ def pool_stats(name: str, path: str, log: logging.Logger = None):
     return FSStats(float(available) + float(used), float(available))
     
 
-def pool_status(name: str, path: str, log: logging.Logger = None):
-    run_out = subprocess.run(
-        ["zpool", "status", name], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
-    )
-    if run_out.returncode != 0 and not run_out.stdout:
+def dataset_used_by_mountpoint(log: logging.Logger = None):
+    try:
+        run_out = subprocess.run(
+            ["zfs", "list", "-Hp", "-o", "mountpoint,used"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+    except FileNotFoundError:
+        return {}
+    if run_out.returncode != 0:
         if log:
-            log.error("Failed to run 'zpool status'!")
-            log.error(run_out.stderr)
-        return None
-    zpool_output = run_out.stdout.split("\n")
+            log.debug("zfs.dataset_used_by_mountpoint(): 'zfs list' failed: {}".format(run_out.stderr))
+        return {}
+    used = {}
+    for line in run_out.stdout.split("\n"):
+        fields = line.split("\t")
+        if len(fields) == 2 and fields[0].startswith("/"):
+            used[fields[0]] = int(fields[1])
+    return used
 
-    def zfs_state_to_pool_state(z_state: str):
-        if z_state == "ONLINE":
-            return PoolState.HEALTHY
-        elif z_state == "DEGRADED":
-            return PoolState.DEGRADED
-        return PoolState.DOWN
 
-    if log:
-        log.debug("zfs.pool_status({}, {}): zpool_output:".format(name, path))
-        log.debug(zpool_output)
+def zfs_state_to_pool_state(z_state: str):
+    if z_state == "ONLINE":
+        return PoolState.HEALTHY
+    elif z_state == "DEGRADED":
+        return PoolState.DEGRADED
+    return PoolState.DOWN
+
+
+def parse_zfs_list(output: str):
+    """Parse 'zfs list -Hp -o name,available,used' into a dict of dataset name to FSStats"""
+    stats = {}
+    for line in output.split("\n"):
+        fields = line.split("\t")
+        if len(fields) == 3:
+            stats[fields[0]] = FSStats(float(fields[1]) + float(fields[2]), float(fields[1]))
+    return stats
 
+
+def _parse_zpool_status_section(name: str, lines: List[str], log: logging.Logger = None):
     state = None
     drive_status = []
     errors = None
@@ -53,40 +77,401 @@ def pool_status(name: str, path: str, log: logging.Logger = None):
     state_line_regex = re.compile(r"^\s*state:\s+(.*)\s*$")
     config_line_regex = re.compile(r"^\s+(\S+)\s+(\S+)\s+\d+\s+\d+\s+\d+\s*(.*)$")
     errors_line_regex = re.compile(r"^errors:\s+(.*)\s*$")
-    for line in zpool_output:
+    for line in lines:
         state_match = state_line_regex.match(line)
         config_match = config_line_regex.match(line)
         errors_match = errors_line_regex.match(line)
         if state_match:
             state = state_match.group(1)
             if log:
-                log.debug("zfs.pool_status({}, {}): state: {}".format(name, path, state))
+                log.debug("zfs.parse_zpool_status({}): state: {}".format(name, state))
             state = zfs_state_to_pool_state(state)
         if errors_match:
             errors = errors_match.group(1)
             if log:
-                log.debug("zfs.pool_status({}, {}): errors: {}".format(name, path, errors))
+                log.debug("zfs.parse_zpool_status({}): errors: {}".format(name, errors))
         if config_match:
             match_name = config_match.group(1)
             zfs_state = config_match.group(2)
             if log:
-                log.debug("zfs.pool_status({}, {}): drive name/state: {}/{}".format(name, path, match_name, zfs_state))
+                log.debug("zfs.parse_zpool_status({}): drive name/state: {}/{}".format(name, match_name, zfs_state))
             if config_match.group(3):
                 messages.append(config_match.group(3))
             if match_name != name and not match_name.startswith("mirror-") and not match_name.startswith("raidz"):
                 drive_status.append(DriveStatus(match_name, zfs_state_to_pool_state(zfs_state)))
 
-    if not state:
-        if log:
-            log.error("Failed to get zfs state for pool: {}".format(name))
-        state = PoolState.ERROR
-
     if errors:
         if not errors.startswith("No known data errors"):
             messages.append(errors)
+    return state, drive_status, messages
+
+
+def parse_zpool_status_text(output: str, log: logging.Logger = None):
+    """Parse the text output of 'zpool status -p' for any number of pools
+
+    Returns a dict of pool name to (PoolState or None, [DriveStatus], [message])
+    """
+    pool_line_regex = re.compile(r"^\s*pool:\s+(\S+)\s*$")
+    sections = {}
+    section = None
+    for line in output.split("\n"):
+        pool_match = pool_line_regex.match(line)
+        if pool_match:
+            section = sections.setdefault(pool_match.group(1), [])
+        elif section is not None:
+            section.append(line)
+    return {name: _parse_zpool_status_section(name, lines, log) for name, lines in sections.items()}
+
+
+def _json_vdev_drives(vdevs: Dict[str, Any]):
+    drive_status = []
+    for vdev in vdevs.values():
+        if "vdevs" in vdev and vdev["vdevs"]:
+            drive_status.extend(_json_vdev_drives(vdev["vdevs"]))
+        else:
+            drive_status.append(DriveStatus(vdev["name"], zfs_state_to_pool_state(vdev["state"])))
+    return drive_status
+
+
+def parse_zpool_status_json(output: str):
+    """Parse the output of 'zpool status -j -p' (OpenZFS 2.3+), same result as parse_zpool_status_text"""
+    pools = {}
+    for name, pool in json.loads(output)["pools"].items():
+        drive_status = []
+        for vdev_class in ["vdevs", "logs", "l2cache", "special", "dedup"]:
+            if vdev_class in pool:
+                root_vdevs = pool[vdev_class]
+                # the data vdevs are nested under a root vdev named after the pool
+                if name in root_vdevs and "vdevs" in root_vdevs[name]:
+                    root_vdevs = root_vdevs[name]["vdevs"]
+                drive_status.extend(_json_vdev_drives(root_vdevs))
+        messages = []
+        if "status" in pool and pool["status"]:
+            messages.append(pool["status"])
+        if "error_count" in pool and int(pool["error_count"]) != 0:
+            messages.append("{} data errors".format(pool["error_count"]))
+        pools[name] = (zfs_state_to_pool_state(pool["state"]), drive_status, messages)
+    return pools
+
+
+class ArcStats:
+    def __init__(self, hits: int, misses: int, size: int, target: int):
+        self.hits = hits
+        self.misses = misses
+        self.size = size
+        self.target = target
+
+    def __str__(self):
+        return "ARC: hit ratio {}, size {} of {}".format(
+            "{:.1%}".format(self.hit_ratio) if self.hit_ratio is not None else "-",
+            to_human_readable(self.size),
+            to_human_readable(self.target),
+        )
+
+    @property
+    def hit_ratio(self):
+        if not self.hits + self.misses:
+            return None
+        return self.hits / (self.hits + self.misses)
+
+    def since(self, before):
+        """The hits and misses since the ArcStats before, with the current size and target"""
+        return ArcStats(self.hits - before.hits, self.misses - before.misses, self.size, self.target)
+
+
+def parse_arcstats(output: str):
+    """Parse the kstat file /proc/spl/kstat/zfs/arcstats"""
+    values = {}
+    for line in output.split("\n")[2:]:
+        fields = line.split()
+        if len(fields) == 3 and fields[2].isdigit():
+            values[fields[0]] = int(fields[2])
+    return ArcStats(values["hits"], values["misses"], values["size"], values["c"])
+
+
+def read_arcstats(path: str = "/proc/spl/kstat/zfs/arcstats", log: logging.Logger = None):
+    try:
+        with open(path, "r") as arcstats_file:
+            return parse_arcstats(arcstats_file.read())
+    except (OSError, KeyError) as e:
+        if log:
+            log.warning("Failed to read ARC stats from {}: {}".format(path, e))
+        return None
+
+
+class ZfsMetrics:
+    def __init__(
+        self, fragmentation: int = None, capacity: int = None, dedup_ratio: float = None, arc: ArcStats = None
+    ):
+        # fragmentation and capacity in percent
+        self.fragmentation = fragmentation
+        self.capacity = capacity
+        self.dedup_ratio = dedup_ratio
+        self.arc = arc
+
+    def __str__(self):
+        return "ZfsMetrics: frag {}, cap {}, dedup {}, {}".format(
+            "{}%".format(self.fragmentation) if self.fragmentation is not None else "-",
+            "{}%".format(self.capacity) if self.capacity is not None else "-",
+            "{:.2f}x".format(self.dedup_ratio) if self.dedup_ratio is not None else "-",
+            self.arc if self.arc else "ARC: -",
+        )
+
+
+def parse_zpool_list_metrics(output: str):
+    """Parse 'zpool list -Hp -o name,frag,cap,dedupratio' into a dict of pool name to ZfsMetrics"""
+
+    def _number(field: str, cast):
+        field = field.strip().rstrip("%x")
+        return cast(field) if field and field != "-" else None
+
+    metrics = {}
+    for line in output.split("\n"):
+        fields = line.split("\t")
+        if len(fields) == 4:
+            metrics[fields[0]] = ZfsMetrics(_number(fields[1], int), _number(fields[2], int), _number(fields[3], float))
+    return metrics
+
 
-    stats = pool_stats(name, path, log)
+def parse_zpool_iostat(output: str):
+    """Parse the interval report of 'zpool iostat -Hpvl <pools> <interval> 2' into a dict of vdev name to DriveIo
 
-    return PoolStatus(
-        name, path, state, drive_status, stats.total_size, stats.used, "\n".join(messages) if messages else None
+    The first report has the averages since the pools were imported, only the second one is used.
+    """
+    lines = [line for line in output.split("\n") if line.strip()]
+    lines = lines[len(lines) // 2 :]
+
+    def _value(field: str):
+        return float(field) if field not in ["-", ""] else 0.0
+
+    drive_io = {}
+    for line in lines:
+        fields = line.split("\t")
+        if len(fields) < 7:
+            continue
+        read_iops, write_iops, read_bytes, write_bytes = [_value(field) for field in fields[3:7]]
+        latency_ms = None
+        # total_wait in ns with -l
+        if len(fields) >= 9 and read_iops + write_iops > 0:
+            latency_ms = (
+                (read_iops * _value(fields[7]) + write_iops * _value(fields[8])) / (read_iops + write_iops) / 1000000
+            )
+        drive_io[fields[0].strip()] = DriveIo(read_iops, write_iops, read_bytes, write_bytes, latency_ms)
+    return drive_io
+
+
+class ZfsCollector:
+    """Collects the status of all given pools with one 'zpool status' and one 'zfs list', cached for the run
+
+    With io_sample_seconds, one 'zpool iostat' over that interval gives the I/O of every drive.
+    """
+
+    def __init__(
+        self,
+        names: List[str],
+        log: logging.Logger = None,
+        timeout: float = None,
+        io_sample_seconds: float = None,
+        arcstats_path: str = "/proc/spl/kstat/zfs/arcstats",
+    ):
+        self.names = names
+        self.log = log
+        self.timeout = timeout
+        self.io_sample_seconds = io_sample_seconds
+        self.arcstats_path = arcstats_path
+        self._pools = None
+        self._stats = None
+        self._io = None
+        self._metrics = None
+        self._arc = None
+        self._lock = threading.Lock()
+
+    def _run(self, command_list: List[str]):
+        if self.log:
+            self.log.debug("ZfsCollector: {}".format(" ".join(command_list)))
+        return subprocess.run(
+            command_list,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=self.timeout,
+        )
+
+    def _collect(self):
+        self._pools = {}
+        self._stats = {}
+        self._io = {}
+        self._metrics = {}
+        self._arc = None
+        try:
+            self._collect_commands()
+        except subprocess.TimeoutExpired as e:
+            if self.log:
+                self.log.error("Timed out after {}s: {}".format(e.timeout, " ".join(e.cmd)))
+
+    def _collect_commands(self):
+        run_out = self._run(["zpool", "status", "-j", "-p"] + self.names)
+        if run_out.stdout.startswith("{"):
+            try:
+                self._pools = parse_zpool_status_json(run_out.stdout)
+            except (KeyError, TypeError, ValueError) as e:
+                if self.log:
+                    self.log.warning("Failed to parse 'zpool status -j' output, using text output: {}".format(e))
+        if not self._pools:
+            run_out = self._run(["zpool", "status", "-p"] + self.names)
+            if run_out.returncode != 0 and not run_out.stdout:
+                if self.log:
+                    self.log.error("Failed to run 'zpool status'!")
+                    self.log.error(run_out.stderr)
+            self._pools = parse_zpool_status_text(run_out.stdout, self.log)
+
+        run_out = self._run(["zfs", "list", "-Hp", "-o", "name,available,used"] + self.names)
+        if run_out.returncode != 0 and self.log:
+            self.log.error("Failed to run 'zfs list'!")
+            self.log.error(run_out.stderr)
+        self._stats = parse_zfs_list(run_out.stdout)
+
+        run_out = self._run(["zpool", "list", "-Hp", "-o", "name,frag,cap,dedupratio"] + self.names)
+        if run_out.returncode != 0 and self.log:
+            self.log.error("Failed to run 'zpool list'!")
+            self.log.error(run_out.stderr)
+        self._metrics = parse_zpool_list_metrics(run_out.stdout)
+
+        # the hit ratio since boot hardly moves, so use the one over the iostat interval when there is one
+        self._arc = read_arcstats(self.arcstats_path, self.log)
+        if self.io_sample_seconds:
+            interval = str(max(1, int(round(self.io_sample_seconds))))
+            run_out = self._run(["zpool", "iostat", "-Hpvl"] + self.names + [interval, "2"])
+            if run_out.returncode != 0 and self.log:
+                self.log.error("Failed to run 'zpool iostat'!")
+                self.log.error(run_out.stderr)
+            self._io = parse_zpool_iostat(run_out.stdout)
+            arc_after = read_arcstats(self.arcstats_path, self.log)
+            if self._arc and arc_after:
+                self._arc = arc_after.since(self._arc)
+
+    def pool_status(self, name: str, path: str):
+        # pools are checked concurrently, the first one collects for all of them
+        with self._lock:
+            if self._pools is None:
+                self._collect()
+        if self.log:
+            self.log.debug("ZfsCollector.pool_status({}, {})".format(name, path))
+
+        state, drive_status, messages = self._pools[name] if name in self._pools else (None, [], [])
+        for ds in drive_status:
+            ds.io = self._io[ds.drive] if ds.drive in self._io else None
+        if not state:
+            if self.log:
+                self.log.error("Failed to get zfs state for pool: {}".format(name))
+            state = PoolState.ERROR
+        stats = self._stats[name] if name in self._stats else None
+        if not stats:
+            # without the sizes the pool can not be reported as fine, nor recorded as 0% or 100% full
+            if self.log:
+                self.log.error("Failed to get zfs sizes for pool: {}".format(name))
+            state = PoolState.ERROR
+        metrics = self._metrics[name] if name in self._metrics else ZfsMetrics()
+        metrics.arc = self._arc
+        return PoolStatus(
+            name,
+            path,
+            state,
+            drive_status,
+            stats.total_size if stats else None,
+            stats.used if stats else None,
+            "\n".join(messages) if messages else None,
+            metrics=metrics,
+        )
+
+
+def pool_status(name: str, path: str, log: logging.Logger = None):
+    return ZfsCollector([name], log).pool_status(name, path)
+
+
+def parse_size(size: str):
+    """Parse a size printed by zpool, either exact bytes (with -p) or human readable like 1.29T"""
+    units = {"B": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40, "P": 1 << 50, "E": 1 << 60}
+    size = size.strip()
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(float(size))
+
+
+def parse_zpool_scan(output: str):
+    """Parse the scan section of 'zpool status -p' into a ScrubProgress"""
+    scan_line_regex = re.compile(r"^\s*scan:\s+(scrub|resilver) (in progress|paused|repaired|resilvered|canceled)")
+    finished_regex = re.compile(r"with (\d+) errors")
+    issued_regex = re.compile(r"(\S+)(?: / (\S+))? issued")
+    total_regex = re.compile(r"(\S+) total")
+    state = "idle"
+    done = None
+    total = None
+    errors = None
+    in_scan = False
+    for line in output.split("\n"):
+        scan_match = scan_line_regex.match(line)
+        if scan_match:
+            in_scan = True
+            kind, scan_state = scan_match.groups()
+            if scan_state == "in progress":
+                state = "running" if kind == "scrub" else "busy"
+            elif scan_state == "paused":
+                state = "paused"
+            finished_match = finished_regex.search(line)
+            if finished_match:
+                errors = int(finished_match.group(1))
+            continue
+        if in_scan:
+            if not line.startswith("\t") and not line.startswith("    "):
+                break
+            issued_match = issued_regex.search(line)
+            if issued_match:
+                done = parse_size(issued_match.group(1))
+                if issued_match.group(2):
+                    total = parse_size(issued_match.group(2))
+            total_match = total_regex.search(line)
+            if total_match:
+                total = parse_size(total_match.group(1))
+    return ScrubProgress(state, done, total, errors)
+
+
+def scrub_progress(name: str, log: logging.Logger = None):
+    run_out = subprocess.run(
+        ["zpool", "status", "-p", name], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+    )
+    if run_out.returncode != 0:
+        if log:
+            log.error("Failed to run 'zpool status'!")
+            log.error(run_out.stderr)
+        return None
+    return parse_zpool_scan(run_out.stdout)
+
+
+def scrub(name: str, log: logging.Logger = None, pause: bool = False):
+    """Start or resume a scrub of pool name, or pause it"""
+    command_list = ["zpool", "scrub"] + (["-p"] if pause else []) + [name]
+    if log:
+        log.info(" ".join(command_list))
+    run_out = subprocess.run(command_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if run_out.returncode != 0:
+        if log:
+            log.error("Failed to run '{}'!".format(" ".join(command_list)))
+            log.error(run_out.stderr)
+        return False
+    return True
+
+
+def pool_devices(name: str, log: logging.Logger = None):
+    """Kernel names of the devices of pool name, as used in /proc/diskstats"""
+    run_out = subprocess.run(
+        ["zpool", "status", "-P", "-L", name], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
     )
+    if run_out.returncode != 0:
+        if log:
+            log.error("Failed to run 'zpool status'!")
+            log.error(run_out.stderr)
+        return []
+    pools = parse_zpool_status_text(run_out.stdout)
+    _, drive_status, _ = pools[name] if name in pools else (None, [], [])
+    return [os.path.basename(ds.drive) for ds in drive_status if ds.drive.startswith("/")]
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Checks of the cron expressions abackup-scheduler runs the jobs at, against the times cron would run them at
+
+test/abdata/check_cron_schedule.py
+"""
+
+import datetime
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT_DIR, "lib"))
+
+from abackup.scheduler.cron import CronSchedule  # noqa: E402
+
+# a monday
+NOW = datetime.datetime(2026, 10, 19, 10, 7, 30)
+
+# expression, after, the next minute it fires at
+NEXT_AFTER = [
+    # steps and ranges
+    ("*/15 9-17 * * *", NOW, datetime.datetime(2026, 10, 19, 10, 15)),
+    ("*/15 9-17 * * *", datetime.datetime(2026, 10, 19, 17, 45), datetime.datetime(2026, 10, 20, 9, 0)),
+    ("5-10/5,50 * * * *", NOW, datetime.datetime(2026, 10, 19, 10, 10)),
+    ("5/20 * * * *", NOW, datetime.datetime(2026, 10, 19, 10, 25)),
+    ("0 0 */10 * *", NOW, datetime.datetime(2026, 10, 21, 0, 0)),
+    # month and weekday names
+    ("0 12 * jan-mar mon", NOW, datetime.datetime(2027, 1, 4, 12, 0)),
+    ("0 3 * * SAT,sun", NOW, datetime.datetime(2026, 10, 24, 3, 0)),
+    ("0 3 1 Feb *", NOW, datetime.datetime(2027, 2, 1, 3, 0)),
+    # 7 and 0 are sunday
+    ("30 2 * * 7", NOW, datetime.datetime(2026, 10, 25, 2, 30)),
+    ("30 2 * * 0", NOW, datetime.datetime(2026, 10, 25, 2, 30)),
+    ("30 2 * * 5-7", NOW, datetime.datetime(2026, 10, 23, 2, 30)),
+    # a restricted day of month and day of week fire on either
+    ("0 0 13 * fri", NOW, datetime.datetime(2026, 10, 23, 0, 0)),
+    ("0 0 20 * fri", NOW, datetime.datetime(2026, 10, 20, 0, 0)),
+    ("0 0 13 * *", NOW, datetime.datetime(2026, 11, 13, 0, 0)),
+    ("0 0 */2 * fri", NOW, datetime.datetime(2026, 10, 23, 0, 0)),
+    # shortcuts
+    ("@hourly", NOW, datetime.datetime(2026, 10, 19, 11, 0)),
+    ("@daily", NOW, datetime.datetime(2026, 10, 20, 0, 0)),
+    ("@weekly", NOW, datetime.datetime(2026, 10, 25, 0, 0)),
+    ("@monthly", NOW, datetime.datetime(2026, 11, 1, 0, 0)),
+    ("@yearly", NOW, datetime.datetime(2027, 1, 1, 0, 0)),
+    # the minute after, never the same one
+    ("7 10 * * *", NOW, datetime.datetime(2026, 10, 20, 10, 7)),
+    ("* * * * *", datetime.datetime(2026, 12, 31, 23, 59), datetime.datetime(2027, 1, 1, 0, 0)),
+    # a leap day is years apart, an impossible day never comes
+    ("0 0 29 2 *", NOW, datetime.datetime(2028, 2, 29, 0, 0)),
+    ("0 0 30 2 *", NOW, None),
+    ("0 0 31 4,6,9,11 *", NOW, None),
+]
+
+INVALID = ["0 0 * *", "0 0 * * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *", "* * * * 8", "*/0 * * * *"]
+
+
+def check(name: str, actual, expected, failed: list):
+    if actual != expected:
+        print("FAIL {}: expected {!r}, got {!r}".format(name, expected, actual))
+        failed.append(name)
+
+
+def main():
+    failed = []
+    for expression, after, expected in NEXT_AFTER:
+        schedule = CronSchedule(expression)
+        name = "{} after {}".format(expression, after)
+        check(name, schedule.next_after(after), expected, failed)
+        if expected:
+            check("{} matches {}".format(expression, expected), schedule.matches(expected), True, failed)
+
+    for expression in INVALID:
+        try:
+            CronSchedule(expression)
+            check("{} is invalid".format(expression), "accepted", "ValueError", failed)
+        except ValueError:
+            pass
+
+    if failed:
+        print("{} checks failed".format(len(failed)))
+        sys.exit(1)
+    print("All cron schedule checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Checks of the md scrub scheduling of abdata scrub on a fake /sys, without an md array
+
+The speed limit abdata pauses a check with must be lifted when the check ends while paused and when a recovery takes
+over the array, otherwise the recovery crawls at 1 KiB/s.
+
+    test/abdata/check_md_scrub.py
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT_DIR, "lib"))
+
+from abackup import mdadm  # noqa: E402
+from abackup.data import Config  # noqa: E402
+from abackup.data.scrub import ScrubRun, ScrubState, ScrubTarget, scrub_state_path, scrub_tick  # noqa: E402
+
+CONFIG = """drivers:
+  mdadm:
+    pools:
+      - name: md0
+        path: {path}
+        scrub:
+          window: "01:00-05:00"
+"""
+# outside of the window, so a paused check stays paused
+NOW = datetime.datetime(2026, 10, 19, 12, 0)
+
+
+def write_md(sysfs_root: str, values: dict):
+    md_path = os.path.join(sysfs_root, "block", "md0", "md")
+    os.makedirs(md_path, exist_ok=True)
+    for attribute, value in values.items():
+        with open(os.path.join(md_path, attribute), "w") as attribute_file:
+            attribute_file.write("{}\n".format(value))
+
+
+def read_md(sysfs_root: str, attribute: str):
+    with open(os.path.join(sysfs_root, "block", "md0", "md", attribute), "r") as attribute_file:
+        return attribute_file.read().strip()
+
+
+def tick_paused_check(work_dir: str, sync_action: str):
+    """Run scrub_tick on a check that abdata paused, after md moved on to sync_action"""
+    sysfs_root = os.path.join(work_dir, "sys")
+    config_path = os.path.join(work_dir, "data.yml")
+    with open(config_path, "w") as config_file:
+        config_file.write(CONFIG.format(path=work_dir))
+    config = Config(config_path, True, False)
+    pool = config.drivers["mdadm"].pools[0]
+
+    write_md(
+        sysfs_root,
+        {
+            "sync_action": "check",
+            "sync_completed": "1146101760 / 1953260928",
+            "sync_speed": "0",
+            "mismatch_cnt": "0",
+            # as the kernel shows the limit abdata paused the check with
+            "sync_speed_max": "{} (local)".format(mdadm.PAUSED_SYNC_SPEED),
+        },
+    )
+    started = NOW - datetime.timedelta(hours=10)
+    state = ScrubState(scrub_state_path(config, pool.name), ScrubRun(started.timestamp()))
+    state.current.pause((NOW - datetime.timedelta(hours=7)).timestamp(), "window")
+    state.save()
+
+    write_md(sysfs_root, {"sync_action": sync_action})
+    success = scrub_tick(config, ScrubTarget("mdadm", pool, config.log, sysfs_root), config.log, NOW)
+    return success, read_md(sysfs_root, "sync_speed_max"), ScrubState.load(state.path)
+
+
+def check(name: str, actual, expected, failed: list):
+    if actual != expected:
+        print("FAIL {}: expected {!r}, got {!r}".format(name, expected, actual))
+        failed.append(name)
+
+
+def main():
+    failed = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        success, speed_max, state = tick_paused_check(work_dir, "check")
+        check("still paused: tick", success, True, failed)
+        check("still paused: sync_speed_max", speed_max, "1 (local)", failed)
+        check("still paused: pause reason", state.current.pause_reason if state.current else None, "window", failed)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        success, speed_max, state = tick_paused_check(work_dir, "idle")
+        check("ended while paused: tick", success, True, failed)
+        check("ended while paused: sync_speed_max", speed_max, "system", failed)
+        check("ended while paused: run finished", state.current is None and len(state.history), 1, failed)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        success, speed_max, state = tick_paused_check(work_dir, "recover")
+        check("recovery while paused: tick", success, True, failed)
+        check("recovery while paused: sync_speed_max", speed_max, "system", failed)
+        check("recovery while paused: pause reason", state.current.pause_reason if state.current else "-", None, failed)
+
+    if failed:
+        print("{} checks failed".format(len(failed)))
+        sys.exit(1)
+    print("All md scrub checks passed")
+
+
+if __name__ == "__main__":
+    main()
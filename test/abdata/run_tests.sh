@@ -29,6 +29,20 @@ function finalize() {
 }
 
 
+echo "################################################"
+echo "    md scrub on a fake /sys"
+echo
+"$(dirname "$0")/check_md_scrub.py" || die 'md scrub checks failed!' $?
+echo
+
+
+echo "################################################"
+echo "    cron schedules of abackup-scheduler"
+echo
+"$(dirname "$0")/check_cron_schedule.py" || die 'cron schedule checks failed!' $?
+echo
+
+
 echo "################################################"
 echo "    update-cron"
 echo
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Backup pipeline benchmark, with shims/docker standing in for docker and the databases
+
+Measures database dumps with and without compression, directory tars staged in each --staging-dir and a whole
+perform_backup of a container with both, for synthetic data of every --entropy.
+
+    test/bench/bench_backup.py --size 256 --output before.json
+    test/bench/bench_backup.py --size 256 --output after.json --compare before.json
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+
+import click
+
+from benchlib import SHIMS_DIR, load_results, measure, median_result, print_comparison, print_results, save_results
+
+from abackup import notifications
+from abackup.backup import Config
+from abackup.backup.backup import perform_backup
+from abackup.backup.project import Container
+from abackup.docker import (
+    BackupFileSettings,
+    DirectoryTarBackupCommand,
+    MysqlBackupCommand,
+    PostgresBackupCommand,
+    TarBackupSettings,
+)
+
+CONTAINER = "bench"
+COLUMNS = [
+    "wall_seconds",
+    "throughput_mib_per_second",
+    "cpu_seconds",
+    "max_rss_bytes",
+    "write_bytes",
+    "output_bytes",
+    "compression_ratio",
+]
+
+
+def run_command(command, log: logging.Logger):
+    if not command.run(log):
+        raise RuntimeError("Benchmark command failed: {}".format(command))
+    return os.path.getsize(command.backup_file_path)
+
+
+def run_perform_backup(config: Config, backup_path: str, log: logging.Logger):
+    container = Container(
+        CONTAINER,
+        databases=[
+            {"name": "benchdb", "driver": "mysql", "password": "bench"},
+            {"name": "benchpg", "driver": "postgres", "user": "postgres"},
+        ],
+        directories=["/data/bench"],
+        backup={"version_count": 1},
+    )
+    if not perform_backup(config, "bench", [container], notifications.Mode.NEVER, log, do_healthchecks=False):
+        raise RuntimeError("Benchmark backup failed")
+    return sum([os.path.getsize(os.path.join(backup_path, name)) for name in os.listdir(backup_path)])
+
+
+def scenarios(config: Config, work_dir: str, backup_path: str, staging_dirs: list, log: logging.Logger):
+    """(name, input streams, staging dir, function returning the bytes of the backup files)"""
+    for use_compression in [True, False]:
+        settings = BackupFileSettings(True, use_compression=use_compression)
+        mode = "gzip" if use_compression else "raw"
+        yield "mysqldump {}".format(mode), 1, None, lambda s=settings: run_command(
+            MysqlBackupCommand("benchdb", "bench", backup_path, s, CONTAINER, []), log
+        )
+        yield "pg_dump {}".format(mode), 1, None, lambda s=settings: run_command(
+            PostgresBackupCommand("benchpg", backup_path, s, CONTAINER, [], "postgres"), log
+        )
+    for staging_dir in staging_dirs:
+        # tar stages its file in .abackup-tmp under the working directory before copying it to the backup path
+        staging_name = "the work dir" if staging_dir == work_dir else staging_dir
+        yield "tar staged in {}".format(staging_name), 1, staging_dir, lambda: run_command(
+            DirectoryTarBackupCommand("/data/bench", backup_path, TarBackupSettings(True), CONTAINER, []), log
+        )
+    yield "perform_backup", 3, None, lambda: run_perform_backup(config, backup_path, log)
+
+
+@click.command()
+@click.option("--size", type=int, default=64, help="MiB of every synthetic dump and tar, defaults to 64.")
+@click.option(
+    "--entropy",
+    type=float,
+    multiple=True,
+    default=[0.0, 0.5, 1.0],
+    help="Fraction of random bytes in the synthetic data, can be repeated. Defaults to 0, 0.5 and 1.",
+)
+@click.option("--runs", type=int, default=3, help="Runs of every scenario, the median is reported. Defaults to 3.")
+@click.option(
+    "--staging-dir",
+    type=click.Path(exists=True, file_okay=False),
+    multiple=True,
+    help="Directory to stage tars in, can be repeated. Defaults to the work directory and /dev/shm.",
+)
+@click.option("--work-dir", type=click.Path(file_okay=False), help="Directory for the backups, defaults to a temp dir.")
+@click.option("--output", type=click.Path(dir_okay=False), help="Save the results as JSON to this file.")
+@click.option("--compare", type=click.Path(exists=True, dir_okay=False), help="JSON results of a run to compare with.")
+def main(size: int, entropy: list, runs: int, staging_dir: list, work_dir: str, output: str, compare: str):
+    work_dir = os.path.abspath(work_dir if work_dir else tempfile.mkdtemp(prefix="abackup-bench-"))
+    os.makedirs(work_dir, exist_ok=True)
+    staging_dirs = [os.path.abspath(d) for d in staging_dir]
+    if not staging_dirs:
+        staging_dirs = [work_dir] + (["/dev/shm"] if os.path.isdir("/dev/shm") else [])
+    config_path = os.path.join(work_dir, "backup.yml")
+    with open(config_path, "w") as config_file:
+        config_file.write("backup_root: {}\n".format(os.path.join(work_dir, "backups")))
+    config = Config(config_path, False, False, "bench")
+    log = config.log
+    backup_path = config.get_backup_path("bench", CONTAINER)
+    os.environ["PATH"] = "{}:{}".format(SHIMS_DIR, os.environ["PATH"])
+    os.environ["ABACKUP_BENCH_BYTES"] = str(size * 1024 * 1024)
+    cwd = os.getcwd()
+
+    results = []
+    try:
+        for entropy_value in entropy:
+            os.environ["ABACKUP_BENCH_ENTROPY"] = str(entropy_value)
+            for name, streams, staging, fn in scenarios(config, work_dir, backup_path, staging_dirs, log):
+                scenario = "{}, entropy {}".format(name, entropy_value)
+                print("Running {}".format(scenario))
+                samples = []
+                for _ in range(runs):
+                    shutil.rmtree(backup_path, ignore_errors=True)
+                    config.ensure_backup_path("bench", CONTAINER)
+                    os.chdir(staging if staging else work_dir)
+                    output_bytes, sample = measure(fn)
+                    input_bytes = streams * size * 1024 * 1024
+                    sample["throughput_mib_per_second"] = input_bytes / 1024 / 1024 / sample["wall_seconds"]
+                    sample["output_bytes"] = output_bytes
+                    sample["compression_ratio"] = output_bytes / input_bytes
+                    samples.append(sample)
+                results.append(median_result(scenario, samples, size_mib=size, entropy=entropy_value))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(os.path.join(work_dir, "backups"), ignore_errors=True)
+        for staging in staging_dirs:
+            shutil.rmtree(os.path.join(staging, ".abackup-tmp"), ignore_errors=True)
+
+    print_results(results, COLUMNS)
+    if output:
+        save_results(output, "backup", {"size_mib": size, "entropy": list(entropy), "runs": runs}, results)
+    if compare:
+        print_comparison(load_results(compare), results, COLUMNS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""Microbenchmarks and checks of the parsers of rsync, zpool, zfs, restic, mdstat and md sysfs output
+
+Every parser is checked against the outputs in fixtures/, whose parsed results are in fixtures/expected.json, and
+timed on the fixtures and on synthetic outputs scaled to every --scale, e.g. files or drives, by the generators in
+synth.py. rsync is also timed on a log of --rsync-lines lines.
+
+    test/bench/bench_parsers.py --check
+    test/bench/bench_parsers.py --output before.json
+    test/bench/bench_parsers.py --output after.json --compare before.json
+    test/bench/bench_parsers.py --update-expected  # after an intended change of what a parser returns
+"""
+
+import json
+import locale
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from subprocess import CompletedProcess
+from typing import Any, Callable, List
+
+import click
+
+import synth
+from benchlib import BENCH_DIR, load_results, print_comparison, print_results, save_results
+
+from abackup import mdadm, zfs
+from abackup.mdadm import MdadmCollector
+from abackup.restic import BackupResult, ForgetResult, PruneResult
+from abackup.sync.rsync import parse_rsync_output
+
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+EXPECTED_PATH = os.path.join(FIXTURES_DIR, "expected.json")
+# /sys of the arrays in mdadm/mdstat, one paused check, one recovery and one idle array
+MD_SYSFS_DIR = os.path.join(FIXTURES_DIR, "mdadm", "sys")
+COLUMNS = [
+    "lines",
+    "rounds",
+    "min_us",
+    "median_us",
+    "mean_us",
+    "stddev_us",
+    "ops_per_second",
+    "lines_per_second",
+    "peak_bytes",
+]
+# a round runs the parser this many times over at least, so fast parsers are not measuring the timer
+MIN_ROUND_SECONDS = 0.001
+
+log = logging.getLogger("bench_parsers")
+
+
+class ParserCase:
+    """A parser, the fixtures it is checked on, how to summarize its result as JSON and how to scale its input
+
+    parse gets the text of the output, or the path of a file with it with reads_file, as the mdstat parser reads
+    /proc/mdstat itself.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        parse: Callable[[str], Any],
+        summarize: Callable[[Any], Any],
+        fixtures: List[str],
+        generate: Callable[[int], str] = None,
+        reads_file: bool = False,
+    ):
+        self.name = name
+        self.parse = parse
+        self.summarize = summarize
+        self.fixtures = fixtures
+        self.generate = generate
+        self.reads_file = reads_file
+
+
+def _completed(stdout: str):
+    return CompletedProcess([], 0, stdout, "")
+
+
+def _summarize_rsync(result):
+    sync_count, sync_deleted, sync_bytes, transferred_files, deleted_files = result
+    return {
+        "sync_count": sync_count,
+        "sync_deleted": sync_deleted,
+        "sync_bytes": sync_bytes,
+        "transferred_files": transferred_files,
+        "deleted_files": deleted_files,
+    }
+
+
+def _summarize_pools(pools):
+    return {
+        name: {
+            "state": state.name if state else None,
+            "drives": {ds.drive: ds.state.name for ds in drive_status},
+            "messages": messages,
+        }
+        for name, (state, drive_status, messages) in pools.items()
+    }
+
+
+def _summarize_fields(result):
+    if isinstance(result, dict):
+        return {key: _summarize_fields(value) for key, value in result.items()}
+    return {key: value for key, value in vars(result).items() if key not in ["stdout", "stderr"]}
+
+
+class _FixtureZfsCollector(zfs.ZfsCollector):
+    """A ZfsCollector reading the command outputs from the fixtures, with the zpool status of status_path
+
+    Without a JSON status, 'zpool status -j' fails as on OpenZFS before 2.3 and the collector falls back to the text.
+    """
+
+    def __init__(self, status_path: str):
+        super().__init__(["tank", "vault"], log, arcstats_path=os.path.join(FIXTURES_DIR, "zfs/arcstats"))
+        self.status_path = status_path
+
+    def _run(self, command_list: List[str]):
+        if command_list[:3] == ["zpool", "status", "-j"]:
+            if not self.status_path.endswith(".json"):
+                return CompletedProcess(command_list, 2, "", "invalid option 'j'")
+            path = self.status_path
+        elif command_list[:2] == ["zpool", "status"]:
+            path = self.status_path
+        else:
+            path = os.path.join(FIXTURES_DIR, "zfs", "{}.txt".format("-".join(command_list[:2])))
+        with open(path, "r") as output_file:
+            return CompletedProcess(command_list, 0, output_file.read(), "")
+
+
+def _zfs_pool_status(path: str):
+    collector = _FixtureZfsCollector(path)
+    return [collector.pool_status(name, "/{}".format(name)) for name in collector.names]
+
+
+def _summarize_zfs_pools(pool_statuses):
+    return {
+        ps.pool: {
+            "state": ps.state.name,
+            "drives": {ds.drive: ds.state.name for ds in ps.drive_status},
+            "total_size": ps.total_size,
+            "used": ps.used,
+            "message": ps.message,
+            "fragmentation": ps.metrics.fragmentation,
+            "capacity": ps.metrics.capacity,
+            "dedup_ratio": ps.metrics.dedup_ratio,
+            "arc_hit_ratio": ps.metrics.arc.hit_ratio if ps.metrics.arc else None,
+        }
+        for ps in pool_statuses
+    }
+
+
+def _md_pool_status(path: str, sysfs_root: str = os.path.join(FIXTURES_DIR, "no-sysfs")):
+    collector = MdadmCollector(mdstat_path=path, sysfs_root=sysfs_root)
+    with open(path, "r") as mdstat_file:
+        names = [line.split()[0] for line in mdstat_file if line.startswith("md")]
+    return [collector.pool_status(name, "/") for name in names]
+
+
+def _summarize_md_pools(pool_statuses):
+    return {
+        ps.pool: {
+            "state": ps.state.name,
+            "drives": {ds.drive: ds.state.name for ds in ps.drive_status},
+            "sync": _summarize_fields(ps.sync) if ps.sync else None,
+        }
+        for ps in pool_statuses
+    }
+
+
+def _md_sysfs_status(path: str):
+    statuses = _md_pool_status(path, MD_SYSFS_DIR)
+    return [(ps, mdadm.scrub_progress(ps.pool, MD_SYSFS_DIR)) for ps in statuses]
+
+
+def _summarize_md_sysfs(statuses):
+    pools = _summarize_md_pools([ps for ps, _ in statuses])
+    for ps, scrub_progress in statuses:
+        pools[ps.pool]["scrub"] = _summarize_fields(scrub_progress) if scrub_progress else None
+    return pools
+
+
+CASES = [
+    ParserCase(
+        "rsync push",
+        lambda text: parse_rsync_output(text, False),
+        _summarize_rsync,
+        ["rsync/push.txt", "rsync/unchanged.txt"],
+        lambda scale: synth.rsync_output(scale, False),
+    ),
+    ParserCase(
+        "rsync pull",
+        lambda text: parse_rsync_output(text, True),
+        _summarize_rsync,
+        ["rsync/pull.txt"],
+        lambda scale: synth.rsync_output(scale, True),
+    ),
+    ParserCase(
+        "zpool status",
+        zfs.parse_zpool_status_text,
+        _summarize_pools,
+        ["zfs/zpool-status.txt"],
+        synth.zpool_status_text_output,
+    ),
+    ParserCase(
+        "zpool status json",
+        zfs.parse_zpool_status_json,
+        _summarize_pools,
+        ["zfs/zpool-status.json"],
+        synth.zpool_status_json_output,
+    ),
+    ParserCase(
+        "zpool scan", zfs.parse_zpool_scan, _summarize_fields, ["zfs/zpool-status.txt", "zfs/zpool-status-scrub.txt"]
+    ),
+    ParserCase("zfs list", zfs.parse_zfs_list, _summarize_fields, ["zfs/zfs-list.txt"]),
+    ParserCase("zpool list", zfs.parse_zpool_list_metrics, _summarize_fields, ["zfs/zpool-list.txt"]),
+    ParserCase("zpool iostat", zfs.parse_zpool_iostat, _summarize_fields, ["zfs/zpool-iostat.txt"]),
+    ParserCase("arcstats", zfs.parse_arcstats, _summarize_fields, ["zfs/arcstats"]),
+    ParserCase(
+        "zfs collector",
+        _zfs_pool_status,
+        _summarize_zfs_pools,
+        ["zfs/zpool-status.json", "zfs/zpool-status.txt"],
+        reads_file=True,
+    ),
+    ParserCase(
+        "restic backup",
+        lambda text: BackupResult.from_output(_completed(text), log),
+        _summarize_fields,
+        ["restic/backup.jsonl"],
+        synth.restic_backup_output,
+    ),
+    ParserCase(
+        "restic forget",
+        lambda text: ForgetResult.from_output(_completed(text), log),
+        _summarize_fields,
+        ["restic/forget.json", "restic/forget-groups.json"],
+        synth.restic_forget_output,
+    ),
+    ParserCase(
+        "restic prune",
+        lambda text: PruneResult.from_output(_completed(text), log),
+        _summarize_fields,
+        ["restic/prune.txt"],
+        synth.restic_prune_output,
+    ),
+    ParserCase(
+        "mdadm pool_status",
+        _md_pool_status,
+        _summarize_md_pools,
+        ["mdadm/mdstat"],
+        synth.mdstat_output,
+        reads_file=True,
+    ),
+    ParserCase("mdadm sysfs", _md_sysfs_status, _summarize_md_sysfs, ["mdadm/mdstat"], reads_file=True),
+]
+
+
+def _normalize(summary: Any):
+    """The summary as it reads back from JSON, e.g. with lists for tuples"""
+    return json.loads(json.dumps(summary))
+
+
+def _input(case: ParserCase, path: str):
+    if case.reads_file:
+        return path
+    with open(path, "r") as fixture_file:
+        return fixture_file.read()
+
+
+def check(cases: List[ParserCase], expected: dict):
+    """The names of the fixtures whose parsed results differ from expected, printing the differences"""
+    failed = []
+    for case in cases:
+        for fixture in case.fixtures:
+            actual = _normalize(case.summarize(case.parse(_input(case, os.path.join(FIXTURES_DIR, fixture)))))
+            wanted = expected.get(case.name, {}).get(fixture)
+            if actual != wanted:
+                print("FAIL {} on {}".format(case.name, fixture))
+                print("  expected: {}".format(json.dumps(wanted, sort_keys=True)))
+                print("  actual:   {}".format(json.dumps(actual, sort_keys=True)))
+                failed.append("{} on {}".format(case.name, fixture))
+    return failed
+
+
+def write_expected(cases: List[ParserCase]):
+    expected = {
+        case.name: {
+            fixture: _normalize(case.summarize(case.parse(_input(case, os.path.join(FIXTURES_DIR, fixture)))))
+            for fixture in case.fixtures
+        }
+        for case in cases
+    }
+    with open(EXPECTED_PATH, "w") as expected_file:
+        json.dump(expected, expected_file, indent=2, sort_keys=True)
+        expected_file.write("\n")
+    print("Expected results written to {}".format(EXPECTED_PATH))
+
+
+def benchmark(parse: Callable[[str], Any], parser_input: str, min_rounds: int, min_time: float):
+    """pytest-benchmark like timing of parse(parser_input): rounds of calibrated iterations after a warmup, until there
+    are min_rounds rounds and min_time seconds, then a last run under tracemalloc for the peak of allocated memory
+    """
+    started = time.perf_counter()
+    parse(parser_input)
+    warmup = time.perf_counter() - started
+    iterations = max(1, int(MIN_ROUND_SECONDS / warmup)) if warmup > 0 else 1000
+
+    times = []
+    total = 0.0
+    while len(times) < min_rounds or total < min_time:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            parse(parser_input)
+        elapsed = time.perf_counter() - started
+        times.append(elapsed / iterations)
+        total += elapsed
+
+    tracemalloc.start()
+    parse(parser_input)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    mean = statistics.mean(times)
+    return {
+        "rounds": len(times),
+        "iterations": iterations,
+        "min_us": min(times) * 1000000,
+        "median_us": statistics.median(times) * 1000000,
+        "mean_us": mean * 1000000,
+        "stddev_us": statistics.stdev(times) * 1000000 if len(times) > 1 else 0.0,
+        "ops_per_second": 1 / mean,
+        "peak_bytes": peak,
+    }
+
+
+def inputs(case: ParserCase, scales: List[int], rsync_lines: int, work_dir: str):
+    """(name, input of the parser, lines) of the fixtures and the scaled outputs of case"""
+    for fixture in case.fixtures:
+        path = os.path.join(FIXTURES_DIR, fixture)
+        with open(path, "r") as fixture_file:
+            lines = len(fixture_file.read().splitlines())
+        yield fixture, _input(case, path), lines
+    if not case.generate:
+        return
+    case_scales = list(scales)
+    if case.name == "rsync push" and rsync_lines:
+        # a bit over one line per file
+        case_scales.append(int(rsync_lines / 1.11))
+    for scale in case_scales:
+        text = case.generate(scale)
+        parser_input = text
+        if case.reads_file:
+            parser_input = os.path.join(work_dir, "{}-{}".format(case.name.replace(" ", "-"), scale))
+            with open(parser_input, "w") as input_file:
+                input_file.write(text)
+        yield "synthetic {}".format(scale), parser_input, len(text.splitlines())
+
+
+@click.command()
+@click.option("--check", "check_only", flag_value=True, help="Only check the parsers against the fixtures.")
+@click.option("--update-expected", flag_value=True, help="Write the current results of the parsers as expected.")
+@click.option(
+    "--scale",
+    type=int,
+    multiple=True,
+    default=[1000, 100000],
+    help="Files, drives, snapshots, progress lines or arrays of the synthetic outputs, can be repeated. "
+    "Defaults to 1000 and 100000.",
+)
+@click.option(
+    "--rsync-lines", type=int, default=2000000, help="Lines of the long rsync log, 0 to skip. Defaults to 2000000."
+)
+@click.option("--parser", "parser_filter", help="Only run the parsers whose name contains this.")
+@click.option("--min-rounds", type=int, default=5, help="Rounds of every benchmark at least, defaults to 5.")
+@click.option("--min-time", type=float, default=0.5, help="Seconds of every benchmark at least, defaults to 0.5.")
+@click.option("--output", type=click.Path(dir_okay=False), help="Save the results as JSON to this file.")
+@click.option("--compare", type=click.Path(exists=True, dir_okay=False), help="JSON results of a run to compare with.")
+def main(
+    check_only: bool,
+    update_expected: bool,
+    scale: list,
+    rsync_lines: int,
+    parser_filter: str,
+    min_rounds: int,
+    min_time: float,
+    output: str,
+    compare: str,
+):
+    # as absync does, for the thousands separators in the rsync stats
+    locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
+    if update_expected:
+        write_expected(CASES)
+        return
+    cases = [case for case in CASES if not parser_filter or parser_filter in case.name]
+
+    with open(EXPECTED_PATH, "r") as expected_file:
+        expected = json.load(expected_file)
+    failed = check(cases, expected)
+    print("Checked {} parsers: {}".format(len(cases), "{} failed".format(len(failed)) if failed else "all passed"))
+    if check_only:
+        sys.exit(1 if failed else 0)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="abackup-bench-") as work_dir:
+        for case in cases:
+            for input_name, parser_input, lines in inputs(case, scale, rsync_lines, work_dir):
+                scenario = "{}, {}".format(case.name, input_name)
+                print("Running {}".format(scenario))
+                result = {"scenario": scenario, "lines": lines}
+                result.update(benchmark(case.parse, parser_input, min_rounds, min_time))
+                result["lines_per_second"] = lines / result["median_us"] * 1000000
+                results.append(result)
+
+    print_results(results, COLUMNS)
+    if output:
+        parameters = {"scale": list(scale), "rsync_lines": rsync_lines, "min_rounds": min_rounds, "min_time": min_time}
+        save_results(output, "parsers", parameters, results)
+    if compare:
+        print_comparison(load_results(compare), results, COLUMNS)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""Sync benchmark of do_rsync, do_auto_rsync and do_restic on synthetic trees, with shims/ssh standing in for ssh
+
+Syncs a tree of many small files and one of a few huge files to a local path and to a "remote" over the ssh shim, first
+into an empty destination, then unchanged and then after churning --churn of the files before every run. The same is
+backed up to a local restic repository when restic is installed. Needs rsync in PATH.
+
+    test/bench/bench_sync.py --output before.json
+    test/bench/bench_sync.py --output after.json --compare before.json
+"""
+
+import locale
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+import click
+
+import synth
+from benchlib import (
+    ROOT_DIR,
+    SHIMS_DIR,
+    load_results,
+    measure,
+    median_result,
+    print_comparison,
+    print_results,
+    save_results,
+)
+
+from abackup.sync import Config, ResticBackupCommand, ResticGlobalOptions
+from abackup.sync.restic import do_restic
+from abackup.sync.rsync import do_auto_rsync, do_rsync
+
+DATA_NAME = "bench"
+COLUMNS = [
+    "wall_seconds",
+    "python_cpu_seconds",
+    "cpu_seconds",
+    "max_rss_bytes",
+    "bytes_moved",
+    "files_moved",
+    "read_bytes",
+    "write_bytes",
+]
+
+
+def write_configs(work_dir: str, source: str, destination: str):
+    """The local sync.yml syncing the source to the remote and to the restic repository, and the sync.yml the remote
+    absync reads over the ssh shim to find the destination
+    """
+    remote_config_path = os.path.join(work_dir, "remote", "sync.yml")
+    os.makedirs(os.path.dirname(remote_config_path), exist_ok=True)
+    with open(remote_config_path, "w") as config_file:
+        config_file.write("stored_data:\n  {}:\n    path: {}\n".format(DATA_NAME, destination))
+
+    password_path = os.path.join(work_dir, "restic-password")
+    with open(password_path, "w") as password_file:
+        password_file.write("bench\n")
+    config_path = os.path.join(work_dir, "sync.yml")
+    with open(config_path, "w") as config_file:
+        config_file.write(
+            "\n".join(
+                [
+                    "owned_data:",
+                    "  {}:".format(DATA_NAME),
+                    # the trailing slash syncs the contents of the source into the destination
+                    "    path: {}/".format(source),
+                    "    auto_sync:",
+                    "      - sync_name: bench-rsync",
+                    "        driver:",
+                    "          type: rsync",
+                    "          settings:",
+                    "            remote_name: benchhost",
+                    "            options:",
+                    "              delete: True",
+                    "              max_delete: 0",
+                    "remotes:",
+                    "  benchhost:",
+                    "    host: benchhost",
+                    "restic_repositories:",
+                    "  bench:",
+                    "    password_provider:",
+                    "      type: file",
+                    "      arg: {}".format(password_path),
+                    "    backend:",
+                    "      type: local",
+                    "      path: {}".format(os.path.join(work_dir, "restic-repo")),
+                    "",
+                ]
+            )
+        )
+    return config_path, remote_config_path
+
+
+def rsync_result(info):
+    if not info:
+        raise RuntimeError("Benchmark sync failed")
+    return info.sync_bytes, info.sync_count + info.sync_deleted
+
+
+def restic_result(info):
+    if not info or "backup_info" not in info.transfer_info:
+        raise RuntimeError("Benchmark restic backup failed")
+    backup_info = info.transfer_info["backup_info"]
+    return backup_info["data_added"], backup_info["files_new"] + backup_info["files_changed"]
+
+
+def scenarios(
+    config: Config, remote_config_path: str, source: str, destination: str, churn: float, log: logging.Logger
+):
+    """(name, function preparing a run, function returning the bytes and files moved)"""
+    data_dir = config.owned_data[DATA_NAME]
+    auto_sync = data_dir.auto_sync[0]
+    remote = config.remotes["benchhost"]
+    rsync_options = data_dir.rsync_options.mask(auto_sync.driver.settings.options)
+    origin = data_dir.path
+
+    def _empty_destination():
+        shutil.rmtree(destination, ignore_errors=True)
+        os.makedirs(destination)
+
+    churn_seeds = iter(range(1, 1000000))
+
+    def _churn():
+        synth.churn(source, churn, next(churn_seeds))
+
+    transports = [("local", None, destination), ("ssh", remote, destination)]
+    for transport, transport_remote, transport_destination in transports:
+
+        def _sync(r=transport_remote, d=transport_destination):
+            return rsync_result(do_rsync(origin, d, rsync_options, log, "bench", "bench", r))
+
+        yield "do_rsync {} initial".format(transport), _empty_destination, _sync
+        yield "do_rsync {} unchanged".format(transport), None, _sync
+        yield "do_rsync {} churn".format(transport), _churn, _sync
+
+    # without --no-log, which would log to stdout along with the path
+    absync_options = "--config {}".format(remote_config_path)
+    yield "do_auto_rsync ssh churn", _churn, lambda: rsync_result(
+        do_auto_rsync(
+            config, DATA_NAME, data_dir, auto_sync, absync_options, "never", log, "bench", do_healthchecks=False
+        )
+    )
+
+    if not shutil.which("restic"):
+        print("restic is not installed, skipping the restic scenarios")
+        return
+    repo = config.restic_repositories["bench"]
+
+    def _backup():
+        return restic_result(
+            do_restic("bench", repo, ResticGlobalOptions.default(), [ResticBackupCommand()], DATA_NAME, source, log)
+        )
+
+    yield "do_restic initial", lambda: init_restic_repo(repo, log), _backup
+    yield "do_restic unchanged", None, _backup
+    yield "do_restic churn", _churn, _backup
+
+
+def init_restic_repo(repo, log: logging.Logger):
+    path = repo.backend.repo_string(log)
+    shutil.rmtree(path, ignore_errors=True)
+    subprocess.run(
+        ["restic", "-r", path, "--password-file", repo.password_provider.arg, "init"],
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+
+@click.command()
+@click.option("--small-files", type=int, default=20000, help="Files in the small files tree, defaults to 20000.")
+@click.option("--small-size", type=int, default=4, help="KiB of every small file, defaults to 4.")
+@click.option("--huge-files", type=int, default=2, help="Files in the huge files tree, defaults to 2.")
+@click.option("--huge-size", type=int, default=256, help="MiB of every huge file, defaults to 256.")
+@click.option("--entropy", type=float, default=0.5, help="Fraction of random bytes in the files, defaults to 0.5.")
+@click.option("--churn", type=float, default=0.1, help="Fraction of the files changed per churn run, defaults to 0.1.")
+@click.option("--runs", type=int, default=3, help="Runs of every scenario, the median is reported. Defaults to 3.")
+@click.option("--work-dir", type=click.Path(file_okay=False), help="Directory for the trees, defaults to a temp dir.")
+@click.option("--output", type=click.Path(dir_okay=False), help="Save the results as JSON to this file.")
+@click.option("--compare", type=click.Path(exists=True, dir_okay=False), help="JSON results of a run to compare with.")
+def main(
+    small_files: int,
+    small_size: int,
+    huge_files: int,
+    huge_size: int,
+    entropy: float,
+    churn: float,
+    runs: int,
+    work_dir: str,
+    output: str,
+    compare: str,
+):
+    if not shutil.which("rsync"):
+        raise click.ClickException("rsync is not installed")
+    # as absync does, for the thousands separators in the rsync stats
+    locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
+    work_dir = os.path.abspath(work_dir if work_dir else tempfile.mkdtemp(prefix="abackup-bench-"))
+    source = os.path.join(work_dir, "source")
+    destination = os.path.join(work_dir, "destination")
+    config_path, remote_config_path = write_configs(work_dir, source, destination)
+    config = Config(config_path, False, False)
+    log = config.log
+    # the remote absync runs from this tree over the ssh shim
+    os.environ["PATH"] = "{}:{}:{}".format(SHIMS_DIR, ROOT_DIR, os.environ["PATH"])
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        [os.path.join(ROOT_DIR, "lib")] + ([os.environ["PYTHONPATH"]] if os.environ.get("PYTHONPATH") else [])
+    )
+
+    trees = [
+        ("small files", small_files, small_size * 1024),
+        ("huge files", huge_files, huge_size * 1024 * 1024),
+    ]
+    results = []
+    try:
+        for tree_name, files, size in trees:
+            print("Writing {} files of {} bytes".format(files, size))
+            shutil.rmtree(source, ignore_errors=True)
+            synth.tree(source, files, size, entropy)
+            for name, prepare, fn in scenarios(config, remote_config_path, source, destination, churn, log):
+                scenario = "{}, {}".format(name, tree_name)
+                print("Running {}".format(scenario))
+                samples = []
+                for _ in range(runs):
+                    if prepare:
+                        prepare()
+                    (bytes_moved, files_moved), sample = measure(fn)
+                    sample["bytes_moved"] = bytes_moved
+                    sample["files_moved"] = files_moved
+                    samples.append(sample)
+                results.append(median_result(scenario, samples, files=files, file_size=size))
+    finally:
+        for path in [source, destination, os.path.join(work_dir, "restic-repo")]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    print_results(results, COLUMNS)
+    if output:
+        parameters = {
+            "small_files": small_files,
+            "small_size_kib": small_size,
+            "huge_files": huge_files,
+            "huge_size_mib": huge_size,
+            "entropy": entropy,
+            "churn": churn,
+            "runs": runs,
+        }
+        save_results(output, "sync", parameters, results)
+    if compare:
+        print_comparison(load_results(compare), results, COLUMNS)
+
+
+if __name__ == "__main__":
+    main()
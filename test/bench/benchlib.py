@@ -0,0 +1,119 @@
+"""Measuring, saving and comparing benchmark results, shared by the benchmarks in this directory
+
+A result is a dict of a "scenario" name and numbers, a results file is JSON with the results of one benchmark run and
+where it ran, so runs before and after a change can be compared with --compare.
+"""
+
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from typing import Any, Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(os.path.dirname(BENCH_DIR))
+SHIMS_DIR = os.path.join(BENCH_DIR, "shims")
+sys.path.insert(0, os.path.join(ROOT_DIR, "lib"))
+
+from tabulate import tabulate  # noqa: E402
+
+from abackup import spans  # noqa: E402
+
+
+def measure(fn: Callable, *args: Any, **kwargs: Any):
+    """Run fn, returning its result and a dict of the wall time, the CPU time of this process, e.g. for parsing the
+    output of the commands, and the summed up usage of the commands it ran
+    """
+    with spans.span("bench") as bench_span:
+        started = time.monotonic()
+        started_cpu = time.process_time()
+        ret = fn(*args, **kwargs)
+        python_cpu_seconds = time.process_time() - started_cpu
+        wall_seconds = time.monotonic() - started
+    usage = bench_span.usage
+    return ret, {
+        "wall_seconds": wall_seconds,
+        "python_cpu_seconds": python_cpu_seconds,
+        "cpu_seconds": usage.cpu_time if usage else 0.0,
+        "max_rss_bytes": usage.max_rss if usage else 0,
+        "read_bytes": usage.read_bytes if usage else 0,
+        "write_bytes": usage.write_bytes if usage else 0,
+        "commands": usage.count if usage else 0,
+    }
+
+
+def median_result(scenario: str, samples: List[Dict[str, float]], **params: Any):
+    """The medians of the numbers of several runs of a scenario"""
+    result = {"scenario": scenario, "runs": len(samples), **params}
+    for key in samples[0].keys():
+        result[key] = statistics.median([sample[key] for sample in samples])
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "-C", ROOT_DIR, "describe", "--always", "--dirty"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def save_results(path: str, benchmark: str, parameters: Dict[str, Any], results: List[Dict[str, Any]]):
+    with open(path, "w") as results_file:
+        json.dump(
+            {
+                "benchmark": benchmark,
+                "started": datetime.datetime.now().isoformat(),
+                "revision": git_revision(),
+                "host": platform.node(),
+                "python": platform.python_version(),
+                "parameters": parameters,
+                "results": results,
+            },
+            results_file,
+            indent=2,
+        )
+    print("Results saved to {}".format(path))
+
+
+def load_results(path: str):
+    with open(path, "r") as results_file:
+        return json.load(results_file)
+
+
+def _format(value: Any):
+    if isinstance(value, float):
+        return "{:.3f}".format(value)
+    return value
+
+
+def print_results(results: List[Dict[str, Any]], columns: List[str]):
+    print(tabulate([[r["scenario"]] + [_format(r.get(c)) for c in columns] for r in results], ["scenario"] + columns))
+
+
+def print_comparison(previous: Dict[str, Any], results: List[Dict[str, Any]], columns: List[str]):
+    """The change of every column of the scenarios in both runs, as a percentage of the previous value"""
+    previous_results = {r["scenario"]: r for r in previous["results"]}
+    rows = []
+    for result in results:
+        before = previous_results.get(result["scenario"])
+        if not before:
+            continue
+        row = [result["scenario"]]
+        for column in columns:
+            if before.get(column) and result.get(column) is not None:
+                row.append("{:+.1%}".format(result[column] / before[column] - 1))
+            else:
+                row.append("-")
+        rows.append(row)
+    print("Compared to {} of {}".format(previous.get("revision"), previous.get("started")))
+    print(tabulate(rows, ["scenario"] + columns))
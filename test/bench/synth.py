@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""Synthetic data for the benchmarks
+
+    synth.py stream SIZE ENTROPY [SEED]
+    synth.py tree ROOT FILES SIZE ENTROPY [SEED]
+    synth.py churn ROOT FRACTION [SEED]
+    synth.py output TOOL SCALE
+
+stream writes SIZE bytes to stdout, where ENTROPY is the fraction of random bytes, the rest is repeated SQL text. tree
+writes FILES files of SIZE such bytes under ROOT, and churn changes, deletes and adds FRACTION of the files under ROOT.
+output writes the output of TOOL, one of OUTPUTS, scaled to SCALE files, drives, snapshots, lines or arrays.
+"""
+
+import json
+import os
+import random
+import sys
+import zlib
+
+CHUNK_SIZE = 4096
+TEXT = b"INSERT INTO bench (id, name, comment) VALUES (42, 'lorem ipsum', 'dolor sit amet, consectetur');\n"
+
+
+def stream(out, size: int, entropy: float, seed: int = 0):
+    """Write size bytes of which a fraction entropy is random to the binary file out, the same bytes for the same seed"""
+    rng = random.Random(seed)
+    text = (TEXT * (CHUNK_SIZE // len(TEXT) + 1))[:CHUNK_SIZE]
+    random_size = int(CHUNK_SIZE * entropy)
+    written = 0
+    while written < size:
+        chunk = rng.randbytes(random_size) + text[random_size:]
+        chunk = chunk[: size - written]
+        out.write(chunk)
+        written += len(chunk)
+
+
+def write_file(path: str, size: int, entropy: float, seed: int = 0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as out:
+        stream(out, size, entropy, seed)
+
+
+def tree(root: str, files: int, size: int, entropy: float, seed: int = 0, files_per_dir: int = 100):
+    """Write files files of size bytes under root, files_per_dir of them in each directory, returning their paths"""
+    paths = []
+    for i in range(files):
+        path = os.path.join(root, "d{:04d}".format(i // files_per_dir), "f{:06d}.dat".format(i))
+        write_file(path, size, entropy, seed + i)
+        paths.append(path)
+    return paths
+
+
+def churn(root: str, fraction: float, seed: int = 0):
+    """Rewrite fraction of the files under root with new bytes of the same size, delete half as many and add half as
+    many new files next to them, returning the numbers of changed, deleted and added files
+    """
+    rng = random.Random(seed)
+    paths = sorted([os.path.join(d, name) for d, _, names in os.walk(root) for name in names])
+    count = max(int(len(paths) * fraction), 1 if paths and fraction > 0 else 0)
+    changed = rng.sample(paths, count)
+    for i, path in enumerate(changed):
+        write_file(path, os.path.getsize(path), 0.5, seed + 1000000 + i)
+    changed_set = set(changed)
+    deleted = rng.sample([path for path in paths if path not in changed_set], min(count // 2, len(paths) - count))
+    for path in deleted:
+        os.remove(path)
+    added = 0
+    for i, path in enumerate(changed[: count // 2]):
+        write_file("{}.new{}".format(path, seed), os.path.getsize(path), 0.5, seed + 2000000 + i)
+        added += 1
+    return len(changed), len(deleted), added
+
+
+#######################################################################################################################
+# Tool outputs, scaled up versions of the outputs in fixtures/
+#######################################################################################################################
+
+
+def _thousands(number: int):
+    return "{:,}".format(number)
+
+
+def rsync_output(files: int, pull: bool = False, files_per_dir: int = 100):
+    """The output of rsync -a --stats --info=del --info=name transferring files files and deleting a tenth as many"""
+    lines = ["receiving incremental file list" if pull else "sending incremental file list"]
+    deleted = files // 10
+    lines.extend(["deleting o1/old/f{:06d}.dat".format(i) for i in range(deleted)])
+    lines.append("o1/")
+    for i in range(files):
+        if i % files_per_dir == 0:
+            lines.append("o1/d{:04d}/".format(i // files_per_dir))
+        lines.append("o1/d{:04d}/f{:06d}.dat".format(i // files_per_dir, i))
+    size = files * 4096
+    sent, received = (files * 120, size) if pull else (size, files * 120)
+    lines.extend(
+        [
+            "",
+            "Number of files: {} (reg: {}, dir: {})".format(
+                _thousands(files + files // files_per_dir + 1),
+                _thousands(files),
+                _thousands(files // files_per_dir + 1),
+            ),
+            "Number of created files: {}".format(_thousands(files)),
+            "Number of deleted files: {}".format(_thousands(deleted)),
+            "Number of regular files transferred: {}".format(_thousands(files)),
+            "Total file size: {} bytes".format(_thousands(size)),
+            "Total transferred file size: {} bytes".format(_thousands(size)),
+            "Literal data: {} bytes".format(_thousands(size)),
+            "Matched data: 0 bytes",
+            "File list size: {}".format(_thousands(files * 30)),
+            "File list generation time: 0.001 seconds",
+            "File list transfer time: 0.000 seconds",
+            "Total bytes sent: {}".format(_thousands(sent)),
+            "Total bytes received: {}".format(_thousands(received)),
+            "",
+            "sent {} bytes  received {} bytes  {}.00 bytes/sec".format(
+                _thousands(sent), _thousands(received), _thousands(size // 10)
+            ),
+            "total size is {}  speedup is 1.00".format(_thousands(size)),
+            "",
+        ]
+    )
+    return "\n".join(lines)
+
+
+def _zpool_drives(drives: int, drives_per_vdev: int = 8):
+    """(vdev, [(drive, state)]) of drives drives in raidz2 vdevs, every 97th drive faulted"""
+    vdevs = []
+    for first in range(0, drives, drives_per_vdev):
+        vdev_drives = [
+            ("ata-BENCH_{:08d}".format(i), "FAULTED" if i % 97 == 96 else "ONLINE")
+            for i in range(first, min(first + drives_per_vdev, drives))
+        ]
+        vdevs.append(("raidz2-{}".format(first // drives_per_vdev), vdev_drives))
+    return vdevs
+
+
+def zpool_status_text_output(drives: int, pools: int = 2):
+    """The output of zpool status -p for pools pools of drives drives each"""
+    lines = []
+    for pool_index in range(pools):
+        name = "pool{}".format(pool_index)
+        vdevs = _zpool_drives(drives)
+        degraded = any(state != "ONLINE" for _, vdev_drives in vdevs for _, state in vdev_drives)
+        pool_state = "DEGRADED" if degraded else "ONLINE"
+        lines.extend(
+            [
+                "  pool: {}".format(name),
+                " state: {}".format(pool_state),
+                "  scan: scrub repaired 0B in 02:13:41 with 0 errors on Sun Oct 12 02:37:42 2026",
+                "config:",
+                "",
+                "\tNAME                       STATE     READ WRITE CKSUM",
+                "\t{:<26} {:<8}     0     0     0".format(name, pool_state),
+            ]
+        )
+        for vdev, vdev_drives in vdevs:
+            vdev_state = "DEGRADED" if any(state != "ONLINE" for _, state in vdev_drives) else "ONLINE"
+            lines.append("\t  {:<24} {:<8}     0     0     0".format(vdev, vdev_state))
+            for drive, state in vdev_drives:
+                lines.append("\t    {:<22} {:<8}     0     0     0".format(drive, state))
+        lines.extend(["", "errors: No known data errors", ""])
+    return "\n".join(lines)
+
+
+def zpool_status_json_output(drives: int, pools: int = 2):
+    """The output of zpool status -j -p for the same pools as zpool_status_text_output"""
+
+    def _vdev(name: str, vdev_type: str, state: str, children: list = None):
+        vdev = {
+            "name": name,
+            "vdev_type": vdev_type,
+            "guid": str(zlib.crc32(name.encode())),
+            "class": "normal",
+            "state": state,
+            "read_errors": "0",
+            "write_errors": "0",
+            "checksum_errors": "0",
+        }
+        if children is not None:
+            vdev["vdevs"] = {child["name"]: child for child in children}
+        return vdev
+
+    output = {"output_version": {"command": "zpool status", "vers_major": 0, "vers_minor": 1}, "pools": {}}
+    for pool_index in range(pools):
+        name = "pool{}".format(pool_index)
+        vdevs = [
+            _vdev(
+                vdev,
+                "raidz",
+                "DEGRADED" if any(state != "ONLINE" for _, state in vdev_drives) else "ONLINE",
+                [_vdev(drive, "disk", state) for drive, state in vdev_drives],
+            )
+            for vdev, vdev_drives in _zpool_drives(drives)
+        ]
+        pool_state = "DEGRADED" if any(vdev["state"] != "ONLINE" for vdev in vdevs) else "ONLINE"
+        output["pools"][name] = {
+            "name": name,
+            "state": pool_state,
+            "vdevs": {name: _vdev(name, "root", pool_state, vdevs)},
+            "error_count": "0",
+        }
+    return json.dumps(output)
+
+
+def restic_backup_output(files: int):
+    """The output of restic --verbose backup --json of files new files"""
+    lines = []
+    for i in range(files):
+        if i % 1000 == 0:
+            status = {"message_type": "status", "percent_done": i / files, "total_files": files, "files_done": i}
+            lines.append(json.dumps(status))
+        verbose_status = {
+            "message_type": "verbose_status",
+            "action": "new",
+            "item": "/data/o1/d{:04d}/f{:06d}.dat".format(i // 100, i),
+            "duration": 0.001,
+            "data_size": 4096,
+            "data_size_in_repo": 4120,
+            "metadata_size": 0,
+            "metadata_size_in_repo": 0,
+            "total_files": 1,
+        }
+        lines.append(json.dumps(verbose_status))
+    summary = {
+        "message_type": "summary",
+        "files_new": files,
+        "files_changed": 0,
+        "files_unmodified": 0,
+        "dirs_new": files // 100 + 1,
+        "dirs_changed": 0,
+        "dirs_unmodified": 0,
+        "data_blobs": files,
+        "tree_blobs": files // 100 + 1,
+        "data_added": files * 4120,
+        "total_files_processed": files,
+        "total_bytes_processed": files * 4096,
+        "total_duration": files / 1000,
+        "snapshot_id": "{:064x}".format(files),
+    }
+    lines.append(json.dumps(summary))
+    return "\n".join(lines) + "\n"
+
+
+def restic_forget_output(snapshots: int):
+    """The output of restic forget --json removing snapshots snapshots of one group"""
+
+    def _snapshot(i: int):
+        return {
+            "time": "2026-10-19T01:00:03.118224503+02:00",
+            "tree": "{:064x}".format(i),
+            "paths": ["/data/o1"],
+            "hostname": "vault",
+            "username": "root",
+            "tags": ["abackup", "o1"],
+            "id": "{:064x}".format(i + 1),
+            "short_id": "{:08x}".format(i + 1),
+        }
+
+    group = {
+        "tags": ["abackup", "o1"],
+        "host": "vault",
+        "paths": ["/data/o1"],
+        "keep": [_snapshot(i) for i in range(3)],
+        "remove": [_snapshot(i) for i in range(3, 3 + snapshots)],
+    }
+    return json.dumps([group]) + "\n"
+
+
+def restic_prune_output(progress_lines: int):
+    """The output of restic prune with progress_lines progress lines per step, as printed without a terminal"""
+    lines = ["loading indexes...", "loading all snapshots...", "finding data that is still in use for 42 snapshots"]
+    lines.extend(
+        [
+            "[0:{:02d}] {:.2f}%  {} / 8316 packs processed".format(i % 60, i * 100 / progress_lines, i)
+            for i in range(progress_lines)
+        ]
+    )
+    lines.extend(
+        [
+            "",
+            "to repack:          5123 blobs / 42.123 MiB",
+            "this removes:        234 blobs / 12.456 MiB",
+            "to delete:           456 blobs / 88.765 MiB",
+            "total prune:         690 blobs / 101.221 MiB",
+            "remaining:         98765 blobs / 120.456 GiB",
+            "unused size after prune: 5.987 GiB (4.97% of remaining size)",
+            "",
+            "repacking packs",
+        ]
+    )
+    lines.extend(
+        [
+            "[0:{:02d}] {:.2f}%  {} / 3 packs repacked".format(i % 60, i * 100 / progress_lines, i)
+            for i in range(progress_lines)
+        ]
+    )
+    lines.extend(["rebuilding index", "done", ""])
+    return "\n".join(lines)
+
+
+def mdstat_output(arrays: int):
+    """/proc/mdstat with arrays raid1 arrays, every 10th of them recovering"""
+    lines = ["Personalities : [raid1] [raid6] [raid5] [raid4] [linear] [multipath] [raid0] [raid10]"]
+    for i in range(arrays):
+        first, second = "disk{:04d}".format(2 * i), "disk{:04d}".format(2 * i + 1)
+        if i % 10 == 9:
+            lines.extend(
+                [
+                    "md{} : active raid1 {}[1] {}[0]".format(i, second, first),
+                    "      976630464 blocks super 1.2 [2/1] [U_]",
+                    "      [=>...................]  recovery =  8.5% (83013632/976630464) finish=92.2min speed=161331K/sec",
+                ]
+            )
+        else:
+            lines.extend(
+                [
+                    "md{} : active raid1 {}[1] {}[0]".format(i, second, first),
+                    "      976630464 blocks super 1.2 [2/2] [UU]",
+                ]
+            )
+        lines.extend(["      bitmap: 1/8 pages [4KB], 65536KB chunk", ""])
+    lines.extend(["unused devices: <none>", ""])
+    return "\n".join(lines)
+
+
+OUTPUTS = {
+    "rsync": rsync_output,
+    "zpool-status": zpool_status_text_output,
+    "zpool-status-json": zpool_status_json_output,
+    "restic-backup": restic_backup_output,
+    "restic-forget": restic_forget_output,
+    "restic-prune": restic_prune_output,
+    "mdstat": mdstat_output,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4 and sys.argv[1] == "stream":
+        stream(sys.stdout.buffer, int(sys.argv[2]), float(sys.argv[3]), int(sys.argv[4]) if len(sys.argv) > 4 else 0)
+    elif len(sys.argv) >= 6 and sys.argv[1] == "tree":
+        seed = int(sys.argv[6]) if len(sys.argv) > 6 else 0
+        tree(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), float(sys.argv[5]), seed)
+    elif len(sys.argv) >= 4 and sys.argv[1] == "churn":
+        print(
+            "changed {}, deleted {}, added {}".format(
+                *churn(sys.argv[2], float(sys.argv[3]), int(sys.argv[4]) if len(sys.argv) > 4 else 0)
+            )
+        )
+    elif len(sys.argv) >= 4 and sys.argv[1] == "output" and sys.argv[2] in OUTPUTS:
+        sys.stdout.write(OUTPUTS[sys.argv[2]](int(sys.argv[3])))
+    else:
+        print(__doc__, file=sys.stderr)
+        exit(2)